@@ -50,9 +50,6 @@ def txt2Reaches(txtFile, dict):
 
     labels = []
     numReaches = 0
-    pathForwardLength = 0.
-    pathBackwardLength = 0.
-    reachFrame = 0
 
     with open(txtFile, 'r') as f:
         lines = f.readlines()
@@ -109,38 +106,9 @@ def txt2Reaches(txtFile, dict):
 
         if i >= 5:
             if len(tempReach['speed_per_moment']) > 0:
-                maxSpeed = max(tempReach['speed_per_moment'])
-                tempReach['max_speed'] = maxSpeed
-                tempReach['max_speed_coordinates'] = tempReach['speed_per_moment'].index(maxSpeed)
-                minSpeed = min(tempReach['speed_per_moment'])
-                tempReach['min_speed'] = minSpeed
-                tempReach['min_speed_coordinates'] = tempReach['speed_per_moment'].index(minSpeed)
-                min_distance = float('inf')
-
-                for index in range(len(tempReach['path_paw'])):
-                    [x, y, z] = tempReach['path_paw'][index]
-                    temp_distance = x**2 + y**2 + z**2
-                    if temp_distance < min_distance:
-                        min_distance = temp_distance
-                        reachFrame = index
-
-                for index in range(len(tempReach['path_paw']) - 1):
-                    [x1, y1, z1] = tempReach['path_paw'][index]
-                    [x2, y2, z2] = tempReach['path_paw'][index + 1]
-                    distance = ((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2) ** 0.5
-                    if index < reachFrame:
-                        pathForwardLength += distance
-                    else:
-                        pathBackwardLength += distance
-
-                tempReach['reach_frame'] = reachFrame
-                tempReach['path_length_paw_forward'] = pathForwardLength
-                tempReach['path_length_paw_backward'] = pathBackwardLength
+                summarizeReach(tempReach)
                 dataList['reaches'].append(tempReach)
 
-                reachFrame = 0
-                pathForwardLength = 0.
-                pathBackwardLength = 0.
                 labels = []
                 i = 0
                 tempReach = {
@@ -159,6 +127,55 @@ def txt2Reaches(txtFile, dict):
                     'path_paw': [],
                 }
                 numReaches += 1
+
+    summarizeReaches(dataList, txtFile)
+    return dataList
+
+def summarizeReach(tempReach):
+    '''
+    Fills in the speed and path length features of one reach from its 'speed_per_moment' and 'path_paw'.
+    :param tempReach: a reach dictionary as built by txt2Reaches, with at least two points in 'path_paw'
+    :return: nothing
+    '''
+    reachFrame = 0
+    pathForwardLength = 0.
+    pathBackwardLength = 0.
+
+    maxSpeed = max(tempReach['speed_per_moment'])
+    tempReach['max_speed'] = maxSpeed
+    tempReach['max_speed_coordinates'] = tempReach['speed_per_moment'].index(maxSpeed)
+    minSpeed = min(tempReach['speed_per_moment'])
+    tempReach['min_speed'] = minSpeed
+    tempReach['min_speed_coordinates'] = tempReach['speed_per_moment'].index(minSpeed)
+    min_distance = float('inf')
+
+    for index in range(len(tempReach['path_paw'])):
+        [x, y, z] = tempReach['path_paw'][index]
+        temp_distance = x**2 + y**2 + z**2
+        if temp_distance < min_distance:
+            min_distance = temp_distance
+            reachFrame = index
+
+    for index in range(len(tempReach['path_paw']) - 1):
+        [x1, y1, z1] = tempReach['path_paw'][index]
+        [x2, y2, z2] = tempReach['path_paw'][index + 1]
+        distance = ((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2) ** 0.5
+        if index < reachFrame:
+            pathForwardLength += distance
+        else:
+            pathBackwardLength += distance
+
+    tempReach['reach_frame'] = reachFrame
+    tempReach['path_length_paw_forward'] = pathForwardLength
+    tempReach['path_length_paw_backward'] = pathBackwardLength
+
+def summarizeReaches(dataList, fileName):
+    '''
+    Fills in the global features of a data dictionary from its reaches.
+    :param dataList: the dictionary built by txt2Reaches or reaches2Data
+    :param fileName: the scored txt file the data belongs to
+    :return: nothing
+    '''
     maxSpeed = 0
     minSpeed = float('inf')
     maxId = 0
@@ -173,12 +190,64 @@ def txt2Reaches(txtFile, dict):
             minSpeed = dataList['reaches'][i]['min_speed']
             minId = dataList['reaches'][i]['id']
 
-    dataList['fileName'] = txtFile
+    dataList['fileName'] = fileName
     dataList['max_speed'] = maxSpeed
     dataList['max_speed_id'] = maxId
     dataList['min_speed'] = minSpeed
     dataList['min_speed_id'] = minId
 
+def reaches2Data(reaches, txtFile, dict):
+    '''
+    Builds the same dictionary as txt2Reaches, from reaches that are already in memory instead of a txt file.
+    :param reaches: a list of (start frame, end frame, label, trajectory lines) for each reach, where the trajectory
+    lines are the "x,y,z" lines of the reach in the txt file
+    :param txtFile: file name of the txt file the reaches are (or will be) saved in
+    :param dict: a dict holding all the labels
+    :return:
+    A dictionary contains some global features and the details for each reach.
+    '''
+    none = 'Valid'
+    dataList = {
+                'fileName': none,
+                'max_speed': none,
+                'max_speed_id': none,
+                'min_speed': none,
+                'min_speed_id': none,
+                'reaches': []
+                }
+
+    for start, stop, label, trajectoryLines in reaches:
+        tempReach = {
+            'id': len(dataList['reaches']),
+            'start_frame': start,
+            'end_frame': stop,
+            'label': label.strip() if label.strip() in dict.keys() else none,
+            'max_speed': none,
+            'max_speed_coordinates': none,
+            'min_speed': none,
+            'min_speed_coordinates': none,
+            'path_length_paw_forward': none,
+            'path_length_paw_backward': none,
+            'reach_frame': none,
+            'speed_per_moment': [],
+            'path_paw': [],
+        }
+        for line in trajectoryLines:
+            listLine = line.replace('\n', '').split(',')
+            if len(listLine) > 1:
+                [x1, y1, z1] = [float(listLine[0]), float(listLine[1]), float(listLine[2])]
+                if len(tempReach['path_paw']) > 0:
+                    [x2, y2, z2] = tempReach['path_paw'][-1]
+                    distance = ((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2) ** 0.5
+                    tempReach['speed_per_moment'].append(distance * 40.)
+                tempReach['path_paw'].append([x1, y1, z1])
+
+        # txt2Reaches drops reaches with less than two points too.
+        if len(tempReach['speed_per_moment']) > 0:
+            summarizeReach(tempReach)
+            dataList['reaches'].append(tempReach)
+
+    summarizeReaches(dataList, txtFile)
     return dataList
 
 def write2CSV(data, targetDir):
@@ -271,6 +340,20 @@ def runOneFile(txtFile, dict):
     targetFile = txtFile.replace('_reaches_scored', '_analysed').replace('txt', 'csv')
     write2CSV_new(data, targetFile)
 
+def runReaches(reaches, txtFile, dict):
+
+    '''
+    Same as runOneFile, for reaches that are already in memory (see reaches2Data) so the txt file isn't read back.
+    The csv file is written next to <txtFile>.
+
+    :param dict: a dict holding all the labels
+    :return: nothing
+    '''
+
+    data = reaches2Data(reaches, txtFile, dict)
+    targetFile = txtFile.replace('_reaches_scored', '_analysed').replace('txt', 'csv')
+    write2CSV_new(data, targetFile)
+
 
 
 
@@ -15,6 +15,8 @@
 #   After the DLC analysis finishes for a given video, kinalyze.py is run on the video and corresponding h5 output
 #   to isolate all the reaches that happened in that video and generate 3D trajectory reconstructions for each reach.
 #   It saves all the reaching data for each video into a text file specific to that video.
+#   pelletTimeline.py then records when the pellet was on the platform in the video and matches it up with the
+#   reaches. This has to happen here, while the video is still the uncut recording the reach frame indexes refer to.
 #
 # 3. remakeVideo.py is then called, which uses the text file generated by kinalyze.py to cut out all frames
 #    from the video that are not within the frame index bounds of a reaching event. It concatenates all the
@@ -27,8 +29,8 @@
 # 5. All the data generated for the current video is then packaged into a folder called
 #    <HomeCageSinglePellet/AnimalProfiles/<animal_name>/Analyses/<video_name>/
 #    This directory contains the video file (cut to eliminate garbage video), the raw h5 deeplabcut output,
-#    and a file containing the reach trajectory reconstruction vectors, frame start/stop indexes
-#    and trial outcome for every reach in that video.
+#    a file containing the reach trajectory reconstruction vectors, frame start/stop indexes
+#    and trial outcome for every reach in that video, and the pellet timeline.
 #
 # 6. Repeat for each video found.
 #
@@ -50,7 +52,8 @@ do
 
 	source activate HCSP
 	videoExtensionRemoved=${video::-4}
-	python kinalyze.py $video $videoExtensionRemoved$NETWORK_NAME.h5 $videoExtensionRemoved"_reaches.txt" 0 0 0 1 0 
+	python kinalyze.py $video $videoExtensionRemoved$NETWORK_NAME.h5 --output $videoExtensionRemoved"_reaches.txt"
+	python pelletTimeline.py $video
 
     # franks stuff
     python remakeVideo.py
@@ -60,6 +63,15 @@ do
 	mv $videoExtensionRemoved$NETWORK_NAME.h5 $VIDEO_DIRECTORY"../Temp/"
 	mv $videoExtensionRemoved$NETWORK_NAME.csv $VIDEO_DIRECTORY"../Temp/"
 	mv $videoExtensionRemoved"_reaches.txt" $VIDEO_DIRECTORY"../Temp/"
+	if [ -f $videoExtensionRemoved"_reaches_pellet_alignment.csv" ]; then
+		mv $videoExtensionRemoved"_reaches_pellet_alignment.csv" $VIDEO_DIRECTORY"../Temp/"
+	fi
+	if [ -f $videoExtensionRemoved"_pellet_timeline.json" ]; then
+		mv $videoExtensionRemoved"_pellet_timeline.json" $VIDEO_DIRECTORY"../Temp/"
+	fi
+	if [ -f $videoExtensionRemoved"_pellet_reaches.csv" ]; then
+		mv $videoExtensionRemoved"_pellet_reaches.csv" $VIDEO_DIRECTORY"../Temp/"
+	fi
 	rm $VIDEO_DIRECTORY*".pickle"
 
 	cd $VIDEO_DIRECTORY"../Temp/"
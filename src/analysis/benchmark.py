@@ -0,0 +1,389 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import argparse
+import json
+import os
+import platform
+import resource
+import runpy
+import shutil
+import subprocess
+import sys
+import time
+
+
+"""
+    Benchmark suite for the analysis pipeline. It generates synthetic DeepLabCut output (.h5, same 24 bodypart layout
+    kinalyze.py expects) and a matching synthetic video for each requested session length, then times every stage of
+    the pipeline on them:
+
+        kinalyze                Full kinalyze.py run, as analyze_videos.sh runs it.
+        kinalyze_load           Opening the video, reading the h5 and writing its CSV copy.
+        kinalyze_filter         filter_trajectory_points()
+        kinalyze_segment        extractEvents()
+        kinalyze_reconstruct    3D reconstruction of every reach.
+        scoreTrials_load        Parsing the reaches file the way the scoring GUI does.
+        analysis_runTest        analysis.runTest() on the scored reaches.
+        remakeVideo             remakeVideo.constructRawDataSet()
+
+    Each stage runs in a fresh process (from a throwaway HomeCageSinglePellet-like directory tree, since the scripts
+    use paths relative to src/analysis/) so the peak RSS reported for it is its own. The kinalyze_* sub-stages share
+    one process, their peak RSS is sampled with instrumentation.MemorySampler, reset between them (so it's the peak
+    while the sub-stage ran, including whatever the earlier ones left in memory). Throughput is reported as frames
+    per second: video/h5 frames for the kinalyze and remakeVideo stages, reach trajectory frames for the others.
+
+    Results are written as JSON. Pass --compare with an older results file to see the change per stage.
+
+    Usage:
+        python benchmark.py --minutes 1 10 60 --output results.json [--compare old_results.json]
+"""
+
+
+ANALYSIS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+SCORER = "DLC_benchmark"
+BODYPARTS = (["leftMirrorPaw" + str(i) for i in range(1, 6)] + ["centerPaw" + str(i) for i in range(1, 6)] +
+             ["rightMirrorPaw" + str(i) for i in range(1, 6)] +
+             ["leftMirrorPellet", "centerPellet", "rightMirrorPellet"] + ["face" + str(i) for i in range(1, 7)])
+
+# Calibration used for the synthetic data. The zones (LEFTSIDE / RIGHTSIDE) match where the synthetic points are put.
+CALIBRATION = [400, 820, 10.0, 10.0, 10.0, 10.0, 10.0, 10.0, 8.0, 8.0, 8.0, 8.0, 8.0, 8.0, 250, 300, 610, 250, 250, 300]
+
+LABELS = ["SUCCESS_1_LEFT", "ATTEMPT_1_LEFT", "DROP_LEFT", "KNOCK_LEFT", "INVALID_LEFT"]
+LABEL_DICT = {"SUCCESS_1_LEFT": 0, "ATTEMPT_1_LEFT": 3, "DROP_LEFT": 6, "KNOCK_LEFT": 7, "INVALID_LEFT": 10}
+
+STAGES = ["kinalyze", "kinalyze_stages", "scoreTrials_load", "analysis_runTest", "remakeVideo"]
+
+
+# Generates <nFrames> rows of DeepLabCut output. Likelihoods are low except during synthetic reaches
+# (<reachesPerMinute> of them, 60-150 frames each), during which the paw points are confidently placed in the
+# zone kinalyze expects them in, with the odd dropped frame.
+def generate_h5(path, nFrames, fps, reachesPerMinute, seed):
+
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.RandomState(seed)
+    nParts = len(BODYPARTS)
+    data = np.empty((nFrames, nParts * 3))
+    leftSide, rightSide = CALIBRATION[0], CALIBRATION[1]
+
+    # x ranges per bodypart so points land in the right zone.
+    xRanges = ([(50, leftSide - 50)] * 5 + [(leftSide + 50, rightSide - 50)] * 5 + [(rightSide + 50, 1170)] * 5 +
+               [(50, leftSide - 50), (leftSide + 50, rightSide - 50), (rightSide + 50, 1170)] +
+               [(leftSide + 50, rightSide - 50)] * 6)
+    for part, (low, high) in enumerate(xRanges):
+        data[:, part * 3] = rng.uniform(low, high, nFrames)
+        data[:, part * 3 + 1] = rng.uniform(50, 450, nFrames)
+        data[:, part * 3 + 2] = rng.uniform(0.0, 0.3, nFrames)
+
+    nReaches = max(1, int(reachesPerMinute * nFrames / (fps * 60.0)))
+    starts = np.sort(rng.choice(np.arange(200, max(201, nFrames - 400)), nReaches, replace=False))
+    for start in starts:
+        stop = min(nFrames, start + rng.randint(60, 150))
+        confident = rng.uniform(0.7, 1.0, (stop - start, 15))
+        confident[rng.uniform(size=confident.shape) < 0.1] = 0.1
+        data[start:stop, 2:45:3] = confident
+
+    columns = pd.MultiIndex.from_product([[SCORER], BODYPARTS, ["x", "y", "likelihood"]],
+                                         names=["scorer", "bodyparts", "coords"])
+    pd.DataFrame(data, columns=columns).to_hdf(path, "df_with_missing", format="table", mode="w")
+    return nReaches
+
+
+# Writes a <nFrames> frame video. A handful of distinct frames are generated up front and cycled, so generation
+# is bounded by encoding speed.
+def generate_video(path, nFrames, fps, width, height, seed):
+
+    import cv2
+    import numpy as np
+
+    rng = np.random.RandomState(seed)
+    frames = []
+    for i in range(16):
+        frame = rng.randint(0, 64, (height, width, 3)).astype(np.uint8)
+        cv2.circle(frame, (int(width * (i + 1) / 17.0), height // 2), height // 10, (255, 255, 255), -1)
+        frames.append(frame)
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    for i in range(nFrames):
+        writer.write(frames[i % len(frames)])
+    writer.release()
+
+
+# Builds the directory layout the analysis scripts expect (they all use paths relative to src/analysis/) and
+# returns (working directory, video path, h5 path, reaches path) for the run.
+def setup_run_tree(runDirectory, videoName, videoSource, h5Source):
+
+    if os.path.isdir(runDirectory):
+        shutil.rmtree(runDirectory)
+    analysesDirectory = os.path.join(runDirectory, "AnimalProfiles", "BENCH", "Analyses", videoName)
+    workingDirectory = os.path.join(runDirectory, "src", "analysis")
+    os.makedirs(analysesDirectory)
+    os.makedirs(workingDirectory)
+    os.makedirs(os.path.join(runDirectory, "config"))
+    with open(os.path.join(runDirectory, "config", "3D_reconstruction_calibration.txt"), 'w') as f:
+        for value in CALIBRATION:
+            f.write(str(value) + "\n")
+
+    video = os.path.join(analysesDirectory, videoName + ".avi")
+    h5 = os.path.join(analysesDirectory, videoName + SCORER + ".h5")
+    shutil.copy(videoSource, video)
+    shutil.copy(h5Source, h5)
+    return workingDirectory, video, h5, os.path.join(analysesDirectory, videoName + "_reaches.txt")
+
+
+# Makes the scored reaches file analysis.py and remakeVideo.py look for, by giving every reach a label.
+def write_scored_reaches(reachesPath):
+
+    scoredPath = reachesPath.replace("_reaches.txt", "_reaches_scored.txt")
+    labelIndex = 0
+    with open(reachesPath) as src, open(scoredPath, 'w') as dst:
+        for line in src:
+            if line == "UNSCORED\n":
+                line = LABELS[labelIndex % len(LABELS)] + "\n"
+                labelIndex += 1
+            dst.write(line)
+    return scoredPath
+
+
+def count_trajectory_frames(reachesPath):
+
+    with open(reachesPath) as f:
+        return sum(1 for line in f if "," in line)
+
+
+def peak_rss_mb():
+
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+# <peakMb> is the stage's own peak RSS when it shares its process with other stages, otherwise the process's peak
+# is used.
+def stage_result(seconds, frames, peakMb=None):
+
+    return {"seconds": seconds, "frames": frames, "frames_per_second": frames / seconds if seconds > 0 else None,
+            "peak_rss_mb": peakMb if peakMb is not None else peak_rss_mb()}
+
+
+# Runs one stage in this process. Called in a child process by run_stage(). Returns {stage name: result}.
+def execute_stage(stage, video, h5, reachesPath, frames):
+
+    sys.path.insert(0, ANALYSIS_DIRECTORY)
+
+    if stage == "kinalyze":
+        kinalyzePath = os.path.join(ANALYSIS_DIRECTORY, "kinalyze.py")
+        # Keep the run log out of the Analyses directory remakeVideo walks.
+        sys.argv = [kinalyzePath, video, h5, "--output", reachesPath, "--run-log", "kinalyze_runs.jsonl"]
+        start = time.perf_counter()
+        runpy.run_path(kinalyzePath, run_name="__main__")
+        return {"kinalyze": stage_result(time.perf_counter() - start, frames)}
+
+    if stage == "kinalyze_stages":
+        import cv2
+        import pandas as pd
+        import kinalyze
+        from instrumentation import MemorySampler
+        # The sub-stages share this process, so ru_maxrss would give each one the peak of everything before it.
+        # The sampler's peak is reset at the start of each sub-stage instead.
+        memory = MemorySampler()
+        memory.start()
+        results = {}
+        start = time.perf_counter()
+        cv2.VideoCapture(video).release()
+        dataframe = pd.read_hdf(h5)
+        dataframe.to_csv(h5[:-3] + ".csv")
+        results["kinalyze_load"] = stage_result(time.perf_counter() - start, frames, memory.peak())
+
+        memory.reset()
+        start = time.perf_counter()
+        calibration = kinalyze.load_calibration_data()
+        pointArray = kinalyze.filter_trajectory_arrays(dataframe, calibration)
+        filteredPoints = kinalyze.filtered_point_lists(pointArray)
+        results["kinalyze_filter"] = stage_result(time.perf_counter() - start, frames, memory.peak())
+
+        memory.reset()
+        start = time.perf_counter()
+        events = kinalyze.extractEvents([0, 1, 2, 3, 4], [5, 6, 7, 8, 9], [10, 11, 12, 13, 14], filteredPoints,
+                                        "reachingReconstruction")
+        results["kinalyze_segment"] = stage_result(time.perf_counter() - start, frames, memory.peak())
+
+        memory.reset()
+        start = time.perf_counter()
+        kinalyze.reconstruct_events(events, pointArray, calibration, "LEFT")
+        seconds = time.perf_counter() - start
+        results["kinalyze_reconstruct"] = stage_result(seconds, sum(event.stopFrame - event.startFrame + 1
+                                                                    for event in events), memory.peak())
+        memory.stop()
+        return results
+
+    if stage == "scoreTrials_load":
+        import scoreTrials
+        start = time.perf_counter()
+        reaches = scoreTrials.load_reaches(reachesPath) or []
+        seconds = time.perf_counter() - start
+        return {"scoreTrials_load": stage_result(seconds, sum(len(r.trajectoryCoords) for r in reaches))}
+
+    if stage == "analysis_runTest":
+        import analysis
+        start = time.perf_counter()
+        analysis.runTest(LABEL_DICT)
+        seconds = time.perf_counter() - start
+        scoredPath = reachesPath.replace("_reaches.txt", "_reaches_scored.txt")
+        return {"analysis_runTest": stage_result(seconds, count_trajectory_frames(scoredPath))}
+
+    if stage == "remakeVideo":
+        import remakeVideo
+        start = time.perf_counter()
+        remakeVideo.constructRawDataSet()
+        return {"remakeVideo": stage_result(time.perf_counter() - start, frames)}
+
+    raise ValueError("Unknown stage " + stage)
+
+
+# Runs <stage> in a child process from <workingDirectory>. The stage's own output goes to <logPath>.
+def run_stage(stage, workingDirectory, video, h5, reachesPath, frames, logPath):
+
+    resultPath = os.path.join(workingDirectory, stage + "_result.json")
+    cmd = [sys.executable, os.path.abspath(__file__), "--run-stage", stage, "--video", video, "--h5", h5,
+           "--reaches", reachesPath, "--frames", str(frames), "--result", resultPath]
+    with open(logPath, 'a') as log:
+        returnCode = subprocess.call(cmd, cwd=workingDirectory, stdout=log, stderr=subprocess.STDOUT)
+    if returnCode != 0 or not os.path.isfile(resultPath):
+        print("  " + stage + " failed, see " + logPath)
+        return {}
+
+    with open(resultPath) as f:
+        return json.load(f)
+
+
+def benchmark_session_length(minutes, args):
+
+    frames = int(minutes * 60 * args.fps)
+    videoName = "bench_{}min".format(minutes)
+    dataDirectory = os.path.join(args.workdir, "data")
+    if not os.path.isdir(dataDirectory):
+        os.makedirs(dataDirectory)
+
+    # Generated data is kept between runs, generating an hour of video takes a while.
+    key = "{}min_{}fps_{}x{}_seed{}".format(minutes, args.fps, args.width, args.height, args.seed)
+    h5Source = os.path.join(dataDirectory, key + ".h5")
+    videoSource = os.path.join(dataDirectory, key + ".avi")
+    if not os.path.isfile(h5Source):
+        print("Generating " + str(frames) + " frames of DeepLabCut data...")
+        generate_h5(h5Source, frames, args.fps, args.reaches_per_minute, args.seed)
+    if not os.path.isfile(videoSource):
+        print("Generating " + str(frames) + " frames of video...")
+        generate_video(videoSource, frames, args.fps, args.width, args.height, args.seed)
+
+    workingDirectory, video, h5, reachesPath = setup_run_tree(os.path.join(args.workdir, "run_" + key),
+                                                              videoName, videoSource, h5Source)
+    logPath = os.path.join(args.workdir, "run_" + key + ".log")
+
+    results = {}
+    for stage in args.stages:
+        # Every later stage needs the reaches file, so kinalyze always runs first.
+        if stage != "kinalyze" and not os.path.isfile(reachesPath):
+            results.update(run_stage("kinalyze", workingDirectory, video, h5, reachesPath, frames, logPath))
+        if stage in ("analysis_runTest", "remakeVideo"):
+            write_scored_reaches(reachesPath)
+        if stage == "kinalyze" and os.path.isfile(reachesPath):
+            os.remove(reachesPath)
+
+        print("  " + stage + "...")
+        results.update(run_stage(stage, workingDirectory, video, h5, reachesPath, frames, logPath))
+
+    return {"minutes": minutes, "frames": frames, "stages": results}
+
+
+def git_revision():
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ANALYSIS_DIRECTORY,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(report, baseline=None):
+
+    baselineStages = {}
+    if baseline is not None:
+        for run in baseline["runs"]:
+            baselineStages[run["minutes"]] = run["stages"]
+
+    for run in report["runs"]:
+        print("\n{} minute session ({} frames)".format(run["minutes"], run["frames"]))
+        for stage, result in sorted(run["stages"].items()):
+            line = "  {:<22} {:>9.2f}s {:>12.1f} frames/s {:>9.1f} MB".format(
+                stage, result["seconds"], result["frames_per_second"] or 0, result["peak_rss_mb"])
+            old = baselineStages.get(run["minutes"], {}).get(stage)
+            if old is not None and result["seconds"] > 0:
+                line += "   {:+.1f}% time vs baseline".format(100.0 * (result["seconds"] - old["seconds"]) / old["seconds"])
+            print(line)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline on synthetic data.")
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 10, 60], help="Session lengths to benchmark.")
+    parser.add_argument("--fps", type=int, default=140)
+    parser.add_argument("--width", type=int, default=1220)
+    parser.add_argument("--height", type=int, default=500)
+    parser.add_argument("--reaches-per-minute", type=float, default=6.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--workdir", default="benchmark_data", help="Where generated data and run trees are kept.")
+    parser.add_argument("--output", help="Results file (default benchmark_<git revision>.json).")
+    parser.add_argument("--compare", help="Results file from an earlier run to compare against.")
+
+    # Used internally to run a single stage in a child process.
+    parser.add_argument("--run-stage", help=argparse.SUPPRESS)
+    parser.add_argument("--video", help=argparse.SUPPRESS)
+    parser.add_argument("--h5", help=argparse.SUPPRESS)
+    parser.add_argument("--reaches", help=argparse.SUPPRESS)
+    parser.add_argument("--frames", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        results = execute_stage(args.run_stage, args.video, args.h5, args.reaches, args.frames)
+        with open(args.result, 'w') as f:
+            json.dump(results, f)
+        return
+
+    args.workdir = os.path.abspath(args.workdir)
+    revision = git_revision()
+    report = {
+        "revision": revision,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"fps": args.fps, "width": args.width, "height": args.height,
+                     "reaches_per_minute": args.reaches_per_minute, "seed": args.seed},
+        "runs": [],
+    }
+    for minutes in args.minutes:
+        print("Benchmarking a {} minute session...".format(minutes))
+        report["runs"].append(benchmark_session_length(minutes, args))
+
+    output = args.output or "benchmark_{}.json".format(revision or time.strftime("%Y%m%d-%H%M%S"))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(report, baseline)
+    print("\nResults saved to " + output)
+
+
+if __name__ == "__main__":
+    main()
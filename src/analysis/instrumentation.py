@@ -0,0 +1,197 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import io
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+
+"""
+    Timing and memory instrumentation for the analysis scripts. Usage:
+
+        instr = RunInstrumentation("video.avi", profiler="cprofile", profileDirectory="...")
+        with instr.stage("filter"):
+            ...
+        instr.append_to_run_log("kinalyze_runs.jsonl", reaches=12)
+
+    Every stage records its wall time, CPU time and peak RSS. The peak is sampled on a background thread every
+    <sampleInterval> seconds, so it's the peak within the stage rather than the process' lifetime peak
+    (ru_maxrss). If <profiler> is "cprofile" or "pyinstrument" each stage is also profiled and the profile is saved
+    to <profileDirectory>/<video name>_<stage>.prof (cProfile, for snakeviz/pstats) or .html (pyinstrument).
+    pyinstrument is optional, if it isn't installed stages run unprofiled.
+"""
+
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+# Current resident set size in MB. Reads /proc where it exists, otherwise falls back to the lifetime peak.
+def current_rss_mb():
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (IOError, OSError, ValueError, IndexError):
+        return lifetime_peak_rss_mb()
+
+
+def lifetime_peak_rss_mb():
+
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class MemorySampler(threading.Thread):
+    """
+        Samples the RSS every <interval> seconds. reset() starts a new peak, peak() returns the peak since the last
+        reset.
+    """
+
+    def __init__(self, interval=0.05):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.stopEvent = threading.Event()
+        self.lock = threading.Lock()
+        self.peakMb = current_rss_mb()
+
+    def run(self):
+
+        while not self.stopEvent.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+
+        rss = current_rss_mb()
+        with self.lock:
+            self.peakMb = max(self.peakMb, rss)
+
+    def reset(self):
+
+        with self.lock:
+            self.peakMb = current_rss_mb()
+
+    def peak(self):
+
+        self.sample()
+        with self.lock:
+            return self.peakMb
+
+    def stop(self):
+
+        self.stopEvent.set()
+
+
+class RunInstrumentation(object):
+    """
+        Collects per stage timings for one run of a script over one video. See the comment at the top of this file.
+
+        Attributes:
+            video: Name of the video being processed, recorded with every run.
+            stages: List of dicts, one per finished stage, in the order they ran.
+    """
+
+    def __init__(self, video, profiler=None, profileDirectory=None, sampleInterval=0.05):
+
+        if profiler is not None and profiler not in PROFILERS:
+            raise ValueError("Unknown profiler " + str(profiler) + ", expected one of " + ", ".join(PROFILERS))
+        self.video = video
+        self.profiler = profiler
+        self.profileDirectory = profileDirectory
+        self.startTime = time.time()
+        self.startPerf = time.perf_counter()
+        self.stages = []
+        self.sampler = MemorySampler(sampleInterval)
+        self.sampler.start()
+
+    @contextmanager
+    def stage(self, name, **info):
+
+        self.sampler.reset()
+        profiler = self._start_profiler()
+        wallStart = time.perf_counter()
+        cpuStart = time.process_time()
+        record = {"stage": name}
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - wallStart
+            record["cpu_seconds"] = time.process_time() - cpuStart
+            record["peak_rss_mb"] = self.sampler.peak()
+            record.update(info)
+            profilePath = self._stop_profiler(profiler, name)
+            if profilePath is not None:
+                record["profile"] = profilePath
+            self.stages.append(record)
+
+    def summary(self, **info):
+
+        summary = {
+            "video": self.video,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.startTime)),
+            "seconds": time.perf_counter() - self.startPerf,
+            "peak_rss_mb": lifetime_peak_rss_mb(),
+            "stages": self.stages,
+        }
+        summary.update(info)
+        return summary
+
+    # Appends one JSON line describing the run to <runLogPath> and stops the memory sampler.
+    def append_to_run_log(self, runLogPath, **info):
+
+        self.sampler.stop()
+        summary = self.summary(**info)
+        directory = os.path.dirname(runLogPath)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(runLogPath, 'a') as f:
+            f.write(json.dumps(summary) + "\n")
+        return summary
+
+    def _start_profiler(self):
+
+        if self.profiler == "cprofile":
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        if self.profiler == "pyinstrument":
+            try:
+                import pyinstrument
+            except ImportError:
+                print("pyinstrument isn't installed, running without profiling")
+                self.profiler = None
+                return None
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+            return profiler
+        return None
+
+    def _stop_profiler(self, profiler, stageName):
+
+        if profiler is None:
+            return None
+
+        directory = self.profileDirectory or "."
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        basePath = os.path.join(directory, os.path.splitext(os.path.basename(self.video))[0] + "_" + stageName)
+
+        if self.profiler == "cprofile":
+            profiler.disable()
+            profiler.dump_stats(basePath + ".prof")
+            return basePath + ".prof"
+
+        profiler.stop()
+        with io.open(basePath + ".html", 'w', encoding="utf-8") as f:
+            f.write(profiler.output_html())
+        return basePath + ".html"
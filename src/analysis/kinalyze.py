@@ -7,16 +7,15 @@
 
 import pandas as pd
 import numpy as np
+import argparse
+import bisect
 import csv
+import json
 import math
 import cv2
-import sys
-from multiprocessing import Process
-import matplotlib.pyplot as plt
-from time import sleep
-import matplotlib.axes as axes
-from mpl_toolkits.mplot3d import Axes3D
-from matplotlib.patches import Circle
+import os
+from collections import namedtuple
+from instrumentation import RunInstrumentation
 
 
 
@@ -53,7 +52,7 @@ from matplotlib.patches import Circle
     reference point.
     
     Details about this process can be viewed in comments for the perform_manual_calibration() and
-    convert_pixelCoord_to_realWorld() functions.
+    pixel_to_real_world() functions.
     
     
 3. 
@@ -89,40 +88,36 @@ from matplotlib.patches import Circle
 
 """
 This script is meant to be called from command line (Ideally automatically from another script
-since the inputs are fairly long file paths).
+since the inputs are fairly long file paths), or imported and used through analyze().
+
+            USAGE:
+
+python kinalyze.py VIDEO_PATH H5_PATH [--output OUTPUT_PATH] [--display-videos] [--display-graphs] [--extract-clips]
+                   [--no-csv] [--calibrate] [--events EVENTS_PATH] [--run-log RUN_LOG] [--profile cprofile|pyinstrument]
+                   [--profile-dir PROFILE_DIR] [--hand LEFT|RIGHT] [--gap-fill ffill|linear|spline]
 
-            INPUTS:
-            
 VIDEO_PATH = Path to video being analyzed
 H5_PATH = Path to deeplabcut h5 output for video
-OUTPUT_PATH = Path + name where text-file containing output data from this script will be created
-DISPLAY_VIDEOS = Flag for displaying videos (1 or 0)
-DISPLAY_GRAPHS = Flag for displaying graphs (1 or 0)
-EXTRACT_VIDEO_CLIPS = Flag for saving each reach as a video (1 or 0)
-GEN_CSV = Flag for outputting data for all reaches to a text file (1 or 0)
-PERFORM_CALIBRATION = Flag for performing manual calibration for trajectory reconstruction (1 or 0)
+--output = Path + name where text-file containing output data from this script will be created.
+           Defaults to <video_path_without_extension>_reaches.txt
+--display-videos = Display each reach
+--display-graphs = Display the 3D reconstruction of each reach
+--extract-clips = Save each reach as a video
+--no-csv = Don't write the reach data text file
+--calibrate = Perform manual calibration for trajectory reconstruction
+--events = Path to the session event log written by main.py. Defaults to
+           <animal_profile>/Logs/<video_name>_events.jsonl
+--run-log = File the per stage timing record for each run is appended to (one JSON line per run).
+            Defaults to $KINALYZE_RUN_LOG or <animal_profile>/Logs/kinalyze_runs.jsonl
+--profile = Profile every stage (see instrumentation.py). Defaults to $KINALYZE_PROFILE
+--profile-dir = Where profiles are saved. Defaults to $KINALYZE_PROFILE_DIR or <animal_profile>/Logs/profiles/
+--hand = Hand to reconstruct reaches for. Defaults to the dominant_hand in the animal's profile, or LEFT
+--gap-fill = How missing frames inside a reach are filled: ffill (repeat the last value, the default), linear or
+             spline (needs scipy). See fill_gaps().
+
+Nothing is loaded at import, and matplotlib / multiprocessing are only imported when graphs or review windows
+are actually used, so a batch driver can import this module once and call analyze() for every video.
 """
-VIDEO_PATH = sys.argv[1]
-H5_PATH = sys.argv[2]
-OUTPUT_PATH = sys.argv[3]
-DISPLAY_VIDEOS = int(sys.argv[4])
-DISPLAY_GRAPHS = int(sys.argv[5])
-EXTRACT_VIDEO_CLIPS = int(sys.argv[6])
-GEN_CSV = int(sys.argv[7])
-PERFORM_CALIBRATION = int(sys.argv[8])
-
-# Load the video
-video = cv2.VideoCapture(VIDEO_PATH)
-frameCount = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
-height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
-fps = video.get(cv2.CAP_PROP_FPS)
-
-# Load deeplabcut h5 file for video
-print("Loading DeepLabCut data...")
-dataframe = pd.read_hdf(H5_PATH)
-dataframe.to_csv(H5_PATH[:-3] + ".csv")
-print("DeepLabCut data loaded")
 
 
 
@@ -132,28 +127,19 @@ print("DeepLabCut data loaded")
 # Calibration temp data
 x1, y1, x2, y2 = -1, -1, -1, -1
 drawing = False
-# Calibration Constants .Set by default from ~/HomeCageSinglePellet/config/3D_reconstruction_calibration.txt.
-# If PERFORM_CALIBRATION is set, then 3D_reconstruction_calibration.txt is updated.
-LEFTSIDE = None
-RIGHTSIDE = None
-LEFT_MIRROR_CALIBRATION_OBJECT_WIDTH = None
-ACTUAL_CALIBRATION_OBJECT_WIDTH = None
-RIGHT_MIRROR_CALIBRATION_OBJECT_WIDTH = None
-LEFT_MIRROR_CALIBRATION_OBJECT_HEIGHT = None
-ACTUAL_CALIBRATION_OBJECT_HEIGHT = None
-RIGHT_MIRROR_CALIBRATION_OBJECT_HEIGHT = None
-PIXELS_MM_Y_LEFTMIRROR = None
-PIXELS_MM_Z_LEFTMIRROR = None
-PIXELS_MM_X_ACTUAL = None
-PIXELS_MM_Y_ACTUAL = None
-PIXELS_MM_Y_RIGHTMIRROR = None
-PIXELS_MM_Z_RIGHTMIRROR = None
-Y_ORIGIN_LEFTMIRROR = None
-Z_ORIGIN_LEFTMIRROR = None
-X_ORIGIN_ACTUAL = None
-Y_ORIGIN_ACTUAL = None
-Y_ORIGIN_RIGHTMIRROR = None
-Z_ORIGIN_RIGHTMIRROR = None
+# Calibration for 3D reconstruction, loaded from ~/HomeCageSinglePellet/config/3D_reconstruction_calibration.txt
+# (one value per line, in field order). If --calibrate is passed the file is updated from perform_manual_calibration().
+#   leftSide/rightSide: x pixel coordinates of the lines separating the left mirror, center view and right mirror.
+#   *ObjectWidth/*ObjectHeight: Size of the calibration object in each perspective, in mm.
+#   pixelsMm*: Pixels per mm along each axis in each perspective.
+#   *Origin*: Pixel coordinate of the reconstruction origin along each axis in each perspective.
+CALIBRATION_PATH = "../../config/3D_reconstruction_calibration.txt"
+Calibration = namedtuple("Calibration", ["leftSide", "rightSide", "leftMirrorObjectWidth", "actualObjectWidth",
+                                         "rightMirrorObjectWidth", "leftMirrorObjectHeight", "actualObjectHeight",
+                                         "rightMirrorObjectHeight", "pixelsMmYLeftMirror", "pixelsMmZLeftMirror",
+                                         "pixelsMmXActual", "pixelsMmYActual", "pixelsMmYRightMirror",
+                                         "pixelsMmZRightMirror", "yOriginLeftMirror", "zOriginLeftMirror",
+                                         "xOriginActual", "yOriginActual", "yOriginRightMirror", "zOriginRightMirror"])
 
 
 
@@ -315,6 +301,59 @@ def extractEvents(leftMirrorPawIndexes, centerPawIndexes, rightMirrorPawIndexes,
     return events
 
 
+# Reads the session event log written by main.py and returns the frame index (as counted by the recorder) of every
+# pellet presentation, in order. Returns an empty list if the video has no event log (e.g it was recorded before event
+# logging existed). A last line cut off by a crash is skipped.
+def load_pellet_presentation_frames(eventsPath):
+
+    if not os.path.isfile(eventsPath):
+        return []
+
+    presentationFrames = []
+    with open(eventsPath) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record["event"] == "PELLET_REQUEST" and record.get("frame") is not None:
+                presentationFrames.append(record["frame"])
+
+    return sorted(presentationFrames)
+
+
+# Pairs each reach with the most recent pellet presentation before it started. Returns a list of
+# (reach, presentationNumber, presentationFrame) tuples, with None for the presentation if the reach happened before
+# the first one.
+def align_reaches_to_presentations(events, presentationFrames):
+
+    aligned = []
+    for event in events:
+        i = bisect.bisect_right(presentationFrames, event.startFrame)
+        if i == 0:
+            aligned.append((event, None, None))
+        else:
+            aligned.append((event, i, presentationFrames[i - 1]))
+
+    return aligned
+
+
+def save_presentation_alignment(alignedReaches, outputPath):
+
+    with open(outputPath, 'w', newline='') as f:
+        wr = csv.writer(f)
+        wr.writerow(["reach_start_frame", "reach_stop_frame", "presentation_number", "presentation_frame",
+                     "frames_since_presentation"])
+        for event, presentationNumber, presentationFrame in alignedReaches:
+            if presentationFrame is None:
+                wr.writerow([event.startFrame, event.stopFrame, "", "", ""])
+            else:
+                wr.writerow([event.startFrame, event.stopFrame, presentationNumber, presentationFrame,
+                             event.startFrame - presentationFrame])
+
+
 # Function for displaying the video of a reaching event to screen.
 def review_event(event, videoName, video, points):
         
@@ -337,6 +376,7 @@ def review_event(event, videoName, video, points):
 
 
 def spawn_event_review_process(event, videoName, video, points):
+    from multiprocessing import Process
     p = Process(target=review_event, args=(event, videoName, video, points))
     p.start()
     return p
@@ -437,6 +477,8 @@ def get_point_distance(point1, point2):
 
 
 def graph_3D_trajectory(x_points, y_points, z_points, startFrame):
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D  # Registers the 3d projection.
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
     ax.set_xlim(-10, 10)
@@ -456,6 +498,7 @@ def graph_3D_trajectory(x_points, y_points, z_points, startFrame):
     return 0
 
 def spawn_3D_graph(x_points, y_points, z_points, startFrame):
+    from multiprocessing import Process
     p = Process(target=graph_3D_trajectory, args=(x_points, y_points, z_points, startFrame,))
     p.start()
     return p
@@ -463,50 +506,11 @@ def spawn_3D_graph(x_points, y_points, z_points, startFrame):
 
 
 
-def print_calibration_info():
-
-    # Calibration Constants
-    global LEFTSIDE
-    global RIGHTSIDE
-    global LEFT_MIRROR_CALIBRATION_OBJECT_WIDTH
-    global ACTUAL_CALIBRATION_OBJECT_WIDTH
-    global RIGHT_MIRROR_CALIBRATION_OBJECT_WIDTH
-    global LEFT_MIRROR_CALIBRATION_OBJECT_HEIGHT
-    global ACTUAL_CALIBRATION_OBJECT_HEIGHT
-    global RIGHT_MIRROR_CALIBRATION_OBJECT_HEIGHT
-    global PIXELS_MM_Y_LEFTMIRROR
-    global PIXELS_MM_Z_LEFTMIRROR
-    global PIXELS_MM_X_ACTUAL
-    global PIXELS_MM_Y_ACTUAL
-    global PIXELS_MM_Y_RIGHTMIRROR
-    global PIXELS_MM_Z_RIGHTMIRROR
-    global Y_ORIGIN_LEFTMIRROR
-    global Z_ORIGIN_LEFTMIRROR
-    global X_ORIGIN_ACTUAL
-    global Y_ORIGIN_ACTUAL
-    global Y_ORIGIN_RIGHTMIRROR
-    global Z_ORIGIN_RIGHTMIRROR
-
-    print("LEFTSIDE=" + str(LEFTSIDE))
-    print("RIGHTSIDE=" + str(RIGHTSIDE))
-    print("LEFT_MIRROR_CALIBRATION_OBJECT_WIDTH=" + str(LEFT_MIRROR_CALIBRATION_OBJECT_WIDTH))
-    print("LEFT_MIRROR_CALIBRATION_OBJECT_HEIGHT=" + str(LEFT_MIRROR_CALIBRATION_OBJECT_HEIGHT))
-    print("ACTUAL_CALIBRATION_OBJECT_WIDTH=" + str(ACTUAL_CALIBRATION_OBJECT_WIDTH))
-    print("ACTUAL_CALIBRATION_OBJECT_HEIGHT=" + str(ACTUAL_CALIBRATION_OBJECT_HEIGHT))
-    print("RIGHT_MIRROR_CALIBRATION_OBJECT_WIDTH=" + str(RIGHT_MIRROR_CALIBRATION_OBJECT_WIDTH))
-    print("RIGHT_MIRROR_CALIBRATION_OBJECT_HEIGHT=" + str(RIGHT_MIRROR_CALIBRATION_OBJECT_HEIGHT))
-    print("PIXELS_MM_Y_LEFT_MIRROR=" + str(PIXELS_MM_Y_LEFTMIRROR))
-    print("PIXELS_MM_Z_LEFT_MIRROR=" + str(PIXELS_MM_Z_LEFTMIRROR))
-    print("PIXELS_MM_X_ACTUAL=" + str(PIXELS_MM_X_ACTUAL))
-    print("PIXELS_MM_Y_ACTUAL=" + str(PIXELS_MM_Y_ACTUAL))
-    print("PIXELS_MM_Y_RIGHT_MIRROR=" + str(PIXELS_MM_Y_RIGHTMIRROR))
-    print("PIXELS_MM_Z_RIGHT_MIRROR=" + str(PIXELS_MM_Z_RIGHTMIRROR))
-    print("Y_ORIGIN_LEFTMIRROR=" + str(Y_ORIGIN_LEFTMIRROR))
-    print("Z_ORIGIN_LEFTMIRROR=" + str(Z_ORIGIN_LEFTMIRROR))
-    print("X_ORIGIN_ACTUAL=" + str(X_ORIGIN_ACTUAL))
-    print("Y_ORIGIN_ACTUAL=" + str(Y_ORIGIN_ACTUAL))
-    print("Y_ORIGIN_RIGHTMIRROR=" + str(Y_ORIGIN_RIGHTMIRROR))
-    print("Z_ORIGIN_RIGHTMIRROR=" + str(Z_ORIGIN_RIGHTMIRROR))
+def print_calibration_info(calibration):
+
+    for field, value in zip(Calibration._fields, calibration):
+        print(field + "=" + str(value))
+
 
 
 # Mouse event callback function for performing manual calibration for trajectory reconstruction.
@@ -542,34 +546,12 @@ This data is used to calculate a pixels:mm ratio for each perspective. The data
 """
 def perform_manual_calibration(calibrationFrame):
 
-    # Calibration Constants
-    global LEFTSIDE
-    global RIGHTSIDE
-    global LEFT_MIRROR_CALIBRATION_OBJECT_WIDTH
-    global ACTUAL_CALIBRATION_OBJECT_WIDTH
-    global RIGHT_MIRROR_CALIBRATION_OBJECT_WIDTH
-    global LEFT_MIRROR_CALIBRATION_OBJECT_HEIGHT
-    global ACTUAL_CALIBRATION_OBJECT_HEIGHT
-    global RIGHT_MIRROR_CALIBRATION_OBJECT_HEIGHT
-    global PIXELS_MM_Y_LEFTMIRROR
-    global PIXELS_MM_Z_LEFTMIRROR
-    global PIXELS_MM_X_ACTUAL
-    global PIXELS_MM_Y_ACTUAL
-    global PIXELS_MM_Y_RIGHTMIRROR
-    global PIXELS_MM_Z_RIGHTMIRROR
-    global Y_ORIGIN_LEFTMIRROR
-    global Z_ORIGIN_LEFTMIRROR
-    global X_ORIGIN_ACTUAL
-    global Y_ORIGIN_ACTUAL
-    global Y_ORIGIN_RIGHTMIRROR
-    global Z_ORIGIN_RIGHTMIRROR
-
-    LEFT_MIRROR_CALIBRATION_OBJECT_WIDTH = float(input("Enter the width of the left mirror calibration object in mm: "))
-    LEFT_MIRROR_CALIBRATION_OBJECT_HEIGHT = float(input("Enter the height of the left mirror calibration object in mm: "))
-    ACTUAL_CALIBRATION_OBJECT_WIDTH = float(input("Enter the width of the center view calibration object in mm: "))
-    ACTUAL_CALIBRATION_OBJECT_HEIGHT = float(input("Enter the height of the center view calibration object in mm: "))
-    RIGHT_MIRROR_CALIBRATION_OBJECT_WIDTH = float(input("Enter the width of the right mirror calibration object in mm: "))
-    RIGHT_MIRROR_CALIBRATION_OBJECT_HEIGHT = float(input("Enter the height of the right mirror calibration object in mm: "))
+    leftMirrorObjectWidth = float(input("Enter the width of the left mirror calibration object in mm: "))
+    leftMirrorObjectHeight = float(input("Enter the height of the left mirror calibration object in mm: "))
+    actualObjectWidth = float(input("Enter the width of the center view calibration object in mm: "))
+    actualObjectHeight = float(input("Enter the height of the center view calibration object in mm: "))
+    rightMirrorObjectWidth = float(input("Enter the width of the right mirror calibration object in mm: "))
+    rightMirrorObjectHeight = float(input("Enter the height of the right mirror calibration object in mm: "))
     print("\n")
 
     cv2.namedWindow("calibrationFrame")
@@ -583,8 +565,8 @@ def perform_manual_calibration(calibrationFrame):
         cv2.line(modified_calibrationFrame, (x1,y1), (x2,y2), (0,255,0), 1)
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
-            print("LEFTSIDE saved as x=" + str(x1))
-            LEFTSIDE = x1
+            print("leftSide saved as x=" + str(x1))
+            leftSide = x1
             break
     print("\n")
 
@@ -595,8 +577,8 @@ def perform_manual_calibration(calibrationFrame):
         cv2.line(modified_calibrationFrame, (x1,y1), (x2,y2), (255,0,0), 1)
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
-            print("RIGHTSIDE saved as x=" + str(x1))
-            RIGHTSIDE = x1
+            print("rightSide saved as x=" + str(x1))
+            rightSide = x1
             break
     print("\n")
 
@@ -608,7 +590,7 @@ def perform_manual_calibration(calibrationFrame):
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
             dist = get_point_distance((x1,y1),(x2,y2))
-            PIXELS_MM_Z_LEFTMIRROR = (dist / LEFT_MIRROR_CALIBRATION_OBJECT_WIDTH)
+            pixelsMmZLeftMirror = (dist / leftMirrorObjectWidth)
             break
     print("\n")
 
@@ -620,7 +602,7 @@ def perform_manual_calibration(calibrationFrame):
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
             dist = get_point_distance((x1,y1),(x2,y2))
-            PIXELS_MM_Y_LEFTMIRROR = (dist / LEFT_MIRROR_CALIBRATION_OBJECT_HEIGHT)
+            pixelsMmYLeftMirror = (dist / leftMirrorObjectHeight)
             break
     print("\n")
 
@@ -632,7 +614,7 @@ def perform_manual_calibration(calibrationFrame):
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
             dist = get_point_distance((x1,y1),(x2,y2))
-            PIXELS_MM_X_ACTUAL = (dist / ACTUAL_CALIBRATION_OBJECT_WIDTH)
+            pixelsMmXActual = (dist / actualObjectWidth)
             break
     print("\n")
 
@@ -644,7 +626,7 @@ def perform_manual_calibration(calibrationFrame):
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
             dist = get_point_distance((x1,y1),(x2,y2))
-            PIXELS_MM_Y_ACTUAL = (dist / ACTUAL_CALIBRATION_OBJECT_HEIGHT)
+            pixelsMmYActual = (dist / actualObjectHeight)
             break
     print("\n")
 
@@ -656,7 +638,7 @@ def perform_manual_calibration(calibrationFrame):
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
             dist = get_point_distance((x1,y1),(x2,y2))
-            PIXELS_MM_Z_RIGHTMIRROR = (dist / RIGHT_MIRROR_CALIBRATION_OBJECT_WIDTH)
+            pixelsMmZRightMirror = (dist / rightMirrorObjectWidth)
             break
     print("\n")
 
@@ -668,7 +650,7 @@ def perform_manual_calibration(calibrationFrame):
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
             dist = get_point_distance((x1,y1),(x2,y2))
-            PIXELS_MM_Y_RIGHTMIRROR = (dist / RIGHT_MIRROR_CALIBRATION_OBJECT_HEIGHT)
+            pixelsMmYRightMirror = (dist / rightMirrorObjectHeight)
             break
     print("\n")
 
@@ -679,7 +661,7 @@ def perform_manual_calibration(calibrationFrame):
         cv2.circle(modified_calibrationFrame, (x1,y1), 2, (0,255,0), -1)
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
-            Y_ORIGIN_LEFTMIRROR = y1
+            yOriginLeftMirror = y1
             break
     print("\n")
 
@@ -690,7 +672,7 @@ def perform_manual_calibration(calibrationFrame):
         cv2.circle(modified_calibrationFrame, (x1,y1), 2, (255,0,0), -1)
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
-            Z_ORIGIN_LEFTMIRROR = x1
+            zOriginLeftMirror = x1
             break
     print("\n")
 
@@ -701,7 +683,7 @@ def perform_manual_calibration(calibrationFrame):
         cv2.circle(modified_calibrationFrame, (x1,y1), 2, (0,255,0), -1)
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
-            X_ORIGIN_ACTUAL = x1
+            xOriginActual = x1
             break
     print("\n")
 
@@ -712,7 +694,7 @@ def perform_manual_calibration(calibrationFrame):
         cv2.circle(modified_calibrationFrame, (x1,y1), 2, (255,0,0), -1)
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
-            Y_ORIGIN_ACTUAL = y1
+            yOriginActual = y1
             break
     print("\n")
 
@@ -723,7 +705,7 @@ def perform_manual_calibration(calibrationFrame):
         cv2.circle(modified_calibrationFrame, (x1,y1), 2, (0,255,0), -1)
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
-            Y_ORIGIN_RIGHTMIRROR = y1
+            yOriginRightMirror = y1
             break
     print("\n")
 
@@ -734,434 +716,278 @@ def perform_manual_calibration(calibrationFrame):
         cv2.circle(modified_calibrationFrame, (x1,y1), 2, (255,0,0), -1)
         cv2.imshow("calibrationFrame", modified_calibrationFrame)
         if cv2.waitKey(1) & 0xFF == ord('s'):
-            Z_ORIGIN_RIGHTMIRROR = x1
+            zOriginRightMirror = x1
             break
     print("\n")
 
-    print("Recapping calibration values...\n")
-    print_calibration_info()
+    calibration = Calibration(leftSide, rightSide, leftMirrorObjectWidth, actualObjectWidth, rightMirrorObjectWidth,
+                              leftMirrorObjectHeight, actualObjectHeight, rightMirrorObjectHeight, pixelsMmYLeftMirror,
+                              pixelsMmZLeftMirror, pixelsMmXActual, pixelsMmYActual, pixelsMmYRightMirror,
+                              pixelsMmZRightMirror, yOriginLeftMirror, zOriginLeftMirror, xOriginActual, yOriginActual,
+                              yOriginRightMirror, zOriginRightMirror)
 
-
-    return 0
+    print("Recapping calibration values...\n")
+    print_calibration_info(calibration)
 
 
-def save_calibration_data():
-
-    # Calibration Constants
-    global LEFTSIDE
-    global RIGHTSIDE
-    global LEFT_MIRROR_CALIBRATION_OBJECT_WIDTH
-    global ACTUAL_CALIBRATION_OBJECT_WIDTH
-    global RIGHT_MIRROR_CALIBRATION_OBJECT_WIDTH
-    global LEFT_MIRROR_CALIBRATION_OBJECT_HEIGHT
-    global ACTUAL_CALIBRATION_OBJECT_HEIGHT
-    global RIGHT_MIRROR_CALIBRATION_OBJECT_HEIGHT
-    global PIXELS_MM_Y_LEFTMIRROR
-    global PIXELS_MM_Z_LEFTMIRROR
-    global PIXELS_MM_X_ACTUAL
-    global PIXELS_MM_Y_ACTUAL
-    global PIXELS_MM_Y_RIGHTMIRROR
-    global PIXELS_MM_Z_RIGHTMIRROR
-    global Y_ORIGIN_LEFTMIRROR
-    global Z_ORIGIN_LEFTMIRROR
-    global X_ORIGIN_ACTUAL
-    global Y_ORIGIN_ACTUAL
-    global Y_ORIGIN_RIGHTMIRROR
-    global Z_ORIGIN_RIGHTMIRROR
-
-
-    with open("../../config/3D_reconstruction_calibration.txt", 'w') as f:
-         f.write(str(LEFTSIDE) + "\n")
-         f.write(str(RIGHTSIDE) + "\n")
-         f.write(str(LEFT_MIRROR_CALIBRATION_OBJECT_WIDTH) + "\n")
-         f.write(str(ACTUAL_CALIBRATION_OBJECT_WIDTH) + "\n")
-         f.write(str(RIGHT_MIRROR_CALIBRATION_OBJECT_WIDTH) + "\n")
-         f.write(str(LEFT_MIRROR_CALIBRATION_OBJECT_HEIGHT) + "\n")
-         f.write(str(ACTUAL_CALIBRATION_OBJECT_HEIGHT) + "\n")
-         f.write(str(RIGHT_MIRROR_CALIBRATION_OBJECT_HEIGHT) + "\n")
-         f.write(str(PIXELS_MM_Y_LEFTMIRROR) + "\n")
-         f.write(str(PIXELS_MM_Z_LEFTMIRROR) + "\n")
-         f.write(str(PIXELS_MM_X_ACTUAL) + "\n")
-         f.write(str(PIXELS_MM_Y_ACTUAL) + "\n")
-         f.write(str(PIXELS_MM_Y_RIGHTMIRROR) + "\n")
-         f.write(str(PIXELS_MM_Z_RIGHTMIRROR) + "\n")
-         f.write(str(Y_ORIGIN_LEFTMIRROR) + "\n")
-         f.write(str(Z_ORIGIN_LEFTMIRROR) + "\n")
-         f.write(str(X_ORIGIN_ACTUAL) + "\n")
-         f.write(str(Y_ORIGIN_ACTUAL) + "\n")
-         f.write(str(Y_ORIGIN_RIGHTMIRROR) + "\n")
-         f.write(str(Z_ORIGIN_RIGHTMIRROR) + "\n")
-
-
-def load_calibration_data():
-
-    # Calibration Constants
-    global LEFTSIDE
-    global RIGHTSIDE
-    global LEFT_MIRROR_CALIBRATION_OBJECT_WIDTH
-    global ACTUAL_CALIBRATION_OBJECT_WIDTH
-    global RIGHT_MIRROR_CALIBRATION_OBJECT_WIDTH
-    global LEFT_MIRROR_CALIBRATION_OBJECT_HEIGHT
-    global ACTUAL_CALIBRATION_OBJECT_HEIGHT
-    global RIGHT_MIRROR_CALIBRATION_OBJECT_HEIGHT
-    global PIXELS_MM_Y_LEFTMIRROR
-    global PIXELS_MM_Z_LEFTMIRROR
-    global PIXELS_MM_X_ACTUAL
-    global PIXELS_MM_Y_ACTUAL
-    global PIXELS_MM_Y_RIGHTMIRROR
-    global PIXELS_MM_Z_RIGHTMIRROR
-    global Y_ORIGIN_LEFTMIRROR
-    global Z_ORIGIN_LEFTMIRROR
-    global X_ORIGIN_ACTUAL
-    global Y_ORIGIN_ACTUAL
-    global Y_ORIGIN_RIGHTMIRROR
-    global Z_ORIGIN_RIGHTMIRROR
-
-
-    with open("../../config/3D_reconstruction_calibration.txt") as f:
-
-        LEFTSIDE = int(f.readline())
-        RIGHTSIDE = int(f.readline())
-        LEFT_MIRROR_CALIBRATION_OBJECT_WIDTH = float(f.readline())
-        ACTUAL_CALIBRATION_OBJECT_WIDTH = float(f.readline())
-        RIGHT_MIRROR_CALIBRATION_OBJECT_WIDTH = float(f.readline())
-        LEFT_MIRROR_CALIBRATION_OBJECT_HEIGHT = float(f.readline())
-        ACTUAL_CALIBRATION_OBJECT_HEIGHT = float(f.readline())
-        RIGHT_MIRROR_CALIBRATION_OBJECT_HEIGHT = float(f.readline())
-        PIXELS_MM_Y_LEFTMIRROR = float(f.readline())
-        PIXELS_MM_Z_LEFTMIRROR = float(f.readline())
-        PIXELS_MM_X_ACTUAL = float(f.readline())
-        PIXELS_MM_Y_ACTUAL = float(f.readline())
-        PIXELS_MM_Y_RIGHTMIRROR = float(f.readline())
-        PIXELS_MM_Z_RIGHTMIRROR = float(f.readline())
-        Y_ORIGIN_LEFTMIRROR = int(f.readline())
-        Z_ORIGIN_LEFTMIRROR = int(f.readline())
-        X_ORIGIN_ACTUAL = int(f.readline())
-        Y_ORIGIN_ACTUAL = int(f.readline())
-        Y_ORIGIN_RIGHTMIRROR = int(f.readline())
-        Z_ORIGIN_RIGHTMIRROR = int(f.readline())
-
-
-
-# This function scans a set of (x,y,z) coordinates and throws out any points
-# that are missing one of the dimensions (x,y or z).
-def filter_points_missing_dimension(x,y,z):
-
-
-    filteredX = []
-    filteredY = []
-    filteredZ = []
-
-    for i in range(0,len(x)):
-        if(x[i]!=None and y[i]!=None and z[i]!=None):
-            filteredX.append(x[i])
-            filteredY.append(y[i])
-            filteredZ.append(z[i])
-
-    return filteredX, filteredY, filteredZ
+    return calibration
 
-    
 
-# This functions uses the calibration info from ~/HomeCageSinglePellet/config/3D_reconstruction_calibration.txt
-# to convert the (x,y,z) pixel coordinates of a reach event into approximate mm coordinates (relative to some reference
-# point specified in the calibration data).
-def convert_pixelCoord_to_realWorld(x_points, y_points, z_points):
-
-
-    # Calibration Constants
-    global LEFTSIDE
-    global RIGHTSIDE
-    global LEFT_MIRROR_CALIBRATION_OBJECT_WIDTH
-    global ACTUAL_CALIBRATION_OBJECT_WIDTH
-    global RIGHT_MIRROR_CALIBRATION_OBJECT_WIDTH
-    global LEFT_MIRROR_CALIBRATION_OBJECT_HEIGHT
-    global ACTUAL_CALIBRATION_OBJECT_HEIGHT
-    global RIGHT_MIRROR_CALIBRATION_OBJECT_HEIGHT
-    global PIXELS_MM_Y_LEFTMIRROR
-    global PIXELS_MM_Z_LEFTMIRROR
-    global PIXELS_MM_X_ACTUAL
-    global PIXELS_MM_Y_ACTUAL
-    global PIXELS_MM_Y_RIGHTMIRROR
-    global PIXELS_MM_Z_RIGHTMIRROR
-    global Y_ORIGIN_LEFTMIRROR
-    global Z_ORIGIN_LEFTMIRROR
-    global X_ORIGIN_ACTUAL
-    global Y_ORIGIN_ACTUAL
-    global Y_ORIGIN_RIGHTMIRROR
-    global Z_ORIGIN_RIGHTMIRROR
-
-    realWorldX = []
-    realWorldY = []
-    realWorldZ = []
-
-    for point in x_points:
-        if point != None and point != -1:
-            realWorldX.append((point - X_ORIGIN_ACTUAL) / PIXELS_MM_X_ACTUAL)
-        else:
-            realWorldX.append(None)
-    for point in y_points:
-        if point != None and point != -1:
-            realWorldY.append((Y_ORIGIN_LEFTMIRROR - point) / PIXELS_MM_Y_LEFTMIRROR)
-        else:
-            realWorldY.append(None)
-    for point in z_points:
-        if point != None and point != -1:
-            realWorldZ.append((Z_ORIGIN_LEFTMIRROR - point) / PIXELS_MM_Z_LEFTMIRROR)
-        else:
-            realWorldZ.append(None)
+def save_calibration_data(calibration, path=CALIBRATION_PATH):
 
-    if(not (len(realWorldX) == len(realWorldY) == len(realWorldZ))):
-        print("Error: convert_pixelCoord_to_realWorld(): Coordinate list lengths do not match")
-        exit()
+    with open(path, 'w') as f:
+        for value in calibration:
+            f.write(str(value) + "\n")
 
-    realWorldX, realWorldY, realWorldZ = filter_points_missing_dimension(realWorldX, realWorldY, realWorldZ)
 
-    return realWorldX, realWorldY, realWorldZ
- 
+def load_calibration_data(path=CALIBRATION_PATH):
 
+    with open(path) as f:
+        values = [f.readline() for field in Calibration._fields]
 
-# -----------------------------------------------------------------------------#
-# All functions below this line are NOT generic and must be rewritten based on #
-# use case.																       #
-# ------------------------------------------------------------------------------#
+    # The zone lines and origins are pixel coordinates, everything else is a measurement.
+    return Calibration(*[int(value) if field == "leftSide" or field == "rightSide" or "Origin" in field else float(value)
+                         for field, value in zip(Calibration._fields, values)])
 
 
-# This function filters the raw deeplabcut h5 output for a particular video to remove
-# any erroneous points.
+# This function uses the calibration info from ~/HomeCageSinglePellet/config/3D_reconstruction_calibration.txt
+# to convert an (N, 3) array of pixel (x, y, z) coordinates into approximate mm coordinates (relative to some
+# reference point specified in the calibration data). The conversion is an affine transform per axis:
 #
-# (The calibration file ~/HomeCageSinglePellet/config/3D_reconstruction_calibration.txt
-#  specifies lines in the y direction that separate our frames into 3 different zones
-#   (left mirror, right mirror, center)).
+#   x = (x_pixel - xOriginActual) / pixelsMmXActual            (center view)
+#   y = (yOriginLeftMirror - y_pixel) / pixelsMmYLeftMirror    (left mirror, y grows downwards in the frame)
+#   z = (zOriginLeftMirror - z_pixel) / pixelsMmZLeftMirror    (left mirror)
 #
-# Each point is expected to be in one of these 3 zones. If a point appears in the wrong zone,
-# it is considered an error and discarded.
-def filter_trajectory_points(dataframe):
-    global LEFTSIDE
-    global RIGHTSIDE
-    global LIKELIHOOD_THRESHOLD
-    filteredPoints = []
+# Missing samples are NaN and stay NaN. The points can come from any number of reaches, so a whole video is
+# converted in one call. Returns the (N, 3) mm array and a boolean mask of the rows that have all 3 dimensions.
+def pixel_to_real_world(pixelPoints, calibration):
 
-    for row in range(0, len(dataframe.index) - 1):
+    origin = np.array([calibration.xOriginActual, calibration.yOriginLeftMirror, calibration.zOriginLeftMirror],
+                      dtype=float)
+    pixelsPerMm = np.array([calibration.pixelsMmXActual, calibration.pixelsMmYLeftMirror,
+                            calibration.pixelsMmZLeftMirror])
+    direction = np.array([1.0, -1.0, -1.0])
 
-        framePoints = []
-        h5ColIndex = 0
+    realWorld = (np.asarray(pixelPoints, dtype=float).reshape(-1, 3) - origin) / pixelsPerMm * direction
+    complete = ~np.isnan(realWorld).any(axis=1)
+    return realWorld, complete
 
-        # Filter left mirror paw points
-        for i in range(0, 5):
-            x = dataframe.iat[row, h5ColIndex]
-            y = dataframe.iat[row, h5ColIndex + 1]
-            l = dataframe.iat[row, h5ColIndex + 2]
-            if (x <= LEFTSIDE and l >= LIKELIHOOD_THRESHOLD):
-                framePoints.append(Point(x, y, l))
-            else:
-                framePoints.append(-1)
-            h5ColIndex += 3
-
-        # Filter points for center paw
-        for i in range(0, 5):
-            x = dataframe.iat[row, h5ColIndex]
-            y = dataframe.iat[row, h5ColIndex + 1]
-            l = dataframe.iat[row, h5ColIndex + 2]
-            if (x >= LEFTSIDE and x <= RIGHTSIDE and l >= LIKELIHOOD_THRESHOLD):
-                framePoints.append(Point(x, y, l))
-            else:
-                framePoints.append(-1)
-            h5ColIndex += 3
-
-        # Filter points for right paw
-        for i in range(0, 5):
-            x = dataframe.iat[row, h5ColIndex]
-            y = dataframe.iat[row, h5ColIndex + 1]
-            l = dataframe.iat[row, h5ColIndex + 2]
-            if (x >= RIGHTSIDE and l >= LIKELIHOOD_THRESHOLD):
-                framePoints.append(Point(x, y, l))
-            else:
-                framePoints.append(-1)
-            h5ColIndex += 3
 
+# Stacks per frame x, y, z pixel lists (with -1 for a missing sample) into an (N, 3) array with NaN for missing samples.
+def stack_pixel_coords(x_points, y_points, z_points):
 
-        # Filter point for left mirror pellet
-        x = dataframe.iat[row, h5ColIndex]
-        y = dataframe.iat[row, h5ColIndex + 1]
-        l = dataframe.iat[row, h5ColIndex + 2]
+    if(not (len(x_points) == len(y_points) == len(z_points))):
+        raise ValueError("stack_pixel_coords(): Coordinate list lengths do not match")
 
-        if (x <= LEFTSIDE and l >= LIKELIHOOD_THRESHOLD):
-            framePoints.append(Point(x, y, l))
-        else:
-            framePoints.append(-1)
-        h5ColIndex += 3
+    pixelPoints = np.column_stack((x_points, y_points, z_points)).astype(float).reshape(-1, 3)
+    pixelPoints[pixelPoints == -1] = np.nan
+    return pixelPoints
 
-        # Filter point for center pellet
-        x = dataframe.iat[row, h5ColIndex]
-        y = dataframe.iat[row, h5ColIndex + 1]
-        l = dataframe.iat[row, h5ColIndex + 2]
 
-        if (l >= LIKELIHOOD_THRESHOLD):
-            framePoints.append(Point(x, y, l))
-        else:
-            framePoints.append(-1)
-        h5ColIndex += 3
+# Converts the pixel coordinates of a single reach to mm and drops the frames missing a dimension.
+# Returns x, y and z lists.
+def convert_pixelCoord_to_realWorld(x_points, y_points, z_points, calibration):
 
-        # Filter point for right mirror pellet
-        x = dataframe.iat[row, h5ColIndex]
-        y = dataframe.iat[row, h5ColIndex + 1]
-        l = dataframe.iat[row, h5ColIndex + 2]
+    realWorld, complete = pixel_to_real_world(stack_pixel_coords(x_points, y_points, z_points), calibration)
+    realWorld = realWorld[complete]
+    return realWorld[:, 0].tolist(), realWorld[:, 1].tolist(), realWorld[:, 2].tolist()
 
-        if (x >= RIGHTSIDE and l >= LIKELIHOOD_THRESHOLD):
-            framePoints.append(Point(x, y, l))
-        else:
-            framePoints.append(-1)
-        h5ColIndex += 3
 
+# Reconstructs every reach in <events> in one conversion and stores the mm trajectories in event.xVals/yVals/zVals.
+# <pointArray> is the output of filter_trajectory_arrays(). Frames missing a dimension are dropped, same as
+# convert_pixelCoord_to_realWorld().
+def reconstruct_events(events, pointArray, calibration, reachingHand, fill="ffill"):
 
+    if not events:
+        return
 
-        # Filter points for center face
-        for i in range(0, 6):
-            x = dataframe.iat[row, h5ColIndex]
-            y = dataframe.iat[row, h5ColIndex + 1]
-            l = dataframe.iat[row, h5ColIndex + 2]
-            if (x >= LEFTSIDE and x <= RIGHTSIDE and l >= LIKELIHOOD_THRESHOLD):
-                framePoints.append(Point(x, y, l))
-            else:
-                framePoints.append(-1)
-            h5ColIndex += 3
+    pixelPoints, lengths = reconstruct_trajectories(events, pointArray, reachingHand, fill)
+    realWorld, complete = pixel_to_real_world(pixelPoints, calibration)
+    bounds = np.cumsum(lengths)[:-1]
+    for event, eventPoints, eventComplete in zip(events, np.split(realWorld, bounds), np.split(complete, bounds)):
+        eventPoints = eventPoints[eventComplete]
+        event.xVals = eventPoints[:, 0].tolist()
+        event.yVals = eventPoints[:, 1].tolist()
+        event.zVals = eventPoints[:, 2].tolist()
+
+
+# Reads the dominant hand ("LEFT" or "RIGHT") from the profile of the animal <videoPath> belongs to
+# (<animal_profile>/<name>_save.txt, with the video in <animal_profile>/<some directory>/). Returns None if
+# there's no profile or it doesn't say.
+def load_dominant_hand(videoPath):
+
+    profileDirectory = os.path.dirname(os.path.dirname(os.path.abspath(videoPath)))
+    saveFile = os.path.join(profileDirectory, os.path.basename(profileDirectory) + "_save.txt")
+    if not os.path.isfile(saveFile):
+        return None
 
+    with open(saveFile) as f:
+        profileState = [line.strip() for line in f.readlines()]
+    if len(profileState) > 5 and profileState[5] in HANDS:
+        return profileState[5]
+    return None
 
-        filteredPoints.append(framePoints)
 
 
-    return filteredPoints
+# -----------------------------------------------------------------------------#
+# All functions below this line are NOT generic and must be rewritten based on #
+# use case.																       #
+# ------------------------------------------------------------------------------#
+
 
+# Zone each of the 24 DeepLabCut body parts is expected in (None = anywhere in the frame):
+# 5 left mirror paw points, 5 center paw points, 5 right mirror paw points, 3 pellet points
+# (left mirror, center, right mirror) and 6 center face points.
+BODYPART_ZONES = ["LEFT"] * 5 + ["CENTER"] * 5 + ["RIGHT"] * 5 + ["LEFT", None, "RIGHT"] + ["CENTER"] * 6
 
 
-# This function takes the filtered deeplabcut h5 output for a reaching event
-# and creates the (x,y,z) coordinates for the reach trajectory.
+# This function filters the raw deeplabcut h5 output for a particular video to remove
+# any erroneous points.
+#
+# (The calibration file ~/HomeCageSinglePellet/config/3D_reconstruction_calibration.txt
+#  specifies lines in the y direction that separate our frames into 3 different zones
+#   (left mirror, right mirror, center)).
 #
-# 1. Use the pixel x coordinate in the left/right mirror as the z data for trajectory reconstruction.
-# 2. Use the pixel y coordinate in the left/right mirror as the y data for trajectory reconstruction.
-# 3. Use the pixel x coordinate in the center view as the x data for trajectory reconstruction.
+# Each point is expected to be in one of these 3 zones. If a point appears in the wrong zone,
+# or its likelihood is below LIKELIHOOD_THRESHOLD, it is considered an error and discarded.
 #
-def gen_reach_trajectory_reconsutrction_xyz(event, points, reachingHand):
-
-    x_points = []
-    y_points = []
-    z_points = []
-    last_x = None
-    last_y = None
-    last_z = None
-
-
-    for frameIndex in range(event.startFrame, event.stopFrame + 1):
-
-        frameX = 0
-        frameY = 0
-        frameZ = 0
-        tempN = 0
-
-
-        if(reachingHand == "LEFT"):
-            # Get Y from Left Mirror Paw
-            for point in range(1,3):
-                if points[frameIndex][point] != -1:
-                    frameY += points[frameIndex][point].y
-                    tempN += 1
-            if(tempN != 0):
-                frameY = frameY / tempN
-                tempN = 0
-
-            # Get Z from Left Mirror Paw
-            for point in range(1,3):
-                if points[frameIndex][point] != -1:
-                    frameZ += points[frameIndex][point].x
-                    tempN += 1
-            if(tempN != 0):
-                frameZ = frameZ / tempN
-                tempN = 0
-
-            # Get X from Center Paw
-            for point in range(7,9):
-                if points[frameIndex][point] != -1:
-                    frameX += points[frameIndex][point].x
-                    tempN += 1
-            if(tempN !=0):
-                frameX = frameX / tempN
-                tempN = 0
-
-        elif(reachingHand == "RIGHT"):
-
-            # Get Y from Right Mirror Paw
-            for point in range(12, 13):
-                if points[frameIndex][point] != -1:
-                    frameY += points[frameIndex][point].y
-                    tempN += 1
-            if (tempN != 0):
-                frameY = frameY / tempN
-                tempN = 0
-
-            # Get Z from Right Mirror Paw
-            for point in range(12, 13):
-                if points[frameIndex][point] != -1:
-                    frameZ += points[frameIndex][point].x
-                    tempN += 1
-            if (tempN != 0):
-                frameZ = frameZ / tempN
-                tempN = 0
-
-            # Get X from Center Paw
-            for point in range(5, 10):
-                if points[frameIndex][point] != -1:
-                    frameX += points[frameIndex][point].x
-                    tempN += 1
-            if (tempN != 0):
-                frameX = frameX / tempN
-                tempN = 0
-
-
-        if(last_x == None and frameX > 0):
-                last_x = frameX
-
-        if(last_y == None and frameY > 0):
-                last_y = frameY
-
-        if(last_z == None and frameZ > 0):
-                last_z = frameZ
-
-
-
-
-        if(frameX > 0):
-            x_points.append(frameX)
-            last_x = frameX
-        elif(last_x != None):
-            x_points.append(last_x)
-        else:
-            x_points.append(-1)
-            last_x = None
-
-        if(frameY > 0):
-            y_points.append(frameY)
-            last_y = frameY
-        elif(last_y != None):
-            y_points.append(last_y)
-        else:
-            y_points.append(-1)
-            last_y = None
-
-        if(frameZ > 0):
-            z_points.append(frameZ)
-            last_z = frameZ
-        elif(last_z != None):
-            z_points.append(last_z)
+# Returns a (frames, 24, 3) array of (x, y, likelihood) per body part, with NaN for discarded points.
+# Like it always has, the last frame of the h5 is left out.
+def filter_trajectory_arrays(dataframe, calibration):
+
+    nParts = len(BODYPART_ZONES)
+    pointArray = dataframe.values[:len(dataframe.index) - 1, :nParts * 3].astype(float).reshape(-1, nParts, 3)
+    x = pointArray[:, :, 0]
+    zones = np.array([zone or "" for zone in BODYPART_ZONES])
+
+    inZone = np.ones(x.shape, dtype=bool)
+    with np.errstate(invalid="ignore"):
+        inZone[:, zones == "LEFT"] = x[:, zones == "LEFT"] <= calibration.leftSide
+        inZone[:, zones == "CENTER"] = ((x[:, zones == "CENTER"] >= calibration.leftSide) &
+                                        (x[:, zones == "CENTER"] <= calibration.rightSide))
+        inZone[:, zones == "RIGHT"] = x[:, zones == "RIGHT"] >= calibration.rightSide
+        valid = inZone & (pointArray[:, :, 2] >= LIKELIHOOD_THRESHOLD)
+
+    pointArray[~valid] = np.nan
+    return pointArray
+
+
+# Converts the output of filter_trajectory_arrays() into the per frame lists of Points (-1 for a discarded point)
+# used by extractEvents() and the display functions.
+def filtered_point_lists(pointArray):
+
+    valid = ~np.isnan(pointArray[:, :, 2])
+    return [[Point(x, y, l) if ok else -1 for (x, y, l), ok in zip(frame, frameValid)]
+            for frame, frameValid in zip(pointArray.tolist(), valid.tolist())]
+
+
+def filter_trajectory_points(dataframe, calibration):
+
+    return filtered_point_lists(filter_trajectory_arrays(dataframe, calibration))
+
+
+
+# Body parts averaged for each reconstruction axis, per reaching hand, as (x parts, y parts, z parts).
+# 1. The pixel x coordinate in the left/right mirror is the z data for trajectory reconstruction.
+# 2. The pixel y coordinate in the left/right mirror is the y data for trajectory reconstruction.
+# 3. The pixel x coordinate in the center view is the x data for trajectory reconstruction.
+HANDS = ("LEFT", "RIGHT")
+HAND_PARTS = {"LEFT": ([7, 8], [1, 2], [1, 2]), "RIGHT": ([5, 6, 7, 8, 9], [12], [12])}
+# Which pixel coordinate (0 = x, 1 = y) each reconstruction axis (x, y, z) is read from.
+AXIS_COORDINATES = (0, 1, 0)
+GAP_FILL_METHODS = ("ffill", "linear", "spline")
+
+
+# Computes the pixel (x, y, z) of both hands for every frame of <pointArray> (see filter_trajectory_arrays()) in
+# one pass: a masked mean over each hand's body parts per axis. Returns a (frames, 2, 3) array indexed by
+# HANDS, with NaN where none of the parts were found (or the mean isn't a positive pixel coordinate).
+def hand_coordinates(pointArray):
+
+    nParts = pointArray.shape[1]
+    # One selection column per (hand, axis) over the x coordinates then the y coordinates of every part.
+    selection = np.zeros((2 * nParts, len(HANDS) * 3))
+    for h, hand in enumerate(HANDS):
+        for axis, parts in enumerate(HAND_PARTS[hand]):
+            selection[AXIS_COORDINATES[axis] * nParts + np.asarray(parts), h * 3 + axis] = 1
+
+    coords = np.concatenate((pointArray[:, :, 0], pointArray[:, :, 1]), axis=1)
+    valid = ~np.isnan(coords)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(valid, coords, 0).dot(selection) / valid.dot(selection)
+        means[~(means > 0)] = np.nan
+
+    return means.reshape(-1, len(HANDS), 3)
+
+
+# Fills the NaN gaps in each column of <values>. Rows are grouped into reaches, rows [groupStarts[i], groupEnds[i])
+# being the reach row i belongs to, and gaps are never filled across reaches.
+#   ffill: Repeat the last value before the gap.
+#   linear: Interpolate linearly between the values on either side of the gap.
+#   spline: Interpolate with a cubic spline through the reach's values (needs scipy, falls back to linear).
+# With every method gaps at the end of a reach hold the last value, and gaps at the start stay NaN.
+def fill_gaps(values, groupStarts, groupEnds, method="ffill"):
+
+    if method not in GAP_FILL_METHODS:
+        raise ValueError("Unknown gap fill method " + str(method) + ", expected one of " + ", ".join(GAP_FILL_METHODS))
+
+    if method == "spline":
+        try:
+            from scipy.interpolate import CubicSpline
+        except ImportError:
+            print("scipy isn't installed, using linear gap interpolation")
+            method = "linear"
+
+    n = len(values)
+    index = np.arange(n)
+    filled = np.array(values, dtype=float)
+    for column in filled.T:
+        valid = ~np.isnan(column)
+        previous = np.maximum.accumulate(np.where(valid, index, -1))
+        following = np.minimum.accumulate(np.where(valid, index, n)[::-1])[::-1]
+        hasPrevious = ~valid & (previous >= groupStarts)
+        hasFollowing = following < groupEnds
+        previousValues = column[np.clip(previous, 0, n - 1)]
+
+        if method == "ffill":
+            column[hasPrevious] = previousValues[hasPrevious]
+            continue
+
+        interior = hasPrevious & hasFollowing
+        trailing = hasPrevious & ~hasFollowing
+        if method == "linear":
+            followingValues = column[np.clip(following, 0, n - 1)]
+            fraction = (index - previous)[interior] / (following - previous)[interior].astype(float)
+            column[interior] = previousValues[interior] + (followingValues[interior] - previousValues[interior]) * fraction
         else:
-            z_points.append(-1)
-            last_z = None
+            for start in np.unique(groupStarts[interior]):
+                group = (groupStarts == start)
+                known = group & valid
+                if np.count_nonzero(known) < 2:
+                    continue
+                gaps = group & interior
+                column[gaps] = CubicSpline(index[known], column[known])(index[gaps])
+        column[trailing] = previousValues[trailing]
 
+    return filled
+
+
+# Builds the pixel (x, y, z) trajectory of <reachingHand> for every reach in <events> in one array operation.
+# Frames past the end of the filtered points are treated as missing. Returns the (N, 3) array of every reach's frames
+# back to back (NaN where missing, after gap filling) and the number of frames in each reach.
+def reconstruct_trajectories(events, pointArray, reachingHand, fill="ffill"):
+
+    lengths = [event.stopFrame - event.startFrame + 1 for event in events]
+    frames = np.concatenate([np.arange(event.startFrame, event.stopFrame + 1) for event in events])
+    inRange = frames < len(pointArray)
+    eventPoints = np.full((len(frames),) + pointArray.shape[1:], np.nan)
+    eventPoints[inRange] = pointArray[frames[inRange]]
+
+    pixelPoints = hand_coordinates(eventPoints)[:, HANDS.index(reachingHand)]
+    groupStarts = np.repeat(np.cumsum([0] + lengths[:-1]), lengths)
+    groupEnds = np.repeat(np.cumsum(lengths), lengths)
+    return fill_gaps(pixelPoints, groupStarts, groupEnds, fill), lengths
 
-    if(not (len(x_points) == len(y_points) == len(z_points))):
-        print("Error: gen_reach_trajectory_reconstruction_xyz(): Coordinate list lengths do not match")
-        exit()
 
-    return x_points, y_points, z_points
 # ----------------------------------------------------------------------------------#
 
 
@@ -1185,82 +1011,170 @@ def extract_vid_range(start, stop, video, ghostTrailPoints, filteredPoints, colo
 
 
 
-# The main funtion is reasonably well laid out, and takes the script in order through
-# the high-level functions that the script performs. The print functions generally describe what's going on.
-def main():
+# Default locations for a video's session event log and kinalyze's run log / profiles, next to the animal's other logs.
+def default_log_directory(videoPath):
+
+    return os.path.join(os.path.dirname(os.path.abspath(videoPath)), "..", "Logs")
+
+
+def default_events_path(videoPath):
 
+    return os.path.join(default_log_directory(videoPath), os.path.splitext(os.path.basename(videoPath))[0] + "_events.jsonl")
 
-    if(PERFORM_CALIBRATION):
+
+# analyze() is reasonably well laid out, and takes the script in order through
+# the high-level functions that the script performs. The print functions generally describe what's going on.
+# Returns the list of ReachEvents found in the video, with their reconstructions.
+def analyze(videoPath, h5Path, outputPath=None, displayVideos=False, displayGraphs=False, extractVideoClips=False,
+            genCsv=True, performCalibration=False, eventsPath=None, runLogPath=None, profiler=None,
+            profileDirectory=None, reachingHand=None, gapFill="ffill"):
+
+    if outputPath is None:
+        outputPath = os.path.splitext(videoPath)[0] + "_reaches.txt"
+    if eventsPath is None:
+        eventsPath = default_events_path(videoPath)
+    logDirectory = default_log_directory(videoPath)
+    if runLogPath is None:
+        runLogPath = os.path.join(logDirectory, "kinalyze_runs.jsonl")
+    if profileDirectory is None:
+        profileDirectory = os.path.join(logDirectory, "profiles")
+    if reachingHand is None:
+        reachingHand = load_dominant_hand(videoPath)
+        if reachingHand is None:
+            print("No dominant hand found in the animal's profile, reconstructing the LEFT hand")
+            reachingHand = "LEFT"
+    instrumentation = RunInstrumentation(videoPath, profiler=profiler, profileDirectory=profileDirectory)
+
+    # Load the video
+    with instrumentation.stage("open_video"):
+        video = cv2.VideoCapture(videoPath)
+        frameCount = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = video.get(cv2.CAP_PROP_FPS)
+
+    # Load deeplabcut h5 file for video
+    print("Loading DeepLabCut data...")
+    with instrumentation.stage("load_h5"):
+        dataframe = pd.read_hdf(h5Path)
+    with instrumentation.stage("write_h5_csv"):
+        dataframe.to_csv(h5Path[:-3] + ".csv")
+    print("DeepLabCut data loaded")
+
+    if(performCalibration):
         ret, calibrationFrame = video.read()
         video.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        perform_manual_calibration(calibrationFrame)
-        save_calibration_data()
+        calibration = perform_manual_calibration(calibrationFrame)
+        save_calibration_data(calibration)
     else:
         print("Loading calibration data...")
-        load_calibration_data()
+        with instrumentation.stage("load_calibration"):
+            calibration = load_calibration_data()
         print("Calibration data loaded.")
 
     labels, nLabels = get_labels(dataframe)
     colors = gen_point_colors(nLabels)
     ghostTrailPoints = gen_ghost_trail_point_lists(nLabels)
     print("Filtering DeepLabCut points...")
-    filteredPoints = filter_trajectory_points(dataframe)
+    with instrumentation.stage("filter", frames=len(dataframe.index)):
+        pointArray = filter_trajectory_arrays(dataframe, calibration)
+        filteredPoints = filtered_point_lists(pointArray)
     print("DeepLabCut points filtered")
 
     # Extract reaching events
     print("Finding reaches...")
-    events = extractEvents([0, 1, 2, 3, 4], [5, 6, 7, 8, 9], [10, 11, 12, 13, 14], filteredPoints, "reachingReconstruction")
+    with instrumentation.stage("segment", frames=len(filteredPoints)) as record:
+        events = extractEvents([0, 1, 2, 3, 4], [5, 6, 7, 8, 9], [10, 11, 12, 13, 14], filteredPoints, "reachingReconstruction")
+        record["reaches"] = len(events)
     print("Reaches found: " + str(len(events)))
 
     print("Computing 3D reconstructions...")
-    for event in events:
-        x, y, z = gen_reach_trajectory_reconsutrction_xyz(event, filteredPoints, "LEFT")
-        x, y, z = convert_pixelCoord_to_realWorld(x, y, z)
-        event.xVals = x
-        event.yVals = y
-        event.zVals = z
+    with instrumentation.stage("reconstruct", reaches=len(events), hand=reachingHand, gap_fill=gapFill):
+        reconstruct_events(events, pointArray, calibration, reachingHand, gapFill)
     print("3D reconstructions completed")
 
+    # Line reaches up with the pellet presentations recorded by the session event log. This goes in its own file
+    # so the format of the reach file stays the same.
+    with instrumentation.stage("align_presentations"):
+        presentationFrames = load_pellet_presentation_frames(eventsPath)
+        if presentationFrames and genCsv:
+            print("Aligning reaches to " + str(len(presentationFrames)) + " pellet presentations...")
+            alignedReaches = align_reaches_to_presentations(events, presentationFrames)
+            save_presentation_alignment(alignedReaches, os.path.splitext(outputPath)[0] + "_pellet_alignment.csv")
+
     # Gen output for each event
     print("Generating output...")
-    for event in events:
+    with instrumentation.stage("output"):
+        for event in events:
 
 
-        if(DISPLAY_VIDEOS):
-            review_event(event, VIDEO_PATH, video, filteredPoints)
-            cv2.waitKey(0)
-        if(DISPLAY_GRAPHS):
-            spawn_3D_graph(np.asarray(event.xVals), np.asarray(event.yVals), np.asarray(event.zVals), event.startFrame)
-            cv2.waitKey(0)
-        if(EXTRACT_VIDEO_CLIPS):
-            extract_vid_range(event.startFrame, event.stopFrame, video, ghostTrailPoints, filteredPoints, colors,str(event.startFrame))
-        if(GEN_CSV):
-            with open(OUTPUT_PATH, 'a', newline='') as outputFile:
+            if(displayVideos):
+                review_event(event, videoPath, video, filteredPoints)
+                cv2.waitKey(0)
+            if(displayGraphs):
+                spawn_3D_graph(np.asarray(event.xVals), np.asarray(event.yVals), np.asarray(event.zVals), event.startFrame)
+                cv2.waitKey(0)
+            if(extractVideoClips):
+                extract_vid_range(event.startFrame, event.stopFrame, video, ghostTrailPoints, filteredPoints, colors,str(event.startFrame))
+            if(genCsv):
+                with open(outputPath, 'a', newline='') as outputFile:
 
-                outputFile.write(str(event.startFrame) + "\n")
-                outputFile.write(str(event.stopFrame) + "\n")
-                outputFile.write(str("UNSCORED") + "\n")
-                wr = csv.writer(outputFile)
+                    outputFile.write(str(event.startFrame) + "\n")
+                    outputFile.write(str(event.stopFrame) + "\n")
+                    outputFile.write(str("UNSCORED") + "\n")
+                    wr = csv.writer(outputFile)
 
-                s = event.startFrame
-                j = 24
+                    s = event.startFrame
+                    j = 24
 
 
-                for i in range(0, len(event.xVals)):
-                    line = []
-                    line.append(event.xVals[i])
-                    line.append(event.yVals[i])
-                    line.append(event.zVals[i])
+                    for i in range(0, len(event.xVals)):
+                        line = []
+                        line.append(event.xVals[i])
+                        line.append(event.yVals[i])
+                        line.append(event.zVals[i])
 
-                    for x in range(0,j):
-                        line.append(dataframe.iat[s, x])
-                    s+= 1
+                        for x in range(0,j):
+                            line.append(dataframe.iat[s, x])
+                        s+= 1
 
-                    wr.writerow(line)
+                        wr.writerow(line)
 
-                outputFile.write("\n\n")
+                    outputFile.write("\n\n")
 
+    summary = instrumentation.append_to_run_log(runLogPath, frames=frameCount, fps=fps, reaches=len(events))
+    for stage in summary["stages"]:
+        print("{:<20} {:>8.2f}s {:>8.1f} MB".format(stage["stage"], stage["seconds"], stage["peak_rss_mb"]))
     print("Done")
+    video.release()
+    return events
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Find the reaches in a video from its DeepLabCut output and reconstruct their 3D trajectories.")
+    parser.add_argument("video", help="Video being analyzed.")
+    parser.add_argument("h5", help="DeepLabCut h5 output for the video.")
+    parser.add_argument("--output", help="Reach data text file (default <video>_reaches.txt).")
+    parser.add_argument("--display-videos", action="store_true", help="Display each reach.")
+    parser.add_argument("--display-graphs", action="store_true", help="Display the 3D reconstruction of each reach.")
+    parser.add_argument("--extract-clips", action="store_true", help="Save each reach as a video.")
+    parser.add_argument("--no-csv", action="store_true", help="Don't write the reach data text file.")
+    parser.add_argument("--calibrate", action="store_true", help="Perform manual calibration before analyzing.")
+    parser.add_argument("--hand", choices=list(HANDS),
+                        help="Hand to reconstruct (default the dominant hand in the animal's profile, else LEFT).")
+    parser.add_argument("--gap-fill", choices=list(GAP_FILL_METHODS), default="ffill",
+                        help="How gaps in a reach's trajectory are filled (default ffill).")
+    parser.add_argument("--events", help="Session event log written by main.py (default <animal>/Logs/<video>_events.jsonl).")
+    parser.add_argument("--run-log", default=os.environ.get("KINALYZE_RUN_LOG"),
+                        help="Per stage timing log (default <animal>/Logs/kinalyze_runs.jsonl).")
+    parser.add_argument("--profile", choices=["cprofile", "pyinstrument"], default=os.environ.get("KINALYZE_PROFILE") or None,
+                        help="Profile every stage.")
+    parser.add_argument("--profile-dir", default=os.environ.get("KINALYZE_PROFILE_DIR"),
+                        help="Where profiles are saved (default <animal>/Logs/profiles/).")
+    args = parser.parse_args()
+
+    analyze(args.video, args.h5, args.output, args.display_videos, args.display_graphs, args.extract_clips,
+            not args.no_csv, args.calibrate, args.events, args.run_log, args.profile, args.profile_dir, args.hand,
+            args.gap_fill)
 
 
 
@@ -0,0 +1,291 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import argparse
+import bisect
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from tqdm import tqdm
+
+
+"""
+    Runs the pellet classifier over archived session videos and records when the pellet was on the platform.
+
+        python pelletTimeline.py [videos...] [--profiles ../../AnimalProfiles] [--stride 10] [--workers 4]
+
+    analyze_videos.sh runs it on each video right after kinalyze, while the video is still the raw recording in
+    <profile>/Videos/, and moves its output into <profile>/Analyses/<video>/ with everything else. Run without
+    arguments it does every video in <profiles>/*/Videos/ and <profiles>/*/Analyses/*/ that hasn't been scored yet
+    (remakeVideo.py cuts scored videos down to their reaches, after which the classifier would see a different video
+    than the one the reach frame numbers refer to).
+
+    Every video is decoded once, front to back, and every <stride>th frame's pellet crop is classified in batches.
+    The result is saved next to the video as <video>_pellet_timeline.json, run length encoded:
+
+        {"video": ..., "frames": 54000, "fps": 140.0, "stride": 10, "threshold": 0.5, "model": ...,
+         "runs": [[0, 1230, 0], [1230, 1870, 1], ...]}
+
+    Each run is [first frame, frame after the last, pellet present]. A sampled frame's state is taken to last until
+    the next sample.
+
+    If kinalyze has found reaches in the video (<video>_reaches.txt next to the video) the timeline is merged with them
+    into <video>_pellet_reaches.csv in the same folder: the pellet's state just before each reach
+    and <settle> frames after it, and whether the reach removed the pellet. The classifier can't tell a pellet that
+    was eaten from one that was knocked off the platform, but only reaches that removed the pellet need scoring for
+    that.
+
+    Videos whose timeline exists, is newer than the video and was made with the same stride, threshold and model are
+    skipped, so the script can be stopped and rerun. The merge is redone for every video each run, since kinalyze may
+    have been run since. Videos are processed in parallel, one per worker process.
+"""
+
+
+CLIENT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client")
+TIMELINE_SUFFIX = "_pellet_timeline.json"
+MERGED_SUFFIX = "_pellet_reaches.csv"
+VIDEO_EXTENSIONS = (".avi", ".mp4")
+
+# Set in each worker process by init_worker().
+classifier = None
+
+
+def load_classifier(modelPath):
+
+    if CLIENT_DIRECTORY not in sys.path:
+        sys.path.insert(0, CLIENT_DIRECTORY)
+    import pelletInference
+    return pelletInference.load_classifier(modelPath)
+
+
+def init_worker(modelPath):
+
+    global classifier
+    classifier = load_classifier(modelPath)
+
+
+# Raw videos waiting for analysis in <profile>/Videos/, and analysed videos in <profile>/Analyses/<video>/ that
+# haven't been scored (and so haven't been cut by remakeVideo.py).
+def find_videos(profilesDirectory):
+
+    videos = []
+    for extension in VIDEO_EXTENSIONS:
+        videos.extend(glob.glob(os.path.join(profilesDirectory, "*", "Videos", "*" + extension)))
+        for videoPath in glob.glob(os.path.join(profilesDirectory, "*", "Analyses", "*", "*" + extension)):
+            name = os.path.splitext(os.path.basename(videoPath))[0]
+            if name == os.path.basename(os.path.dirname(videoPath)) and \
+                    not os.path.isfile(os.path.splitext(videoPath)[0] + "_reaches_scored.txt"):
+                videos.append(videoPath)
+    return sorted(videos)
+
+
+def timeline_path(videoPath):
+
+    return os.path.splitext(videoPath)[0] + TIMELINE_SUFFIX
+
+
+# <video>_reaches.txt next to the video, where kinalyze writes it and where analyze_videos.sh keeps it when it
+# moves the video into <profile>/Analyses/<video>/.
+def reaches_path(videoPath):
+
+    return os.path.splitext(videoPath)[0] + "_reaches.txt"
+
+
+# Run length encodes pellet probabilities sampled at <frameIndexes> into [start, stop, present] runs.
+def encode_runs(frameIndexes, probabilities, threshold, frameCount):
+
+    runs = []
+    for frameIndex, probability in zip(frameIndexes, probabilities):
+        frameIndex = int(frameIndex)
+        present = int(probability >= threshold)
+        if runs and runs[-1][2] == present:
+            continue
+        if runs:
+            runs[-1][1] = frameIndex
+        runs.append([frameIndex, None, present])
+
+    if runs:
+        runs[-1][1] = max(frameCount, int(frameIndexes[-1]) + 1)
+    return runs
+
+
+# State of the pellet at <frame> (1 present, 0 absent), or None if <frame> is outside the timeline.
+def state_at(runs, frame):
+
+    i = bisect.bisect_right([run[0] for run in runs], frame) - 1
+    if i < 0 or frame >= runs[i][1]:
+        return None
+    return runs[i][2]
+
+
+def load_timeline(videoPath):
+
+    with open(timeline_path(videoPath)) as f:
+        return json.load(f)
+
+
+# The timeline of <videoName> in the profile at <profileDirectory>, wherever the video is in the pipeline, or None if
+# it hasn't been built.
+def find_timeline(profileDirectory, videoName):
+
+    for folder in (os.path.join(profileDirectory, "Analyses", videoName), os.path.join(profileDirectory, "Videos")):
+        for extension in VIDEO_EXTENSIONS:
+            videoPath = os.path.join(folder, videoName + extension)
+            if os.path.isfile(timeline_path(videoPath)):
+                return load_timeline(videoPath)
+    return None
+
+
+def timeline_is_current(videoPath, stride, threshold, modelPath):
+
+    path = timeline_path(videoPath)
+    if not os.path.isfile(path) or os.path.getmtime(path) < os.path.getmtime(videoPath):
+        return False
+    try:
+        timeline = load_timeline(videoPath)
+    except ValueError:
+        return False
+    return (timeline.get("stride") == stride and timeline.get("threshold") == threshold and
+            timeline.get("model") == os.path.basename(modelPath))
+
+
+# Classifies one video and writes its timeline. Runs in a worker process.
+def build_timeline(job):
+
+    import cv2
+
+    videoPath, stride, threshold, batchSize, modelPath = job
+    video = cv2.VideoCapture(videoPath)
+    frameCount = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = video.get(cv2.CAP_PROP_FPS)
+    video.release()
+
+    start = time.perf_counter()
+    frameIndexes, probabilities = classifier.predict_video(videoPath, batchSize, stride)
+    timeline = {
+        "video": os.path.basename(videoPath),
+        "frames": frameCount,
+        "fps": fps,
+        "stride": stride,
+        "threshold": threshold,
+        "model": os.path.basename(modelPath),
+        "samples": len(frameIndexes),
+        "seconds": time.perf_counter() - start,
+        "runs": encode_runs(frameIndexes, probabilities, threshold, frameCount),
+    }
+
+    # Written to a temporary file first so a killed run never leaves a truncated timeline that looks current.
+    path = timeline_path(videoPath)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(timeline, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+    return videoPath, timeline["samples"], timeline["seconds"]
+
+
+# Start and stop frame of each reach in a kinalyze reaches.txt. Each reach is a block of lines (start, stop,
+# category, trajectory rows) ended by two blank lines.
+def load_reach_intervals(reachesPath):
+
+    intervals = []
+    with open(reachesPath) as f:
+        block = []
+        for line in f:
+            line = line.strip()
+            if line:
+                block.append(line)
+            elif block:
+                intervals.append((int(block[0]), int(block[1])))
+                block = []
+        if block:
+            intervals.append((int(block[0]), int(block[1])))
+    return intervals
+
+
+def reach_outcome(before, after):
+
+    if before is None or after is None:
+        return "UNKNOWN"
+    if not before:
+        return "NO_PELLET"
+    return "PELLET_REMOVED" if not after else "PELLET_STAYED"
+
+
+# Writes <video>_pellet_reaches.csv next to the video's reaches.txt. Returns the number of reaches merged, or None
+# if kinalyze hasn't been run on the video.
+def merge_with_reaches(videoPath, settle):
+
+    reachesPath = reaches_path(videoPath)
+    if not os.path.isfile(reachesPath) or not os.path.isfile(timeline_path(videoPath)):
+        return None
+
+    runs = load_timeline(videoPath)["runs"]
+    intervals = load_reach_intervals(reachesPath)
+    with open(reachesPath[:-len("_reaches.txt")] + MERGED_SUFFIX, 'w', newline='') as f:
+        wr = csv.writer(f)
+        wr.writerow(["reach_start_frame", "reach_stop_frame", "pellet_before", "pellet_after", "outcome"])
+        for startFrame, stopFrame in intervals:
+            before = state_at(runs, startFrame - 1)
+            after = state_at(runs, stopFrame + settle)
+            wr.writerow([startFrame, stopFrame, "" if before is None else before, "" if after is None else after,
+                         reach_outcome(before, after)])
+    return len(intervals)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Build pellet presence timelines for archived session videos.")
+    parser.add_argument("videos", nargs="*", help="Videos to process (default every video under --profiles).")
+    parser.add_argument("--profiles", default="../../AnimalProfiles", help="AnimalProfiles directory.")
+    parser.add_argument("--model", default="pelletModel/model.h5",
+                        help="Pellet classifier weights. An exported model.npz next to it is used if there is one.")
+    parser.add_argument("--stride", type=int, default=10, help="Classify every Nth frame (default 10).")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Pellet probability threshold (default 0.5).")
+    parser.add_argument("--batch-size", type=int, default=256, help="Crops per inference batch (default 256).")
+    parser.add_argument("--settle", type=int, default=30,
+                        help="Frames after a reach ends before the pellet's state is read (default 30).")
+    parser.add_argument("--workers", type=int, default=max(1, multiprocessing.cpu_count() // 2),
+                        help="Videos processed in parallel (default half the CPUs).")
+    parser.add_argument("--force", action="store_true", help="Rebuild timelines that are already up to date.")
+    args = parser.parse_args()
+
+    videos = args.videos or find_videos(args.profiles)
+    pending = [video for video in videos
+               if args.force or not timeline_is_current(video, args.stride, args.threshold, args.model)]
+    print(str(len(videos)) + " videos, " + str(len(pending)) + " need a timeline")
+
+    if pending:
+        jobs = [(video, args.stride, args.threshold, args.batch_size, args.model) for video in pending]
+        if args.workers > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(min(args.workers, len(jobs)), init_worker, (args.model,))
+            results = pool.imap_unordered(build_timeline, jobs)
+        else:
+            pool = None
+            init_worker(args.model)
+            results = (build_timeline(job) for job in jobs)
+
+        try:
+            for videoPath, samples, seconds in tqdm(results, total=len(jobs)):
+                tqdm.write("{}: {} samples in {:.1f}s".format(os.path.basename(videoPath), samples, seconds))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    merged = 0
+    for video in videos:
+        if merge_with_reaches(video, args.settle) is not None:
+            merged += 1
+    print("Merged the timelines of " + str(merged) + " videos with their reaches")
+
+
+if __name__ == "__main__":
+    main()
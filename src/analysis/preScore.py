@@ -0,0 +1,220 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import argparse
+import csv
+import glob
+import os
+from collections import namedtuple
+
+import numpy as np
+
+import pelletTimeline
+from kinalyze import load_dominant_hand
+
+
+"""
+    Proposes a score for each reach before anyone watches it, from two things that are already on disk:
+
+        - the reach's 3D paw trajectory in <video>_reaches.txt (kinalyze), summarized like analysis.py does:
+          duration, reach frame (closest approach to the pellet), path length and max speed
+        - whether the pellet was on the platform before and after the reach (pelletTimeline.py)
+
+    Rules, in order:
+
+        pellet state unknown                    no proposal
+        trajectory too short / no movement      INVALID
+        no pellet before the reach              INVALID
+        pellet still there after the reach      ATTEMPT_<n>
+        pellet gone after the reach             SUCCESS_<n> (could also be a DROP or a KNOCK, so low confidence)
+
+    where <n> is how many reaches (up to 3) have been made at the same pellet, and the hand is the animal's dominant
+    hand. Each rule has a fixed confidence (RULE_CONFIDENCE). scoreTrials.py shows the proposal while the reach plays,
+    Enter accepts it, and with --auto-accept it labels reaches whose proposal is confident enough without showing them.
+
+        python preScore.py [--profiles ../../AnimalProfiles]
+
+    writes the proposals for every analysed video to <video>_reaches_proposed.csv, for checking the rules against
+    videos that have already been scored.
+"""
+
+
+# analysis.py's speed unit: mm per frame * 40.
+SPEED_SCALE = 40.
+# Reaches shorter than this many frames, or whose paw moves less than this many mm in total, are tracking noise.
+MIN_REACH_FRAMES = 3
+MIN_PATH_LENGTH_MM = 1.0
+MAX_ATTEMPTS = 3
+# Frames after a reach ends before the pellet's state is read, as in pelletTimeline.py.
+SETTLE_FRAMES = 30
+
+RULE_CONFIDENCE = {
+    "NO_MOVEMENT": 0.8,
+    "NO_PELLET": 0.9,
+    "PELLET_STAYED": 0.85,
+    "PELLET_REMOVED": 0.5,
+}
+
+PROPOSED_SUFFIX = "_reaches_proposed.csv"
+
+# Kinematics of one reach. Lengths in mm, speed in analysis.py's units, reachFrame relative to the reach start.
+ReachKinematics = namedtuple("ReachKinematics", ["frames", "reachFrame", "pathLength", "pathForward",
+                                                 "pathBackward", "maxSpeed"])
+# A proposed label. <rule> is the key into RULE_CONFIDENCE that produced it, None when there's no proposal.
+Proposal = namedtuple("Proposal", ["label", "confidence", "rule", "pelletBefore", "pelletAfter", "kinematics"])
+
+
+# Parses the x, y, z columns of a reach's trajectory lines (as loaded by scoreTrials.load_reaches) into an (N, 3)
+# array. Unparseable values become NaN.
+def trajectory_array(trajectoryCoords):
+
+    rows = []
+    for line in trajectoryCoords:
+        fields = line.split(",")
+        row = []
+        for field in fields[:3]:
+            try:
+                row.append(float(field))
+            except ValueError:
+                row.append(np.nan)
+        if len(row) == 3:
+            rows.append(row)
+    return np.asarray(rows, dtype=np.float64).reshape((-1, 3))
+
+
+# The per reach measures analysis.txt2Reaches() computes, in a few array operations. Missing points are skipped
+# instead of turning every sum into NaN.
+def reach_kinematics(points):
+
+    if len(points) == 0:
+        return ReachKinematics(0, None, 0.0, 0.0, 0.0, 0.0)
+
+    steps = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    steps = np.where(np.isnan(steps), 0.0, steps)
+    distances = np.sum(points ** 2, axis=1)
+    if np.all(np.isnan(distances)):
+        reachFrame = None
+        forward = 0.0
+    else:
+        reachFrame = int(np.nanargmin(distances))
+        forward = float(steps[:reachFrame].sum())
+    pathLength = float(steps.sum())
+    maxSpeed = float(steps.max()) * SPEED_SCALE if len(steps) else 0.0
+    return ReachKinematics(len(points), reachFrame, pathLength, forward, pathLength - forward, maxSpeed)
+
+
+# Which attempt at the current pellet each reach is: 1 for the first reach after the pellet appeared, 2 for the next
+# one, and so on. A reach that removed the pellet (or found none) ends the count.
+def attempt_numbers(states):
+
+    attempts = []
+    attempt = 0
+    for before, after in states:
+        attempt = attempt + 1 if before else 0
+        attempts.append(max(attempt, 1))
+        if not before or not after:
+            attempt = 0
+    return attempts
+
+
+def propose(kinematics, before, after, attempt, hand):
+
+    if before is None or after is None:
+        return Proposal(None, 0.0, None, before, after, kinematics)
+
+    if kinematics.frames < MIN_REACH_FRAMES or kinematics.pathLength < MIN_PATH_LENGTH_MM:
+        rule, label = "NO_MOVEMENT", "INVALID_" + hand
+    elif not before:
+        rule, label = "NO_PELLET", "INVALID_" + hand
+    elif after:
+        rule, label = "PELLET_STAYED", "ATTEMPT_" + str(min(attempt, MAX_ATTEMPTS)) + "_" + hand
+    else:
+        rule, label = "PELLET_REMOVED", "SUCCESS_" + str(min(attempt, MAX_ATTEMPTS)) + "_" + hand
+    return Proposal(label, RULE_CONFIDENCE[rule], rule, before, after, kinematics)
+
+
+# <profile>/Videos/<video>.avi, where the video analysed in <profile>/Analyses/<video>/ was recorded to. Only used to
+# find the profile (kinalyze.load_dominant_hand() works from a video path).
+def raw_video_path(profileDirectory, videoName):
+
+    return os.path.join(profileDirectory, "Videos", videoName + ".avi")
+
+
+# Proposes a label for each of <reaches> (scoreTrials.Reach objects) in <videoName> of the profile at
+# <profileDirectory>. Returns a list of Proposals in the same order.
+def propose_video(profileDirectory, videoName, reaches, settle=SETTLE_FRAMES):
+
+    hand = load_dominant_hand(raw_video_path(profileDirectory, videoName)) or "LEFT"
+    timeline = pelletTimeline.find_timeline(profileDirectory, videoName)
+    runs = timeline["runs"] if timeline is not None else None
+
+    states = []
+    for reach in reaches:
+        if runs is None:
+            states.append((None, None))
+        else:
+            states.append((pelletTimeline.state_at(runs, reach.start - 1),
+                           pelletTimeline.state_at(runs, reach.stop + settle)))
+
+    proposals = []
+    for reach, (before, after), attempt in zip(reaches, states, attempt_numbers(states)):
+        kinematics = reach_kinematics(trajectory_array(reach.trajectoryCoords))
+        proposals.append(propose(kinematics, before, after, attempt, hand))
+    return proposals
+
+
+def save_proposals(reaches, proposals, outputPath):
+
+    with open(outputPath, 'w', newline='') as f:
+        wr = csv.writer(f)
+        wr.writerow(["reach_start_frame", "reach_stop_frame", "scored_label", "proposed_label", "confidence", "rule",
+                     "pellet_before", "pellet_after", "reach_frame", "path_length", "max_speed"])
+        for reach, proposal in zip(reaches, proposals):
+            k = proposal.kinematics
+            wr.writerow([reach.start, reach.stop, reach.category.strip(), proposal.label or "", proposal.confidence,
+                         proposal.rule or "", "" if proposal.pelletBefore is None else proposal.pelletBefore,
+                         "" if proposal.pelletAfter is None else proposal.pelletAfter,
+                         "" if k.reachFrame is None else k.reachFrame, k.pathLength, k.maxSpeed])
+
+
+def main():
+
+    # scoreTrials is only needed for its reach file parser, and pulls in Tk.
+    from scoreTrials import load_reaches
+
+    parser = argparse.ArgumentParser(description="Propose a score for every reach kinalyze has found.")
+    parser.add_argument("--profiles", default="../../AnimalProfiles", help="AnimalProfiles directory.")
+    parser.add_argument("--settle", type=int, default=SETTLE_FRAMES,
+                        help="Frames after a reach ends before the pellet's state is read (default 30).")
+    args = parser.parse_args()
+
+    counts = {}
+    for reachesPath in sorted(glob.glob(os.path.join(args.profiles, "*", "Analyses", "*", "*_reaches.txt"))):
+        videoName = os.path.basename(reachesPath)[:-len("_reaches.txt")]
+        profileDirectory = os.path.dirname(os.path.dirname(os.path.dirname(reachesPath)))
+        reaches = load_reaches(reachesPath) or []
+        # The scored file has the same reaches plus their labels, so the proposals can be compared with them. Only
+        # the labels are taken from it: remakeVideo.py rewrites its frame indexes to match the cut video, while the
+        # pellet timeline is of the raw one.
+        scoredReaches = load_reaches(reachesPath[:-len(".txt")] + "_scored.txt")
+        if scoredReaches is not None:
+            if len(scoredReaches) == len(reaches):
+                for reach, scoredReach in zip(reaches, scoredReaches):
+                    reach.category = scoredReach.category
+            else:
+                print(videoName + ": scored file doesn't have the same reaches, leaving the labels out")
+        proposals = propose_video(profileDirectory, videoName, reaches, args.settle)
+        save_proposals(reaches, proposals, reachesPath[:-len("_reaches.txt")] + PROPOSED_SUFFIX)
+        for proposal in proposals:
+            counts[proposal.rule] = counts.get(proposal.rule, 0) + 1
+
+    for rule, count in sorted(counts.items(), key=lambda item: str(item[0])):
+        print("{:<16} {}".format(rule or "NO_PROPOSAL", count))
+
+
+if __name__ == "__main__":
+    main()
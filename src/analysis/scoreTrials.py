@@ -5,11 +5,17 @@
 """
 
 import analysis
+import preScore
+import scoringJournal
+import scoringLabels
 from tkinter import *
 import PIL
 from PIL import ImageTk
 import cv2
 import os, sys
+import argparse
+import queue
+import threading
 
 
 # This file defines and implements a GUI that allows the user to load session information from a particular session, from a particular animal,
@@ -17,8 +23,14 @@ import os, sys
 #
 # 1. Select an animal to score videos for.
 # 2. Select a video to score.
-# 3. Use the hotkeys or buttons to score all the reaches in that video.
-# 4. After you score the last reach for a video, the scoring data for that video is saved.
+# 3. Use the hotkeys or buttons to score all the reaches in that video. If preScore.py could propose a score for a reach
+#    it's shown on the video, and Enter accepts it. Run with --auto-accept <confidence> to skip confident ones.
+#    Backspace undoes the last label. The labels and their keys are in scoringLabels.py, and the keys can be changed
+#    in config/scoringKeys.txt (or the file given with --keys).
+# 4. After you score the last reach for a video, the scoring data for that video is saved. analysis.py is run on it in
+#    the background, so you can start on the next video straight away. Every label is also written to a journal as
+#    it's given (scoringJournal.py), so if the GUI is closed part way through a video, selecting the video again
+#    picks up at the first reach that hasn't been scored.
 # 5. Repeat.
 #
 # The profiles are read from the directory specified in this function. This script expects the same ~/HomeCageSinglePellet/AnimalProfiles/ directory
@@ -56,23 +68,171 @@ class Reach(object):
 
 
 
+# Parses a reaches.txt file written by kinalyze.py into a list of Reaches. Returns None if the file doesn't exist.
+# This expects the reaching data in one exact format. It has no tolerance to changing formats.
+def load_reaches(reachFilePath):
+
+    try:
+        file = open(reachFilePath)
+    except FileNotFoundError:
+        return None
+
+    with file:
+        lines = file.readlines()
+    reachesText = []
+    temp = []
+    lastLine = ""
+
+    for line in lines:
+
+        if line + lastLine == "\n\n":
+            reachesText.append(temp)
+            temp = []
+        else:
+            temp.append(line)
+
+        lastLine = line
+
+    reaches = []
+    for text in reachesText:
+        start = int(text[0])
+        stop = int(text[1])
+        category = str(text[2])
+        trajectoryCoords = []
+        for i in range(3, len(text) - 1):
+            trajectoryCoords.append(text[i])
+
+        reaches.append(Reach(start, stop, trajectoryCoords,category))
+
+    return reaches
+
+
+# Most frames kept in memory for one reach. Longer reaches keep every 2nd, 3rd, ... frame so they still play from start
+# to finish. Frames are kept in grayscale (the camera is monochrome), about 0.6 MB each at 1220x500.
+MAX_CACHED_FRAMES = 150
+
+
+# Reads the frames of reaches from a video, each on its own thread with its own VideoCapture, so the next reach can
+# be read while the current one plays. Frames are added to the reach's list as they're read, so playing can start on
+# the first ones instead of waiting for the whole reach. They're kept in memory until keep() drops them.
+class ReachFrameLoader(object):
+
+    def __init__(self, videoPath):
+        self.videoPath = videoPath
+        self.lock = threading.Lock()
+        # (start, stop) -> {"ready": Event set once every frame is read, "frames": list of frames read so far,
+        #                   "stride": frames skipped per frame kept, "dropped": True once keep() let go of it}
+        self.reaches = {}
+
+    # Starts reading <reach>'s frames in the background, unless that's already been done. Returns the reach's entry
+    # straight away.
+    def prefetch(self, reach):
+        key = (reach.start, reach.stop)
+        with self.lock:
+            if key in self.reaches:
+                return self.reaches[key]
+            length = reach.stop - reach.start + 1
+            entry = {"ready": threading.Event(), "frames": [], "dropped": False,
+                     "stride": max(1, -(-length // MAX_CACHED_FRAMES))}
+            self.reaches[key] = entry
+
+        thread = threading.Thread(target=self.read_frames, args=(reach.start, reach.stop, entry))
+        thread.daemon = True
+        thread.start()
+        return entry
+
+    def read_frames(self, start, stop, entry):
+        cap = cv2.VideoCapture(self.videoPath)
+        try:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            for i in range(stop - start + 1):
+                if entry["dropped"]:
+                    break
+                if i % entry["stride"] != 0:
+                    if cap.grab() == False:
+                        break
+                    continue
+                ret, frame = cap.read()
+                if ret == False:
+                    break
+                if len(frame.shape) == 3:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                entry["frames"].append(frame)
+        finally:
+            cap.release()
+            entry["ready"].set()
+
+    # Forgets the frames of every reach that isn't in <reaches>, and stops reading them.
+    def keep(self, reaches):
+        keys = set((reach.start, reach.stop) for reach in reaches)
+        with self.lock:
+            for key in list(self.reaches):
+                if key not in keys:
+                    self.reaches[key]["dropped"] = True
+                    del self.reaches[key]
+
+
+# Runs analysis.py on scored videos one at a time on a background thread, so the GUI doesn't stop while they're
+# analysed.
+class AnalysisWorker(threading.Thread):
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.jobs = queue.Queue()
+
+    # Queues the analysis of the scored file at <scoredPath>. If <reaches> (see analysis.reaches2Data) is given the
+    # analysis is done from them instead of reading the file.
+    def submit(self, scoredPath, reaches=None):
+        self.jobs.put((scoredPath, reaches))
+
+    # Finishes the queued jobs and stops the worker.
+    def stop(self):
+        self.jobs.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            scoredPath, reaches = job
+            try:
+                if reaches is None:
+                    analysis.runOneFile(scoredPath, scoringLabels.LABEL_IDS)
+                else:
+                    analysis.runReaches(reaches, scoredPath, scoringLabels.LABEL_IDS)
+                print("Analysis saved for " + os.path.basename(scoredPath))
+            except Exception as e:
+                print("Analysis of " + os.path.basename(scoredPath) + " failed: " + repr(e))
+
 
 class Application(Frame):
     currentProfile = None
     currentVideo = None
     currentReaches = []
+    currentProposals = []
     currentReachIndex = None
+    currentFrames = None
+    currentFramesReady = None
     currentFrame = None
     currentStartFrame = None
     currentStopFrame = None
     font = cv2.FONT_HERSHEY_SIMPLEX
 
 
-    def __init__(self, master=None):
+    def __init__(self, master=None, autoAcceptThreshold=None, keyBindings=None):
 
         Frame.__init__(self, master)
-
-        self.cap = None
+        self.autoAcceptThreshold = autoAcceptThreshold
+        self.keyBindings = keyBindings or scoringLabels.load_key_bindings()
+        # Labels given in the current video, newest last, for undo().
+        self.history = []
+        self.playing = False
+
+        self.frameLoader = None
+        self.journal = None
+        self.analysisWorker = AnalysisWorker()
+        self.analysisWorker.start()
         self.defaultImg = cv2.imread('../../resources/Images/default.png')
         self.lmain = None
 
@@ -84,13 +244,16 @@ class Application(Frame):
         self.animalDropdownVar.trace('w', self.change_animal_dropdown)
         self.videoSelectionChanged = False
         self.createWidgets()
+        self.bind_keys()
 
 
 
     # This function gets called whenever the last reach in a video is scored.
     # It saves all the scoring data for the completed video in a new file.
     # This new file contains all the same data as the reaches.txt file, in addition
-    # to the new scoring data for each reach.
+    # to the new scoring data for each reach. The file is written from the reaches in
+    # memory, and analysis.py works from them too on self.analysisWorker instead of
+    # reading the file back, so the GUI carries on while it runs.
     def saveScoring(self):
         reaches = self.currentReaches
         self.currentReaches = []
@@ -106,783 +269,174 @@ class Application(Frame):
         if exists:
 
             print("This video has already been scored. Not overwriting existing data.\n")
+            # The file on disk is what counts, not the labels that were just given.
+            self.analysisWorker.submit(savePath)
 
         else:
 
-            with open(savePath, 'a') as f:
-
-                for reach in reaches:
-                    f.write(str(reach.start) + "\n")
-                    f.write(str(reach.stop) + "\n")
-                    f.write(str(reach.category) + "\n")
-                    for line in reach.trajectoryCoords:
-                        f.write(line)
-                    f.write("\n\n")
+            text = []
+            for reach in reaches:
+                text.append(str(reach.start) + "\n" + str(reach.stop) + "\n" + str(reach.category) + "\n")
+                text.extend(reach.trajectoryCoords)
+                text.append("\n\n")
+            # Written to a temporary file first so a crash can't leave a half written file that marks the video as
+            # scored. The journal is only deleted once the scored file is in place.
+            # (Not <savePath>.tmp, analysis.readAllFiles() would take that for a scored file.)
+            tempPath = savePath[:-len(".txt")] + ".tmp"
+            with open(tempPath, 'w') as f:
+                f.write("".join(text))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tempPath, savePath)
 
             print("Scoring saved!")
-        self.change_animal_dropdown()
-        analysis.runOneFile(savePath,{"SUCCESS_1_LEFT": 0, "SUCCESS_2_LEFT": 1, "SUCCESS_3_LEFT": 2, "ATTEMPT_1_LEFT": 3, "ATTEMPT_2_LEFT": 4, "ATTEMPT_3_LEFT": 5,"DROP_LEFT": 6,
-                                      "KNOCK_LEFT": 7,"SUCCESSFUL_LICK_LEFT": 8, "FAILED_LICK_LEFT": 9, "INVALID_LEFT": 10, "MACHINE_FAIL_LEFT": 11, "SUCCESS_1_RIGHT": 12,
-                                      "SUCCESS_2_RIGHT": 13, "SUCCESS_3_RIGHT": 14, "ATTEMPT_1_RIGHT": 15, "ATTEMPT_2_RIGHT": 16, "ATTEMPT_3_RIGHT": 17, "DROP_RIGHT": 18,
-                                      "KNOCK_RIGHT": 19, "SUCCESSFUL_LICK_RIGHT": 20, "FAILED_LICK_RIGHT": 21, "INVALID_RIGHT": 22, "MACHINE_FAIL_RIGHT": 23,
-                                      "USER_DEFINED_1": 24, "USER_DEFINED_2": 25, "USER_DEFINED_3": 26, "USER_DEFINED_4": 27, "USER_DEFINED_5": 28,
-                                      "USER_DEFINED_6": 29, "USER_DEFINED_7": 30, "USER_DEFINED_8": 31, "USER_DEFINED_9": 32,} )
+            analysisReaches = [(reach.start, reach.stop, str(reach.category), reach.trajectoryCoords) for reach in reaches]
+            self.analysisWorker.submit(savePath, analysisReaches)
+        if self.journal is not None:
+            self.journal.discard()
+            self.journal = None
+        self.mark_video_scored(self.currentVideo)
 
 
 
 
-# START OF SCORING BUTTON FUNCTIONS
+# START OF SCORING FUNCTIONS
 #-----------------------------------------------------------------------------------------------------------------------
 #-----------------------------------------------------------------------------------------------------------------------
 #
-# All the functions in this block (lines 121-864) are functions bound to scoring buttons.
-# They all do the same thing for their respective button.
-# 1. Set the appropriate category for the current reach.
-# 2. Check if it's the last reach in the current video.
+# Every scoring button and hotkey calls score_current_reach() with its category from scoringLabels.LABELS, which:
+# 1. Sets the appropriate category for the current reach and remembers the old one so it can be undone.
+# 2. Checks if it's the last reach in the current video.
 #    If it is, save the scoring information and reset all the video/reach variables.
-#    If it isn't, increment to the next reach in the video.
-#
-# There's probably a good way to use 1 function for all these buttons since they all do roughly the same
-# thing, but copy and pasting ~30 times took like 10 minutes and works fine. Sorry if you need to change these lol.
-# If you end up using this a lot, reworking all these into one overloaded function should be pretty easy.
+#    If it isn't, move on to the next reach in the video (skipping any that get auto-accepted). Its frames have
+#    usually been read in the background while the current one was playing, so it starts playing straight away.
 #-----------------------------------------------------------------------------------------------------------------------
-    def s1_left(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "SUCCESS_1_LEFT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as SUCCESS_1_LEFT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as SUCCESS_1_LEFT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-
-    def s2_left(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "SUCCESS_2_LEFT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as SUCCESS_2_LEFT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as SUCCESS_2_LEFT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def s3_left(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "SUCCESS_3_LEFT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as SUCCESS_3_LEFT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as SUCCESS_3_LEFT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def a1_left(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "ATTEMPT_1_LEFT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as ATTEMPT_1_LEFT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as ATTEMPT_1_LEFT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def a2_left(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "ATTEMPT_2_LEFT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as ATTEMPT_2_LEFT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as ATTEMPT_2_LEFT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def a3_left(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "ATTEMPT_3_LEFT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as ATTEMPT_3_LEFT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as ATTEMPT_3_LEFT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def drop_left(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "DROP_LEFT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as DROP_LEFT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as DROP_LEFT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def knock_left(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "KNOCK_LEFT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as KNOCK_LEFT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as KNOCK_LEFT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-
-    def s_lick_left(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "SUCCESSFUL_LICK_LEFT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as SUCCESSFUL_LICK_LEFT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as SUCCESSFUL_LICK_LEFT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def f_lick_left(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "FAILED_LICK_LEFT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as FAILED_LICK_LEFT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as FAILED_LICK_LEFT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def invalid_left(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "INVALID_LEFT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as INVALID_LEFT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as INVALID_LEFT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def machine_fail_left(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "MACHINE_FAIL_LEFT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as MACHINE_FAIL_LEFT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as MACHINE_FAIL_LEFT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-
-    def s1_right(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "SUCCESS_1_RIGHT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as SUCCESS_1_RIGHT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as SUCCESS_1_RIGHT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-
-    def s2_right(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "SUCCESS_2_RIGHT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as SUCCESS_2_RIGHT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as SUCCESS_2_RIGHT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def s3_right(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "SUCCESS_3_RIGHT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as SUCCESS_3_RIGHT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as SUCCESS_3_RIGHT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def a1_right(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "ATTEMPT_1_RIGHT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as ATTEMPT_1_RIGHT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as ATTEMPT_1_RIGHT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def a2_right(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "ATTEMPT_2_RIGHT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as ATTEMPT_2_RIGHT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as ATTEMPT_2_RIGHT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def a3_right(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "ATTEMPT_3_RIGHT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as ATTEMPT_3_RIGHT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as ATTEMPT_3_RIGHT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def drop_right(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "DROP_RIGHT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as DROP_RIGHT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as DROP_RIGHT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def knock_right(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "KNOCK_RIGHT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as KNOCK_RIGHT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as KNOCK_RIGHT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-
-    def s_lick_right(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "SUCCESSFUL_LICK_RIGHT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as SUCCESSFUL_LICK_RIGHT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as SUCCESSFUL_LICK_RIGHT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def f_lick_right(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "FAILED_LICK_RIGHT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as FAILED_LICK_RIGHT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as FAILED_LICK_RIGHT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def invalid_right(self, event=None):
+    def score_current_reach(self, category, event=None):
 
         if self.currentReachIndex == None:
             return 0
 
-        self.currentReaches[self.currentReachIndex].category = "INVALID_RIGHT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as INVALID_RIGHT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as INVALID_RIGHT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
+        reach = self.currentReaches[self.currentReachIndex]
+        # (reach index, category before) for every reach this label changes, so undo() can put them back.
+        changed = [(self.currentReachIndex, reach.category)]
+        self.history.append((self.currentReachIndex, changed))
+        self.set_category(self.currentReachIndex, category)
+        print("Trial marked as " + category)
+        self.next_reach(changed)
 
-    def machine_fail_right(self, event=None):
+    # Labels reach <reachIndex> and records it in the journal. Categories that aren't labels (kinalyze's UNSCORED, put
+    # back by undo()) are journaled as unscored.
+    def set_category(self, reachIndex, category):
 
-        if self.currentReachIndex == None:
-            return 0
+        reach = self.currentReaches[reachIndex]
+        reach.category = category
+        if self.journal is not None:
+            self.journal.record(reachIndex, reach, category if category in scoringLabels.LABEL_IDS else "")
 
-        self.currentReaches[self.currentReachIndex].category = "MACHINE_FAIL_RIGHT"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as MACHINE_FAIL_RIGHT")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as MACHINE_FAIL_RIGHT")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def udf1(self, event=None):
+    # Moves on to the next reach that needs a human, labelling the ones in between whose proposal is at least
+    # <autoAcceptThreshold> confident. Saves the scoring once the video is done.
+    def next_reach(self, changed=None):
 
-        if self.currentReachIndex == None:
-            return 0
+        reachIndex = self.currentReachIndex + 1
+        while reachIndex < len(self.currentReaches) and self.auto_accept(reachIndex, changed):
+            reachIndex += 1
 
-        self.currentReaches[self.currentReachIndex].category = "USER_DEFINED_1"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as USER_DEFINED_1")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as USER_DEFINED_1")
+        if reachIndex < len(self.currentReaches):
+            self.show_reach(reachIndex)
+        else:
             self.saveScoring()
             self.currentReachIndex = None
             self.currentVideo = None
-            self.cap = None
+            self.frameLoader = None
+            self.currentFrames = None
+            self.currentFramesReady = None
             self.currentFrame = None
             self.currentStartFrame = None
             self.currentStopFrame = None
+            self.history = []
 
-    def udf2(self, event=None):
+    # Makes reach <reachIndex> the one being played and starts reading the next one that will need a human.
+    def show_reach(self, reachIndex):
 
-        if self.currentReachIndex == None:
-            return 0
+        reach = self.currentReaches[reachIndex]
+        self.currentReachIndex = reachIndex
+        self.currentStartFrame = reach.start
+        self.currentStopFrame = reach.stop
+        # Usually already read. If not (the first reach, after an undo or skipping auto-accepted reaches) it plays
+        # from the first frames while the rest are read. <currentFrame> is the position in <currentFrames>.
+        entry = self.frameLoader.prefetch(reach)
+        self.currentFrames = entry["frames"]
+        self.currentFramesReady = entry["ready"]
+        self.currentFrame = 0
 
-        self.currentReaches[self.currentReachIndex].category = "USER_DEFINED_2"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as USER_DEFINED_2")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as USER_DEFINED_2")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
+        upcoming = reachIndex + 1
+        while upcoming < len(self.currentReaches) and self.would_auto_accept(upcoming):
+            upcoming += 1
+        keep = [reach]
+        if upcoming < len(self.currentReaches):
+            keep.append(self.currentReaches[upcoming])
+            self.frameLoader.prefetch(self.currentReaches[upcoming])
+        self.frameLoader.keep(keep)
 
-    def udf3(self, event=None):
+    def would_auto_accept(self, reachIndex):
 
-        if self.currentReachIndex == None:
-            return 0
+        proposal = self.current_proposal(reachIndex)
+        return self.autoAcceptThreshold is not None and proposal is not None and \
+            proposal.confidence >= self.autoAcceptThreshold
 
-        self.currentReaches[self.currentReachIndex].category = "USER_DEFINED_3"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as USER_DEFINED_3")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as USER_DEFINED_3")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
+    def auto_accept(self, reachIndex, changed=None):
 
-    def udf4(self, event=None):
+        if not self.would_auto_accept(reachIndex):
+            return False
+        proposal = self.current_proposal(reachIndex)
+        if changed is not None:
+            changed.append((reachIndex, self.currentReaches[reachIndex].category))
+        self.set_category(reachIndex, proposal.label)
+        print("Trial " + str(reachIndex + 1) + " auto-accepted as " + proposal.label +
+              " ({:.2f})".format(proposal.confidence))
+        return True
 
-        if self.currentReachIndex == None:
-            return 0
+    def current_proposal(self, reachIndex=None):
 
-        self.currentReaches[self.currentReachIndex].category = "USER_DEFINED_4"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as USER_DEFINED_4")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as USER_DEFINED_4")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
+        if reachIndex is None:
+            reachIndex = self.currentReachIndex
+        if reachIndex is None or reachIndex >= len(self.currentProposals):
+            return None
+        proposal = self.currentProposals[reachIndex]
+        return proposal if proposal.label is not None else None
 
-    def udf5(self, event=None):
+    # Bound to Enter: labels the current reach with its proposed category.
+    def accept_proposal(self, event=None):
 
-        if self.currentReachIndex == None:
+        proposal = self.current_proposal()
+        if proposal is None:
             return 0
+        return self.score_current_reach(proposal.label)
 
-        self.currentReaches[self.currentReachIndex].category = "USER_DEFINED_5"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as USER_DEFINED_5")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as USER_DEFINED_5")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-    def udf6(self, event=None):
+    # Bound to BackSpace: takes back the last label (and any reaches auto-accepted after it) and goes back to that
+    # reach. Only works until the video is saved.
+    def undo(self, event=None):
 
-        if self.currentReachIndex == None:
+        if self.currentReachIndex == None or not self.history:
             return 0
 
-        self.currentReaches[self.currentReachIndex].category = "USER_DEFINED_6"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as USER_DEFINED_6")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as USER_DEFINED_6")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
+        reachIndex, changed = self.history.pop()
+        for changedIndex, category in reversed(changed):
+            self.set_category(changedIndex, category)
+        print("Undid label of trial " + str(reachIndex + 1))
+        self.show_reach(reachIndex)
 
+    # Binds the hotkeys in <self.keyBindings> (see scoringLabels.load_key_bindings()).
+    def bind_keys(self):
 
-    def udf7(self, event=None):
+        for label in scoringLabels.LABELS:
+            self.master.bind(self.keyBindings[label.category],
+                             lambda event, category=label.category: self.score_current_reach(category))
+        self.master.bind(self.keyBindings["ACCEPT"], self.accept_proposal)
+        self.master.bind(self.keyBindings["UNDO"], self.undo)
 
-        if self.currentReachIndex == None:
-            return 0
 
-        self.currentReaches[self.currentReachIndex].category = "USER_DEFINED_7"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as USER_DEFINED_7")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as USER_DEFINED_7")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-
-    def udf8(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "USER_DEFINED_8"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as USER_DEFINED_8")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as USER_DEFINED_8")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-
-    def udf9(self, event=None):
-
-        if self.currentReachIndex == None:
-            return 0
-
-        self.currentReaches[self.currentReachIndex].category = "USER_DEFINED_9"
-        if(self.currentReachIndex < len(self.currentReaches) - 1):
-            self.currentReachIndex += 1
-            self.currentFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStartFrame = self.currentReaches[self.currentReachIndex].start
-            self.currentStopFrame = self.currentReaches[self.currentReachIndex].stop
-            print("Trial marked as USER_DEFINED_9")
-        elif(self.currentReachIndex >= len(self.currentReaches) - 1):
-            print("Trial marked as USER_DEFINED_9")
-            self.saveScoring()
-            self.currentReachIndex = None
-            self.currentVideo = None
-            self.cap = None
-            self.currentFrame = None
-            self.currentStartFrame = None
-            self.currentStopFrame = None
-
-
-
-# END OF SCORING BUTTON FUNCTIONS
+# END OF SCORING FUNCTIONS
 #-----------------------------------------------------------------------------------------------------------------------
 #-----------------------------------------------------------------------------------------------------------------------
 
@@ -891,8 +445,8 @@ class Application(Frame):
 
     # This function displays frames from the current reach to the GUI.
     # There is some logic for controlling looping of the current reach,
-    # reading the correct frame from the current video, what to do if there
-    # is no video, etc.
+    # picking the correct frame from the current reach's frames (read in the
+    # background by self.frameLoader), what to do if there is no video, etc.
     # It also paints the current reach number onto the frame for the user to see
     # how far along they are.
     #
@@ -900,23 +454,27 @@ class Application(Frame):
     # until one of the base cases is detected.
     def play_video(self, event=None):
 
-        if self.cap == None or self.currentReachIndex == None:
+        if self.frameLoader == None or self.currentReachIndex == None:
+            self.playing = False
             self.show_frame()
             return 0
+        self.playing = True
 
+        # Loop once every frame has been read (the video can end before the reach does), otherwise wait on the
+        # frame that's being read.
+        if self.currentFrame >= len(self.currentFrames):
+            if not self.currentFramesReady.is_set() or not self.currentFrames:
+                self.lmain.after(1, self.play_video)
+                return 0
+            self.currentFrame = 0
 
-
-        if self.currentFrame > self.currentStopFrame or self.currentFrame < self.currentStartFrame:
-            self.currentFrame = self.currentStartFrame
-
-
-
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.currentFrame)
-        ret, frame = self.cap.read()
-        if ret == False:
-            return 0
+        # Copied so the text isn't painted onto the frame the next loop shows.
+        frame = self.currentFrames[self.currentFrame].copy()
 
         cv2.putText(frame, "Reach:" + str(self.currentReachIndex + 1) + "/" + str(len(self.currentReaches)), (950, 40), self.font, 1, (255, 255, 255), 1, cv2.LINE_AA)
+        proposal = self.current_proposal()
+        if proposal is not None:
+            cv2.putText(frame, "Proposed: " + proposal.label + " ({:.2f}) [Enter]".format(proposal.confidence), (20, 40), self.font, 1, (255, 255, 255), 1, cv2.LINE_AA)
 
         img = PIL.Image.fromarray(frame)
         imgtk = PIL.ImageTk.PhotoImage(image=img)
@@ -967,6 +525,12 @@ class Application(Frame):
             index += 1
 
 
+    # Colours <video>'s entry in the video list as scored, without rescanning the rest of the list.
+    def mark_video_scored(self, video):
+        if self.currentProfile == -1 or video not in self.currentProfile.videoList[1]:
+            return
+        self.videoListBox.itemconfig(self.currentProfile.videoList[1].index(video), {'bg': 'dark sea green'})
+
     def find_animal_profile(self, profileName):
         for profile in self.profiles:
             if profileName == profile.profileName:
@@ -987,55 +551,51 @@ class Application(Frame):
 
         self.videoPath = '../../AnimalProfiles/' + str(
             self.currentProfile.profileName) + "/Analyses/" + self.currentVideo + "/" + self.currentVideo + ".avi"
-        self.cap = cv2.VideoCapture(self.videoPath)
+        self.frameLoader = ReachFrameLoader(self.videoPath)
+        self.history = []
+        # The labels given so far in the video that was being scored stay in its journal.
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
         self.loadVideoReachData()
-        self.play_video()
+        # Only one play_video() loop at a time, or reaches play at double speed after picking another video.
+        if not self.playing:
+            self.play_video()
 
     # This function loads the reaching data for <self.currentVideo>.
     # This function expects the reaching data in one exact format.
     # It has no tolerance to changing formats.
     def loadVideoReachData(self):
 
-        try:
-            file = open("../../AnimalProfiles/" + str(
-                self.currentProfile.profileName) + "/Analyses/" + self.currentVideo + "/" + self.currentVideo + "_reaches.txt")
-            # Store configuration file values
-        except FileNotFoundError:
+        analysisDirectory = "../../AnimalProfiles/" + str(self.currentProfile.profileName) + "/Analyses/" + self.currentVideo
+        reaches = load_reaches(analysisDirectory + "/" + self.currentVideo + "_reaches.txt")
+        if reaches is None:
             print("No reaching data found for selected video!")
             return -1
 
-        lines = file.readlines()
-        reachesText = []
-        temp = []
-        lastLine = ""
-
-        for line in lines:
-
-            if line + lastLine == "\n\n":
-                reachesText.append(temp)
-                temp = []
-            else:
-                temp.append(line)
-
-            lastLine = line
-
-        reaches = []
-        for text in reachesText:
-            start = int(text[0])
-            stop = int(text[1])
-            category = str(text[2])
-            trajectoryCoords = []
-            for i in range(3, len(text) - 1):
-                trajectoryCoords.append(text[i])
-
-            reaches.append(Reach(start, stop, trajectoryCoords,category))
+        # Put back the labels from an earlier go at this video that didn't get to the end.
+        journalPath = scoringJournal.journal_path(analysisDirectory, self.currentVideo)
+        labels = scoringJournal.load_labels(journalPath, reaches)
+        for reachIndex, label in labels.items():
+            reaches[reachIndex].category = label
+        firstUnscored = 0
+        while firstUnscored in labels:
+            firstUnscored += 1
+        if firstUnscored > 0:
+            print("Resuming at reach " + str(firstUnscored + 1) + "/" + str(len(reaches)))
+        self.journal = scoringJournal.ScoringJournal(journalPath)
 
         self.currentReaches = reaches
+        try:
+            self.currentProposals = preScore.propose_video("../../AnimalProfiles/" + str(self.currentProfile.profileName),
+                                                           self.currentVideo, reaches)
+        except (IOError, ValueError, KeyError) as e:
+            print("Couldn't propose scores for this video: " + str(e))
+            self.currentProposals = []
         if(len(self.currentReaches) > 0):
-            self.currentFrame = self.currentReaches[0].start
-            self.currentStartFrame = self.currentReaches[0].start
-            self.currentStopFrame = self.currentReaches[0].stop
-            self.currentReachIndex = 0
+            # Start just before the first unscored reach so next_reach() can skip over any auto-accepted ones.
+            self.currentReachIndex = firstUnscored - 1
+            self.next_reach()
 
 
     # All GUI elements are initialized and rendered in this function.
@@ -1060,76 +620,17 @@ class Application(Frame):
         self.lmain = Label(imageFrame)
         self.show_frame()
 
-        self.S1_LEFT = Button(buttonFrame1, text='S_1_L (q)',command=self.s1_left)
-        self.S1_LEFT.pack(side=LEFT)
-        self.S2_LEFT = Button(buttonFrame1, text='S_2_L (w)',command=self.s2_left)
-        self.S2_LEFT.pack(side=LEFT)
-        self.S3_LEFT = Button(buttonFrame1, text='S_3_L (e)',command=self.s3_left)
-        self.S3_LEFT.pack(side=LEFT)
-        self.A1_LEFT = Button(buttonFrame1, text='A_1_L (r)',command=self.a1_left)
-        self.A1_LEFT.pack(side=LEFT)
-        self.A2_LEFT = Button(buttonFrame1, text='A_2_L (t)',command=self.a2_left)
-        self.A2_LEFT.pack(side=LEFT)
-        self.A3_LEFT = Button(buttonFrame1, text='A_3_L (y)',command=self.a3_left)
-        self.A3_LEFT.pack(side=LEFT)
-        self.DROP_LEFT = Button(buttonFrame1, text='DROP_L (u)',command=self.drop_left)
-        self.DROP_LEFT.pack(side=LEFT)
-        self.KNOCK_LEFT = Button(buttonFrame1, text='KNOCK_L (i)',command=self.knock_left)
-        self.KNOCK_LEFT.pack(side=LEFT)
-        self.S_LICK_LEFT = Button(buttonFrame1, text='S_LICK_L (o)',command=self.s_lick_left)
-        self.S_LICK_LEFT.pack(side=LEFT)
-        self.F_LICK_LEFT = Button(buttonFrame1, text='F_LICK_L (p)',command=self.f_lick_left)
-        self.F_LICK_LEFT.pack(side=LEFT)
-        self.INVALID_LEFT = Button(buttonFrame1, text='INVALID_L (a)',command=self.invalid_left)
-        self.INVALID_LEFT.pack(side=LEFT)
-        self.MACHINE_FAIL_LEFT = Button(buttonFrame1, text='MACHINE_FAIL_L (s)',command=self.machine_fail_left)
-        self.MACHINE_FAIL_LEFT.pack(side=LEFT)
-
-
-        self.S1_RIGHT = Button(buttonFrame2, text='S_1_R (d)',command=self.s1_right)
-        self.S1_RIGHT.pack(side=LEFT)
-        self.S2_RIGHT = Button(buttonFrame2, text='S_2_R (f)',command=self.s2_right)
-        self.S2_RIGHT.pack(side=LEFT)
-        self.S3_RIGHT = Button(buttonFrame2, text='S_3_R (g)',command=self.s3_right)
-        self.S3_RIGHT.pack(side=LEFT)
-        self.A1_RIGHT = Button(buttonFrame2, text='A_1_R (h)',command=self.a1_right)
-        self.A1_RIGHT.pack(side=LEFT)
-        self.A2_RIGHT = Button(buttonFrame2, text='A_2_R (j)',command=self.a2_right)
-        self.A2_RIGHT.pack(side=LEFT)
-        self.A3_RIGHT = Button(buttonFrame2, text='A_3_R (k)',command=self.a3_right)
-        self.A3_RIGHT.pack(side=LEFT)
-        self.DROP_RIGHT = Button(buttonFrame2, text='DROP_R (l)',command=self.drop_right)
-        self.DROP_RIGHT.pack(side=LEFT)
-        self.KNOCK_RIGHT = Button(buttonFrame2, text='KNOCK_R (z)',command=self.knock_right)
-        self.KNOCK_RIGHT.pack(side=LEFT)
-        self.S_LICK_RIGHT = Button(buttonFrame2, text='S_LICK_R (x)',command=self.s_lick_right)
-        self.S_LICK_RIGHT.pack(side=LEFT)
-        self.F_LICK_RIGHT = Button(buttonFrame2, text='F_LICK_R (c)',command=self.f_lick_right)
-        self.F_LICK_RIGHT.pack(side=LEFT)
-        self.INVALID_RIGHT = Button(buttonFrame2, text='INVALID_R (v)',command=self.invalid_right)
-        self.INVALID_RIGHT.pack(side=LEFT)
-        self.MACHINE_FAIL_RIGHT = Button(buttonFrame2, text='MACHINE_FAIL_R (b)',command=self.machine_fail_right)
-        self.MACHINE_FAIL_RIGHT.pack(side=LEFT)
-
-
-        self.UDF1 = Button(buttonFrame3, text="USER_DEF_1 (1)",command=self.udf1)
-        self.UDF1.pack(side=LEFT)
-        self.UDF2 = Button(buttonFrame3, text="USER_DEF_2 (2)",command=self.udf2)
-        self.UDF2.pack(side=LEFT)
-        self.UDF3 = Button(buttonFrame3, text="USER_DEF_3 (3)",command=self.udf3)
-        self.UDF3.pack(side=LEFT)
-        self.UDF4 = Button(buttonFrame3, text="USER_DEF_4 (4)",command=self.udf4)
-        self.UDF4.pack(side=LEFT)
-        self.UDF5 = Button(buttonFrame3, text="USER_DEF_5 (5)",command=self.udf5)
-        self.UDF5.pack(side=LEFT)
-        self.UDF6 = Button(buttonFrame3, text="USER_DEF_6 (6)",command=self.udf6)
-        self.UDF6.pack(side=LEFT)
-        self.UDF7 = Button(buttonFrame3, text="USER_DEF_7 (7)",command=self.udf7)
-        self.UDF7.pack(side=LEFT)
-        self.UDF8 = Button(buttonFrame3, text="USER_DEF_8 (8)",command=self.udf8)
-        self.UDF8.pack(side=LEFT)
-        self.UDF9 = Button(buttonFrame3, text="USER_DEF_9 (9)",command=self.udf9)
-        self.UDF9.pack(side=LEFT)
+        buttonFrames = [buttonFrame1, buttonFrame2, buttonFrame3]
+        self.scoringButtons = {}
+        for label in scoringLabels.LABELS:
+            button = Button(buttonFrames[label.row],
+                            text=label.text + " (" + scoringLabels.key_text(self.keyBindings[label.category]) + ")",
+                            command=lambda category=label.category: self.score_current_reach(category))
+            button.pack(side=LEFT)
+            self.scoringButtons[label.category] = button
+        self.undoButton = Button(buttonFrame3, text="UNDO (" + scoringLabels.key_text(self.keyBindings["UNDO"]) + ")",
+                                 command=self.undo)
+        self.undoButton.pack(side=LEFT)
 
 
 
@@ -1146,45 +647,20 @@ class Application(Frame):
 
 
 
-# 1. Create tk app
-# 2. Bind all the hotkeys
-# 3. enter main GUI loop
-app = Application()
-app.master.title('HCSP Scoring Interface')
-app.master.bind('q',app.s1_left)
-app.master.bind('w',app.s2_left)
-app.master.bind('e',app.s3_left)
-app.master.bind('r',app.a1_left)
-app.master.bind('t',app.a2_left)
-app.master.bind('y',app.a3_left)
-app.master.bind('u',app.drop_left)
-app.master.bind('i',app.knock_left)
-app.master.bind('o',app.s_lick_left)
-app.master.bind('p',app.f_lick_left)
-app.master.bind('a',app.invalid_left)
-app.master.bind('s',app.machine_fail_left)
-
-app.master.bind('d',app.s1_right)
-app.master.bind('f',app.s2_right)
-app.master.bind('g',app.s3_right)
-app.master.bind('h',app.a1_right)
-app.master.bind('j',app.a2_right)
-app.master.bind('k',app.a3_right)
-app.master.bind('l',app.drop_right)
-app.master.bind('z',app.knock_right)
-app.master.bind('x',app.s_lick_right)
-app.master.bind('c',app.f_lick_right)
-app.master.bind('v',app.invalid_right)
-app.master.bind('b',app.machine_fail_right)
-
-app.master.bind('1',app.udf1)
-app.master.bind('2',app.udf2)
-app.master.bind('3',app.udf3)
-app.master.bind('4',app.udf4)
-app.master.bind('5',app.udf5)
-app.master.bind('6',app.udf6)
-app.master.bind('7',app.udf7)
-app.master.bind('8',app.udf8)
-app.master.bind('9',app.udf9)
-
-app.mainloop()
+# 1. Create tk app (which binds all the hotkeys)
+# 2. enter main GUI loop
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score the reaches kinalyze found.")
+    parser.add_argument("--auto-accept", type=float, metavar="CONFIDENCE",
+                        help="Label reaches whose proposed score is at least this confident without showing them.")
+    parser.add_argument("--keys", default=scoringLabels.KEY_BINDINGS_PATH,
+                        help="CATEGORY=KEY file overriding the default hotkeys (default ../../config/scoringKeys.txt).")
+    args = parser.parse_args()
+
+    app = Application(autoAcceptThreshold=args.auto_accept, keyBindings=scoringLabels.load_key_bindings(args.keys))
+    app.master.title('HCSP Scoring Interface')
+    app.mainloop()
+    if app.journal is not None:
+        app.journal.close()
+    # Let any analysis still running finish before exiting.
+    app.analysisWorker.stop()
@@ -0,0 +1,117 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import os
+import time
+
+
+"""
+    Append-only record of the labels given to a video's reaches in scoreTrials.py, so a crash or an accidental close
+    doesn't lose the labels given so far. It's kept next to the reaches as <video>_reaches_scoring.journal, one line
+    per label:
+
+        <reach index>,<reach start frame>,<reach stop frame>,<label>,<unix time>
+
+    A later line for the same reach overrides an earlier one, and an empty label (written by undo) means the reach is
+    unscored again. Every line is flushed to the OS as it's written, which is enough to survive scoreTrials crashing.
+    fsync, which is what survives the computer going down, is slow enough to notice between key presses, so it's only
+    done every SYNC_EVERY labels or SYNC_INTERVAL seconds, and when the journal is closed.
+
+    Once every reach is labelled, scoreTrials writes the whole video to <video>_reaches_scored.txt and the journal
+    is deleted.
+"""
+
+
+JOURNAL_SUFFIX = "_reaches_scoring.journal"
+SYNC_EVERY = 10
+SYNC_INTERVAL = 5.0
+
+
+def journal_path(analysisDirectory, videoName):
+
+    return os.path.join(analysisDirectory, videoName + JOURNAL_SUFFIX)
+
+
+# Replays the journal at <path> against <reaches> (scoreTrials.Reach objects). Returns a dict mapping the index of
+# every reach that has a label to that label. Lines that don't match a reach (the reaches were found again since)
+# and a line cut off by a crash are ignored.
+def load_labels(path, reaches):
+
+    labels = {}
+    if not os.path.isfile(path):
+        return labels
+
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split(",")
+            if len(fields) != 5 or not line.endswith("\n"):
+                continue
+            try:
+                reachIndex, start, stop = int(fields[0]), int(fields[1]), int(fields[2])
+            except ValueError:
+                continue
+            if reachIndex >= len(reaches) or reaches[reachIndex].start != start or reaches[reachIndex].stop != stop:
+                continue
+            if fields[3]:
+                labels[reachIndex] = fields[3]
+            else:
+                labels.pop(reachIndex, None)
+    return labels
+
+
+class ScoringJournal(object):
+    """
+        The journal of one video. The file is only created when the first label is written.
+
+        Attributes:
+            path: Path of the journal file.
+            syncEvery: Labels written between fsyncs.
+            syncInterval: Seconds between fsyncs, checked when a label is written.
+            unsynced: Labels written since the last fsync.
+    """
+
+    def __init__(self, path, syncEvery=SYNC_EVERY, syncInterval=SYNC_INTERVAL):
+
+        self.path = path
+        self.syncEvery = syncEvery
+        self.syncInterval = syncInterval
+        self.unsynced = 0
+        self.lastSync = time.monotonic()
+        self.file = None
+
+    # Records that reach <reachIndex> of <reach> was labelled <label>, or unlabelled if <label> is empty.
+    def record(self, reachIndex, reach, label):
+
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        self.file.write(str(reachIndex) + "," + str(reach.start) + "," + str(reach.stop) + "," + label + "," +
+                        "{:.3f}".format(time.time()) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.syncEvery or time.monotonic() - self.lastSync >= self.syncInterval:
+            self.sync()
+
+    def sync(self):
+
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.lastSync = time.monotonic()
+
+    def close(self):
+
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    # Deletes the journal once its labels are safely in the scored file.
+    def discard(self):
+
+        self.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
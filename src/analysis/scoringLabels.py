@@ -0,0 +1,83 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import os
+from collections import namedtuple
+
+
+"""
+    The categories a reach can be scored as, and the keys that score them in scoreTrials.py. This is the one list of
+    labels: scoreTrials builds its buttons and key bindings from it and analysis.py numbers the labels by their
+    position in it.
+
+    The default keys can be changed in config/scoringKeys.txt, one CATEGORY=KEY per line, e.g:
+
+        SUCCESS_1_LEFT=q
+        UNDO=<Control-z>
+
+    KEY is anything Tk's bind() takes. A single character is that key, anything else must be a full event pattern
+    like <Return>. Lines for unknown categories are ignored.
+"""
+
+
+# <text> is the button label, <row> the row of buttons it goes in.
+ScoringLabel = namedtuple("ScoringLabel", ["category", "text", "key", "row"])
+
+LABELS = [
+    ScoringLabel("SUCCESS_1_LEFT", "S_1_L", "q", 0),
+    ScoringLabel("SUCCESS_2_LEFT", "S_2_L", "w", 0),
+    ScoringLabel("SUCCESS_3_LEFT", "S_3_L", "e", 0),
+    ScoringLabel("ATTEMPT_1_LEFT", "A_1_L", "r", 0),
+    ScoringLabel("ATTEMPT_2_LEFT", "A_2_L", "t", 0),
+    ScoringLabel("ATTEMPT_3_LEFT", "A_3_L", "y", 0),
+    ScoringLabel("DROP_LEFT", "DROP_L", "u", 0),
+    ScoringLabel("KNOCK_LEFT", "KNOCK_L", "i", 0),
+    ScoringLabel("SUCCESSFUL_LICK_LEFT", "S_LICK_L", "o", 0),
+    ScoringLabel("FAILED_LICK_LEFT", "F_LICK_L", "p", 0),
+    ScoringLabel("INVALID_LEFT", "INVALID_L", "a", 0),
+    ScoringLabel("MACHINE_FAIL_LEFT", "MACHINE_FAIL_L", "s", 0),
+    ScoringLabel("SUCCESS_1_RIGHT", "S_1_R", "d", 1),
+    ScoringLabel("SUCCESS_2_RIGHT", "S_2_R", "f", 1),
+    ScoringLabel("SUCCESS_3_RIGHT", "S_3_R", "g", 1),
+    ScoringLabel("ATTEMPT_1_RIGHT", "A_1_R", "h", 1),
+    ScoringLabel("ATTEMPT_2_RIGHT", "A_2_R", "j", 1),
+    ScoringLabel("ATTEMPT_3_RIGHT", "A_3_R", "k", 1),
+    ScoringLabel("DROP_RIGHT", "DROP_R", "l", 1),
+    ScoringLabel("KNOCK_RIGHT", "KNOCK_R", "z", 1),
+    ScoringLabel("SUCCESSFUL_LICK_RIGHT", "S_LICK_R", "x", 1),
+    ScoringLabel("FAILED_LICK_RIGHT", "F_LICK_R", "c", 1),
+    ScoringLabel("INVALID_RIGHT", "INVALID_R", "v", 1),
+    ScoringLabel("MACHINE_FAIL_RIGHT", "MACHINE_FAIL_R", "b", 1),
+] + [ScoringLabel("USER_DEFINED_" + str(n), "USER_DEF_" + str(n), str(n), 2) for n in range(1, 10)]
+
+# Category -> number, the label dict analysis.runOneFile() takes.
+LABEL_IDS = dict((label.category, i) for i, label in enumerate(LABELS))
+
+# Keys for the actions that aren't labels: accept the proposed score (preScore.py) and undo the last label.
+ACTIONS = {"ACCEPT": "<Return>", "UNDO": "<BackSpace>"}
+
+KEY_BINDINGS_PATH = "../../config/scoringKeys.txt"
+
+
+# Returns a dict mapping each category (and action) to its Tk event pattern, with any overrides in <path> applied.
+def load_key_bindings(path=KEY_BINDINGS_PATH):
+
+    bindings = dict((label.category, label.key) for label in LABELS)
+    bindings.update(ACTIONS)
+    if os.path.isfile(path):
+        with open(path) as f:
+            for line in f:
+                category, sep, key = line.strip().partition("=")
+                if sep and key and category in bindings:
+                    bindings[category] = key
+    return bindings
+
+
+# The text shown for a key on its button, e.g "q" or "Return".
+def key_text(key):
+
+    return key.strip("<>")
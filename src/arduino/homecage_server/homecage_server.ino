@@ -1,11 +1,21 @@
 /*
     This program is a server for controlling the hardware peripherals attached to the HomeCage system.
     It waits for commands over a serial port (python client in our case) and performs the desired action upon receiving the command.
-    There is no proper message passing system and it simply uses various magic byte values as messages.
-    Note: These bytes can cause different outcomes depending on the state the program is in at the time
-    of receiving. The lack of real message passing system means the program is rather fragile. I recommend
-    not modifying this program too much. Utility may instead be found by recycling specific functions.
-    (For controlling servos, steppers, IR breakers, etc....attached to the Arduino).
+    Commands still use the old magic byte values, but each one is sent inside a frame with a sequence number:
+
+        #<seq>:<cmd>[:<arg>]\n         e.g  #12:3:4\n  (move the stepper to 4mm)
+
+    The server answers every frame with ACK:<seq>\n once it has been parsed, and DONE:<seq>\n once the action
+    has finished (stepper positioned, pellet raised). Frames that don't make sense in the current state get
+    NAK:<seq>\n. READY\n (after boot) and TERM\n (IR breaker connected) are sent unprompted like before.
+    This lets the client wait exactly as long as the hardware takes instead of sleeping for a worst case time.
+
+    Commands:
+        A       Start a session (listening mode only).
+        Y       RFID rejected (listening mode only).
+        1       Present a pellet with the right arm.
+        2       Present a pellet with the left arm.
+        3:<d>   Move the stepper to <d>mm from the origin, <d> is a single digit 0-6.
 
 
     This program enters a listening mode on boot and waits for a signal over serial to tell it to start a session.
@@ -61,6 +71,14 @@ volatile byte IRState;
 int stepperDistFromOrigin = -1;
 double stepsToMmRatio = 420;
 
+// Serial frame parsing state. See the protocol description at the top of this file.
+const int FRAME_BUFFER_SIZE = 32;
+char frameBuffer[FRAME_BUFFER_SIZE];
+int frameLength = 0;
+long frameSeq = 0;
+char frameCmd = 0;
+char frameArg = 0;
+
 
 // Hardware interrupt handler for switch pin
 void handleSwitchChange() {
@@ -271,6 +289,58 @@ int moveStepper(int targetPos) {
 
 
 
+// Reads whatever bytes are available on the serial port without blocking. Returns true once a complete frame has
+// been received, in which case <frameSeq>, <frameCmd> and <frameArg> hold its contents. Malformed frames are dropped.
+bool readFrame() {
+
+  while(Serial.available() > 0) {
+
+    char c = Serial.read();
+
+    if(c == '#') {
+      frameLength = 0;
+      frameBuffer[frameLength++] = c;
+      continue;
+    }
+    // Ignore anything that isn't part of a frame.
+    if(frameLength == 0) {
+      continue;
+    }
+    if(c != '\n') {
+      if(frameLength < FRAME_BUFFER_SIZE - 1) {
+        frameBuffer[frameLength++] = c;
+      }
+      else {
+        frameLength = 0;
+      }
+      continue;
+    }
+
+    frameBuffer[frameLength] = '\0';
+    frameLength = 0;
+
+    char *cmdStart = strchr(frameBuffer, ':');
+    if(cmdStart == NULL || cmdStart[1] == '\0') {
+      continue;
+    }
+    frameSeq = atol(frameBuffer + 1);
+    frameCmd = cmdStart[1];
+    frameArg = (cmdStart[2] == ':') ? cmdStart[3] : 0;
+    return true;
+  }
+
+  return false;
+}
+
+void sendReply(const char *reply, long seq) {
+
+  Serial.print(reply);
+  Serial.print(':');
+  Serial.print(seq);
+  Serial.write('\n');
+}
+
+
 void setup() {
 
   // Open serial connection
@@ -308,23 +378,27 @@ void setup() {
 
 bool listenForStartCommand() {
   
-  char authByte;
-  
   while(true) {
 
-    if(Serial.available() > 0) {
-      
-      authByte = Serial.read();
+    if(!readFrame()) {
+      continue;
     }
-    
-    if(authByte == 'A') {
 
+    if(frameCmd == 'A') {
+
+      sendReply("ACK", frameSeq);
+      sendReply("DONE", frameSeq);
       return true;
     }
-    else if (authByte == 'Y' ) {
+    else if (frameCmd == 'Y' ) {
+      sendReply("ACK", frameSeq);
       digitalWrite(ledPin,HIGH);
+      sendReply("DONE", frameSeq);
       return false;
     }
+    else {
+      sendReply("NAK", frameSeq);
+    }
 
   }
 }
@@ -335,56 +409,41 @@ int startSession() {
 
   while(!digitalRead(IRBreakerPin)) {
 
-    char cmd;
-    char stepperDist;
-    
-    if(Serial.available() > 0) {
+    if(readFrame()) {
 
-      cmd = Serial.read();
-      
-      switch(cmd){
+      switch(frameCmd){
         
         case ('1'):
+          sendReply("ACK", frameSeq);
           displayPellet(right);
+          sendReply("DONE", frameSeq);
           break;
           
         case ('2'):
+          sendReply("ACK", frameSeq);
           displayPellet(left);
+          sendReply("DONE", frameSeq);
           break;
           
         case ('3'):
 
-          // Give client a second to respond
-          delay(1000);
-          stepperDist = Serial.read();
-          
-          switch(stepperDist){
-            case('0'):
-              zeroStepper();
-              break;
-            case('1'):
-              moveStepper(stepsToMmRatio * 1);
-              break;
-            case('2'):
-              moveStepper(stepsToMmRatio * 2);
-              break;
-            case('3'):
-              moveStepper(stepsToMmRatio * 3);
-              break;
-            case('4'):
-              moveStepper(stepsToMmRatio * 4);
-              break;
-            case('5'):
-              moveStepper(stepsToMmRatio * 5);
-              break;
-            case('6'):
-              moveStepper(stepsToMmRatio * 6);
-              break;
-            default:
-              break;  
-            }
+          if(frameArg < '0' || frameArg > '6') {
+            sendReply("NAK", frameSeq);
+            break;
+          }
+
+          sendReply("ACK", frameSeq);
+          if(frameArg == '0') {
+            zeroStepper();
+          }
+          else {
+            moveStepper(stepsToMmRatio * (frameArg - '0'));
+          }
+          sendReply("DONE", frameSeq);
+          break;
             
         default:
+          sendReply("NAK", frameSeq);
           break;
       }
     }
@@ -410,6 +469,7 @@ int startSession() {
   while(Serial.read() >= 0) {
     continue;
   }
+  frameLength = 0;
 
   return 0;
 }
@@ -6,10 +6,34 @@
 
 
 import serial
+import time
 from time import sleep
 
+
+# Command bytes understood by the Arduino server. See homecage_server.ino for the frame format.
+CMD_START_SESSION = 'A'
+CMD_REJECT_RFID = 'Y'
+CMD_PELLET_RIGHT_ARM = '1'
+CMD_PELLET_LEFT_ARM = '2'
+CMD_MOVE_STEPPER = '3'
+
 class client(object):
 
+    """
+        Protocol layer for the Arduino server. Every command is sent as a frame with a sequence number
+        (#<seq>:<cmd>[:<arg>]\n). The server replies ACK:<seq> when it receives the frame and DONE:<seq> when the
+        action has finished, so callers can wait for the hardware instead of sleeping for a fixed time. The server
+        also sends TERM on its own when the IR breaker ends a session.
+
+        Nothing here blocks unless asked to: send a command, then either poll() from a loop or wait_for() its DONE.
+
+        Attributes:
+            serialInterface: The serial.Serial connection to the Arduino.
+            acked / done / rejected: Sequence numbers the server has sent ACK / DONE / NAK for.
+            termReceived: True once TERM has been received in the current session.
+            messageListener: Optional callable(kind, seq, line) called for every message received, e.g for logging.
+                             <kind> is ACK, DONE, NAK, TERM or OTHER and <seq> is None for unsequenced messages.
+    """
 
     def __init__(self, arduinoSerialPortPath, baudrate):
 
@@ -17,7 +41,7 @@ class client(object):
         #   when you open a serial connection with it, so a ~3 second delay
         #   after opening the connection is recommended)
         self.serialInterface = serial.Serial(arduinoSerialPortPath, baudrate)
-        
+
         self.serialInterface.flushInput()
         sleep(3)
         # Wait for Arduino to say it's ready TODO: readline is blocking....add timeout eventually
@@ -29,12 +53,128 @@ class client(object):
             print("Arduino took too long to respond...shutting down")
             exit()
 
+        self.seq = 0
+        self.readBuffer = b""
+        self.acked = set()
+        self.done = set()
+        self.rejected = set()
+        self.termReceived = False
+        self.messageListener = None
+
+
+    # Sends a framed command and returns its sequence number.
+    def send_command(self, cmd, arg=None):
+
+        self.seq += 1
+        frame = "#" + str(self.seq) + ":" + cmd
+        if arg is not None:
+            frame += ":" + str(arg)
+        self.serialInterface.write((frame + "\n").encode())
+        return self.seq
+
+    # Reads and handles every complete message the server has sent. Waits up to <timeout> seconds for the first
+    # byte if nothing has arrived yet. Returns the list of messages handled.
+    def poll(self, timeout=0):
+
+        self.serialInterface.timeout = timeout
+        data = self.serialInterface.read(max(1, self.serialInterface.in_waiting))
+        if not data:
+            return []
+
+        self.readBuffer += data
+        messages = []
+        while b"\n" in self.readBuffer:
+            line, self.readBuffer = self.readBuffer.split(b"\n", 1)
+            line = line.rstrip().decode(errors="replace")
+            if line:
+                self._handle_message(line)
+                messages.append(line)
+
+        return messages
+
+    # Blocks until the command with sequence number <seq> is done. Returns "DONE", "NAK", "TERM" (the session ended
+    # first) or None if <timeout> seconds passed.
+    def wait_for(self, seq, timeout):
+
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.status(seq)
+            if status is not None:
+                return status
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.poll(min(remaining, 0.05))
+
+    # Returns "DONE", "NAK" or "TERM" if the command with sequence number <seq> won't make progress anymore, else None.
+    def status(self, seq):
 
-    # DEPRECATED: This function was used to read RFIDs from the Arduino, before we switched the 
-    # RFID reader from the Arduino to the PC. 
+        if seq in self.done:
+            return "DONE"
+        if seq in self.rejected:
+            return "NAK"
+        if self.termReceived:
+            return "TERM"
+        return None
+
+    # Tells the server to start a session and waits for it to confirm. Returns True if it did.
+    def start_session(self, timeout=2):
+
+        # Anything still buffered belongs to the last session.
+        self.serialInterface.reset_input_buffer()
+        self.readBuffer = b""
+        self.acked.clear()
+        self.done.clear()
+        self.rejected.clear()
+        self.termReceived = False
+
+        return self.wait_for(self.send_command(CMD_START_SESSION), timeout) == "DONE"
+
+    # Sending this rejection notice is no longer necessary, it is a relic of when the RFID sensor was handled by the
+    # Arduino directly. The server doesn't need an answer so this doesn't wait for one.
+    def reject_rfid(self):
+
+        return self.send_command(CMD_REJECT_RFID)
+
+    def move_stepper(self, distMm):
+
+        return self.send_command(CMD_MOVE_STEPPER, int(distMm))
+
+    # <hand> is the paw the pellet is presented to. The left paw reaches for the pellet on the right arm.
+    def present_pellet(self, hand):
+
+        if hand == "LEFT":
+            return self.send_command(CMD_PELLET_RIGHT_ARM)
+        elif hand == "RIGHT":
+            return self.send_command(CMD_PELLET_LEFT_ARM)
+        return None
+
+    def _handle_message(self, line):
+
+        kind, _, seq = line.partition(":")
+        if kind in ("ACK", "DONE", "NAK") and seq.isdigit():
+            seq = int(seq)
+            if kind == "ACK":
+                self.acked.add(seq)
+            elif kind == "DONE":
+                self.done.add(seq)
+            else:
+                self.rejected.add(seq)
+        elif line == "TERM":
+            kind, seq = "TERM", None
+            self.termReceived = True
+        else:
+            kind, seq = "OTHER", None
+
+        if self.messageListener is not None:
+            self.messageListener(kind, seq, line)
+
+
+    # DEPRECATED: This function was used to read RFIDs from the Arduino, before we switched the
+    # RFID reader from the Arduino to the PC.
     def listenForRFID(self):
 
         RFID = self.serialInterface.readline().rstrip().decode()
         self.serialInterface.flushInput()
         return RFID
-
@@ -0,0 +1,316 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import argparse
+import itertools
+import os
+import select
+import threading
+import time
+import tty
+
+
+# Timing of the real hardware, taken from homecage_server.ino.
+STEPS_PER_MM = 420
+STEP_TIME = 0.002                                       # One HIGH/LOW pulse pair with delay(1) each.
+SERVO_TRAVEL = (140 - 72) * 2 * 0.016 + 0.3             # Lower to grab the pellet, raise it, settle.
+SERVO_LOWER_TIME = (140 - 72) * 0.016 + 0.3
+ZERO_STEPPER_TIME = 1000 * STEP_TIME + 0.1              # Plus however far it is from the limit switch.
+BOOT_TIME = 2 * SERVO_LOWER_TIME + ZERO_STEPPER_TIME
+
+
+class ArduinoSimulator(threading.Thread):
+    """
+        Software stand-in for homecage_server.ino. It runs the same state machine (listenForStartCommand ->
+        startSession -> TERM) and speaks the same framed protocol on a pseudo-terminal, so the client can be run
+        and load tested without the hardware. Point ARDUINO_PORT in config.txt at <port> to use it.
+
+        Like the real board it resets when the port is opened: nothing is sent until a client opens the port,
+        and READY is sent <bootTime> seconds later. While the stepper or a servo is moving the simulator doesn't
+        read commands or check the IR beam, same as the firmware.
+
+        Animal behaviour is scripted with <dwellTimes>: the n-th session ends (the IR beam is reconnected and TERM
+        is sent) dwellTimes[n] seconds after it started. If <dwellTimes> runs out, or is None, the IR beam follows
+        animal_enters() / animal_leaves() instead, and like the firmware a session started while the beam is
+        connected ends straight away. All latencies are multiplied by <timeScale>, so e.g 0.1 runs everything 10x faster.
+
+        Attributes:
+            port: Path of the pty the client should open.
+            stats: Counters and timings collected while running, see report().
+            startTimes / rejectTimes: time.monotonic() of every A / Y command received.
+    """
+
+    def __init__(self, bootTime=BOOT_TIME, stepTime=STEP_TIME, servoTime=SERVO_TRAVEL, dwellTimes=None,
+                 timeScale=1.0):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.bootTime = bootTime
+        self.stepTime = stepTime
+        self.servoTime = servoTime
+        self.dwellTimes = iter(dwellTimes) if dwellTimes is not None else iter(())
+        self.timeScale = timeScale
+
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        tty.setraw(slave)
+        # With no slave descriptor open the master reports POLLHUP, which is how we notice the client opening the port.
+        os.close(slave)
+
+        self.stopEvent = threading.Event()
+        self.animalPresent = threading.Event()
+        self.readBuffer = b""
+        self.stepperPos = 0
+        self.armsUp = set()
+        self.startTimes = []
+        self.rejectTimes = []
+        self.stats = {"opens": 0, "sessions": 0, "rejects": 0, "frames": 0, "naks": 0, "pellets": 0,
+                      "stepper_moves": 0, "session_durations": [], "command_busy_time": 0.0}
+
+    def run(self):
+
+        while not self.stopEvent.is_set():
+            if not self._wait_for_client_open():
+                return
+            self.stats["opens"] += 1
+            self._reset()
+            self._sleep(self.bootTime)
+            self._write("READY")
+
+            while not self.stopEvent.is_set() and not self._client_closed():
+                if self._listen_for_start_command():
+                    self._start_session()
+
+    def stop(self):
+
+        self.stopEvent.set()
+
+    # Breaks the IR beam.
+    def animal_enters(self):
+
+        self.animalPresent.set()
+
+    # Reconnects the IR beam, ending the current session.
+    def animal_leaves(self):
+
+        self.animalPresent.clear()
+
+    def report(self):
+
+        durations = self.stats["session_durations"]
+        lines = ["opens: " + str(self.stats["opens"]),
+                 "sessions: " + str(self.stats["sessions"]),
+                 "rejects: " + str(self.stats["rejects"]),
+                 "frames received: " + str(self.stats["frames"]),
+                 "NAKs sent: " + str(self.stats["naks"]),
+                 "pellets presented: " + str(self.stats["pellets"]),
+                 "stepper moves: " + str(self.stats["stepper_moves"]),
+                 "hardware busy: {:.2f}s".format(self.stats["command_busy_time"])]
+        if durations:
+            lines.append("mean session length: {:.2f}s".format(sum(durations) / len(durations)))
+        return "\n".join(lines)
+
+    # listenForStartCommand(). Returns True when a session should start, False on Y or if the client went away.
+    def _listen_for_start_command(self):
+
+        while not self.stopEvent.is_set():
+            frame = self._read_frame(0.05)
+            if frame is None:
+                if self._client_closed():
+                    return False
+                continue
+
+            seq, cmd, arg = frame
+            if cmd == 'A':
+                self.startTimes.append(time.monotonic())
+                self._reply("ACK", seq)
+                self._reply("DONE", seq)
+                return True
+            elif cmd == 'Y':
+                self.rejectTimes.append(time.monotonic())
+                self._reply("ACK", seq)
+                self.stats["rejects"] += 1
+                self._reply("DONE", seq)
+                return False
+            else:
+                self._reply("NAK", seq)
+
+        return False
+
+    # startSession(). Handles commands until the IR beam is reconnected (or the scripted dwell time is over), then sends TERM.
+    def _start_session(self):
+
+        self.stats["sessions"] += 1
+        start = time.monotonic()
+        dwell = next(self.dwellTimes, None)
+        deadline = start + dwell * self.timeScale if dwell is not None else None
+
+        while not self.stopEvent.is_set():
+            if deadline is None and not self.animalPresent.is_set():
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            if self._client_closed():
+                return
+
+            frame = self._read_frame(0.01)
+            if frame is None:
+                continue
+
+            seq, cmd, arg = frame
+            if cmd in ('1', '2'):
+                self._reply("ACK", seq)
+                self._busy(self.servoTime)
+                self.armsUp.add(cmd)
+                self.stats["pellets"] += 1
+                self._reply("DONE", seq)
+            elif cmd == '3' and arg is not None and len(arg) == 1 and arg in "0123456":
+                self._reply("ACK", seq)
+                self._busy(self._stepper_time(int(arg)))
+                self.stats["stepper_moves"] += 1
+                self._reply("DONE", seq)
+            else:
+                self._reply("NAK", seq)
+
+        self._write("TERM")
+        self.stats["session_durations"].append(time.monotonic() - start)
+        self._busy(len(self.armsUp) * SERVO_LOWER_TIME)
+        self.armsUp.clear()
+        # The firmware flushes whatever the client sent during teardown.
+        self._drain()
+
+    def _stepper_time(self, targetMm):
+
+        if targetMm == 0:
+            travel = ZERO_STEPPER_TIME + self.stepperPos * STEPS_PER_MM * self.stepTime
+        else:
+            travel = abs(targetMm - self.stepperPos) * STEPS_PER_MM * self.stepTime
+        self.stepperPos = targetMm
+        return travel
+
+    def _busy(self, seconds):
+
+        self.stats["command_busy_time"] += seconds * self.timeScale
+        self._sleep(seconds)
+
+    def _sleep(self, seconds):
+
+        self.stopEvent.wait(seconds * self.timeScale)
+
+    def _reset(self):
+
+        self.readBuffer = b""
+        self.stepperPos = 0
+        self.armsUp.clear()
+        self._drain()
+
+    def _reply(self, reply, seq):
+
+        if reply == "NAK":
+            self.stats["naks"] += 1
+        self._write(reply + ":" + str(seq))
+
+    def _write(self, msg):
+
+        try:
+            os.write(self.master, (msg + "\n").encode())
+        except OSError:
+            pass
+
+    # Returns (seq, cmd, arg) for the next complete frame, or None if none arrived within <timeout> seconds.
+    def _read_frame(self, timeout):
+
+        while True:
+            while b"\n" in self.readBuffer:
+                line, self.readBuffer = self.readBuffer.split(b"\n", 1)
+                frame = self._parse_frame(line.decode(errors="replace"))
+                if frame is not None:
+                    self.stats["frames"] += 1
+                    return frame
+
+            ready, _, _ = select.select([self.master], [], [], timeout)
+            if not ready:
+                return None
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return None
+            if not data:
+                return None
+            self.readBuffer += data
+
+    @staticmethod
+    def _parse_frame(line):
+
+        start = line.find("#")
+        if start < 0:
+            return None
+        parts = line[start + 1:].strip().split(":")
+        if len(parts) < 2 or not parts[0].isdigit() or not parts[1]:
+            return None
+        return int(parts[0]), parts[1], parts[2] if len(parts) > 2 else None
+
+    def _drain(self):
+
+        self.readBuffer = b""
+        while select.select([self.master], [], [], 0)[0]:
+            try:
+                if not os.read(self.master, 1024):
+                    return
+            except OSError:
+                return
+
+    def _client_closed(self):
+
+        poller = select.poll()
+        poller.register(self.master, select.POLLHUP)
+        return any(event & select.POLLHUP for _, event in poller.poll(0))
+
+    def _wait_for_client_open(self):
+
+        while not self.stopEvent.is_set():
+            if not self._client_closed():
+                return True
+            self.stopEvent.wait(0.05)
+        return False
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Simulate the HomeCage Arduino server on a pseudo-terminal.")
+    parser.add_argument("--link", help="Also make a symlink to the pty at this path (e.g to put in config.txt).")
+    parser.add_argument("--dwell", type=float, nargs="+", default=[30],
+                        help="Session lengths in seconds, used in order. Repeats the last one forever.")
+    parser.add_argument("--boot-time", type=float, default=BOOT_TIME)
+    parser.add_argument("--step-time", type=float, default=STEP_TIME, help="Seconds per stepper step.")
+    parser.add_argument("--servo-time", type=float, default=SERVO_TRAVEL, help="Seconds per pellet presentation.")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiplier applied to every latency.")
+    args = parser.parse_args()
+
+    dwellTimes = itertools.chain(args.dwell, itertools.repeat(args.dwell[-1]))
+
+    simulator = ArduinoSimulator(args.boot_time, args.step_time, args.servo_time, dwellTimes, args.time_scale)
+    if args.link:
+        if os.path.islink(args.link):
+            os.remove(args.link)
+        os.symlink(simulator.port, args.link)
+
+    print("Arduino simulator listening on " + simulator.port)
+    simulator.start()
+    try:
+        while simulator.is_alive():
+            simulator.join(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+    finally:
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+        print(simulator.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import json
+import os
+import time
+
+
+class SessionEventLog(object):
+    """
+        Append-only log of everything that happens during one session (pellet requests, stepper moves, messages from
+        the Arduino, the IR beam ending the session, recorder start/stop). One JSON object per line, e.g:
+
+            {"t": 7.0013, "event": "PELLET_REQUEST", "frame": 350, "presentation": 2, "hand": "LEFT"}
+
+        <t> is seconds since the log was opened, taken from time.monotonic() so it can't jump when the system clock is
+        adjusted. The wall clock time of the session start is in the SESSION_START record. <frame> is the index of the
+        video frame the recorder was writing when the event happened, read from the recorder's own frame counter
+        (RecorderProcess.frame_index()), or None while not recording or if the recorder can't report it. kinalyze
+        uses it to line reaches up with pellet presentations.
+
+        Each record is written to the file as soon as it's logged. The file is flushed after every line, so a crash
+        loses nothing the OS has been handed, but only fsynced when the log is closed so the session loop never waits
+        on the disk.
+
+        Attributes:
+            path: File the records are appended to.
+            recorder: The RecorderProcess recording the session, used for frame indexes.
+    """
+
+    def __init__(self, path, recorder=None):
+
+        self.path = path
+        self.recorder = recorder
+        self.file = open(path, 'a')
+        self.startTime = time.monotonic()
+
+    def log(self, event, **fields):
+
+        if self.file is None:
+            return
+
+        now = time.monotonic()
+        frame = self.recorder.frame_index() if self.recorder is not None else None
+        record = {"t": round(now - self.startTime, 4), "event": event, "frame": frame}
+        record.update(fields)
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+
+        if self.file is None:
+            return
+
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
@@ -1,11 +1,10 @@
 from tkinter import *
 from time import sleep
-import os
 
-# This is the GUI for configuring AnimalProfiles. It reads profiles from the ~/HomeCageSinglePellet/AnimalProfiles/ directory.
-# It expects to find 5 profiles there and will not work with any other number. Profiles should be named as follows: 
+# This is the GUI for configuring AnimalProfiles. It expects 5 profiles, named as follows:
 # MOUSE1, MOUSE2, MOUSE3, MOUSE4, MOUSE5. Do not use other names. This GUI gets instantiated in its own process that runs
-# concurrently with the SessionController process.
+# concurrently with the SessionController process. It does not read or write any files itself. All settings are read from
+# and written to the SharedState handed to it by main.py, and the SessionController process takes care of saving them.
 #
 # Disclaimer: This was not well written. However, it's pretty straightforward. 
 # Create button -> Assign function to it -> Position it -> Pack it into tk frame.
@@ -13,30 +12,21 @@ import os
 # might affect something seemingly unrelated. Advise not modifying unless really needed.
 #
 #
-# Most of the buttons are attached to a function that simply reads and writes to a profileState. They will also update text boxes
+# Most of the buttons are attached to a function that simply reads and writes to the SharedState. They will also update text boxes
 # when appropriate. It's mostly clear just by reading it.
 
 class GUI:
 
 
     # All of the buttons are intialized and rendered inside __init__. 
-	def __init__(self, master, animalProfilePath):
+	def __init__(self, master, animalProfilePath, sharedState):
 
 
 		self.master = master
 		self.animalProfilePath = animalProfilePath
-		self.profileNames = []
-		self.profileSaveFilePaths = []
-		self.profileStates = []
+		self.sharedState = sharedState
 		self.currentMouse = -1
 
-		with open("../../config/trialLimitConfig.txt") as f:
-			self.mouse1TrialLimit = f.readline().rstrip()
-			self.mouse2TrialLimit = f.readline().rstrip()
-			self.mouse3TrialLimit = f.readline().rstrip()
-			self.mouse4TrialLimit = f.readline().rstrip()
-			self.mouse5TrialLimit = f.readline().rstrip()
-
 
 		menubar = Menu(master)
 		menubar.config(fg="red",)
@@ -59,18 +49,19 @@ class GUI:
 
 		frame2 = Frame(master)
 
-		self.load_animal_profiles()
 		dists = [0,0,0,0,0]
-		armSettings = ['left','left','left','left']
+		armSettings = ['left','left','left','left','left']
+		trialLimits = [0,0,0,0,0]
 
 		for mouse in range(1,6):
-			profileIndex = self.find_profile_state_index(mouse)
+			settings = self.sharedState.get(mouse)
+			trialLimits[mouse - 1] = settings.get('trial_limit', 0)
 
-			if profileIndex == -1:
+			if 'dominant_hand' not in settings:
 				print("Mouse " + str(mouse) + " does not exist")
 			else:
-				dists.insert(mouse - 1,self.profileStates[profileIndex][4])
-				armSettings.insert(mouse - 1, self.profileStates[profileIndex][5])
+				dists[mouse - 1] = settings['difficulty_dist_mm']
+				armSettings[mouse - 1] = settings['dominant_hand']
 
 
 
@@ -113,16 +104,10 @@ class GUI:
 		self.spinbox5 = Spinbox(frameLimBox, from_=0, to=300, command=self.update_spinbox5)
 		self.spinbox5.pack(padx=38,side=LEFT)
 		frameLimBox.pack()
-		for i in range(0,int(self.mouse1TrialLimit)):
-			self.spinbox1.invoke("buttonup")
-		for i in range(0,int(self.mouse2TrialLimit)):
-			self.spinbox2.invoke("buttonup")
-		for i in range(0,int(self.mouse3TrialLimit)):
-			self.spinbox3.invoke("buttonup")
-		for i in range(0,int(self.mouse4TrialLimit)):
-			self.spinbox4.invoke("buttonup")
-		for i in range(0,int(self.mouse5TrialLimit)):
-			self.spinbox5.invoke("buttonup")
+		# Set the starting values directly. Invoking the buttons would publish every intermediate value.
+		for spinbox, trialLimit in zip((self.spinbox1, self.spinbox2, self.spinbox3, self.spinbox4, self.spinbox5), trialLimits):
+			spinbox.delete(0, END)
+			spinbox.insert(0, str(trialLimit))
 
 
 		frame42 = Frame(master)
@@ -146,204 +131,72 @@ class GUI:
 
 
 	def update_spinbox1(self):
-		self.mouse1TrialLimit = self.spinbox1.get()
-		with open("../../config/trialLimitConfig.txt", 'w') as f:
-			f.write(self.mouse1TrialLimit + "\n")
-			f.write(self.mouse2TrialLimit + "\n")
-			f.write(self.mouse3TrialLimit + "\n")
-			f.write(self.mouse4TrialLimit + "\n")
-			f.write(self.mouse5TrialLimit + "\n")
+		self.sharedState.update(1, trial_limit=int(self.spinbox1.get()))
 
 	def update_spinbox2(self):
-		self.mouse2TrialLimit = self.spinbox2.get()
-		with open("../../config/trialLimitConfig.txt", 'w') as f:
-			f.write(self.mouse1TrialLimit + "\n")
-			f.write(self.mouse2TrialLimit + "\n")
-			f.write(self.mouse3TrialLimit + "\n")
-			f.write(self.mouse4TrialLimit + "\n")
-			f.write(self.mouse5TrialLimit + "\n")
+		self.sharedState.update(2, trial_limit=int(self.spinbox2.get()))
 
 	def update_spinbox3(self):
-		self.mouse3TrialLimit = self.spinbox3.get()
-		with open("../../config/trialLimitConfig.txt", 'w') as f:
-			f.write(self.mouse1TrialLimit + "\n")
-			f.write(self.mouse2TrialLimit + "\n")
-			f.write(self.mouse3TrialLimit + "\n")
-			f.write(self.mouse4TrialLimit + "\n")
-			f.write(self.mouse5TrialLimit + "\n")
+		self.sharedState.update(3, trial_limit=int(self.spinbox3.get()))
 
 	def update_spinbox4(self):
-		self.mouse4TrialLimit = self.spinbox4.get()
-		with open("../../config/trialLimitConfig.txt", 'w') as f:
-			f.write(self.mouse1TrialLimit + "\n")
-			f.write(self.mouse2TrialLimit + "\n")
-			f.write(self.mouse3TrialLimit + "\n")
-			f.write(self.mouse4TrialLimit + "\n")
-			f.write(self.mouse5TrialLimit + "\n")
+		self.sharedState.update(4, trial_limit=int(self.spinbox4.get()))
 
 	def update_spinbox5(self):
-		self.mouse5TrialLimit = self.spinbox5.get()
-		with open("../../config/trialLimitConfig.txt", 'w') as f:
-			f.write(self.mouse1TrialLimit + "\n")
-			f.write(self.mouse2TrialLimit + "\n")
-			f.write(self.mouse3TrialLimit + "\n")
-			f.write(self.mouse4TrialLimit + "\n")
-			f.write(self.mouse5TrialLimit + "\n")
+		self.sharedState.update(5, trial_limit=int(self.spinbox5.get()))
 
 
 	def switch_arm_state_1(self):
 
-		self.load_animal_profiles()
-
-		profileIndex = self.find_profile_state_index(1)
-		armState = self.profileStates[profileIndex][5]
-
-		if armState == "RIGHT":
-			self.profileStates[profileIndex][5] = "LEFT"
-			armState = "LEFT"
-		elif armState == "LEFT":
-			self.profileStates[profileIndex][5] = "RIGHT"
-			armState = "RIGHT"
-
-
-		self.armButton1.config(text=armState)
-		self.save_animal_profile(profileIndex)
+		armState = self.toggle_arm_state(1)
+		if armState is not None:
+			self.armButton1.config(text=armState)
 
 
 	def switch_arm_state_2(self):
 
-		self.load_animal_profiles()
-
-		profileIndex = self.find_profile_state_index(2)
-		armState = self.profileStates[profileIndex][5]
-
-		if armState == "RIGHT":
-			self.profileStates[profileIndex][5] = "LEFT"
-			armState = "LEFT"
-		elif armState == "LEFT":
-			self.profileStates[profileIndex][5] = "RIGHT"
-			armState = "RIGHT"
-
-
-		self.armButton2.config(text=armState)
-		self.save_animal_profile(profileIndex)
+		armState = self.toggle_arm_state(2)
+		if armState is not None:
+			self.armButton2.config(text=armState)
 
 
 	def switch_arm_state_3(self):
 
-		self.load_animal_profiles()
-
-		profileIndex = self.find_profile_state_index(3)
-		armState = self.profileStates[profileIndex][5]
-
-		if armState == "RIGHT":
-			self.profileStates[profileIndex][5] = "LEFT"
-			armState = "LEFT"
-		elif armState == "LEFT":
-			self.profileStates[profileIndex][5] = "RIGHT"
-			armState = "RIGHT"
-
-
-		self.armButton3.config(text=armState)
-		self.save_animal_profile(profileIndex)
+		armState = self.toggle_arm_state(3)
+		if armState is not None:
+			self.armButton3.config(text=armState)
 
 
 	def switch_arm_state_4(self):
 
-		self.load_animal_profiles()
-
-		profileIndex = self.find_profile_state_index(4)
-		armState = self.profileStates[profileIndex][5]
-
-		if armState == "RIGHT":
-			self.profileStates[profileIndex][5] = "LEFT"
-			armState = "LEFT"
-		elif armState == "LEFT":
-			self.profileStates[profileIndex][5] = "RIGHT"
-			armState = "RIGHT"
+		armState = self.toggle_arm_state(4)
+		if armState is not None:
+			self.armButton4.config(text=armState)
 
 
-		self.armButton4.config(text=armState)
-		self.save_animal_profile(profileIndex)
+	def switch_arm_state_5(self):
 
+		armState = self.toggle_arm_state(5)
+		if armState is not None:
+			self.armButton5.config(text=armState)
 
-	def switch_arm_state_5(self):
 
-		self.load_animal_profiles()
+	# Flips the presentation arm for <mouseNumber> in the shared state and returns the new setting,
+	# or None if there is no profile for that mouse.
+	def toggle_arm_state(self, mouseNumber):
 
-		profileIndex = self.find_profile_state_index(5)
-		armState = self.profileStates[profileIndex][5]
+		armState = self.sharedState.get(mouseNumber).get('dominant_hand')
 
 		if armState == "RIGHT":
-			self.profileStates[profileIndex][5] = "LEFT"
 			armState = "LEFT"
 		elif armState == "LEFT":
-			self.profileStates[profileIndex][5] = "RIGHT"
 			armState = "RIGHT"
+		else:
+			print("Error: Could not find profile for Mouse " + str(mouseNumber))
+			return None
 
-
-		self.armButton5.config(text=armState)
-		self.save_animal_profile(profileIndex)
-
-
-	def load_animal_profiles(self):
-
-		self.profileNames = []
-		self.profileStates = []
-		self.profileSaveFilePaths = []
-
-		# Get list of profile folders
-		self.profileNames = os.listdir(self.animalProfilePath)
-
-
-		for profile in self.profileNames:
-
-			# Build save file path and save in list
-			loadFile = self.animalProfilePath + profile + "/" + profile + "_save.txt"
-			self.profileSaveFilePaths.append(loadFile)
-
-			# Open the save file
-			try:
-				load = open(loadFile, 'r')
-			except IOError:
-				print ("Could not open AnimalProfile save file!")
-
-			# Read all lines from save file and strip them
-			with load:
-				profileState = load.readlines()
-			self.profileStates.append([x.strip() for x in profileState])
-
-
-	def save_animal_profile(self, profileIndex):
-
-		with open(self.profileSaveFilePaths[profileIndex], 'w') as save:
-
-			save.write(str(self.profileStates[profileIndex][0]) + "\n")
-			save.write(str(self.profileStates[profileIndex][1]) + "\n")
-			save.write(str(self.profileStates[profileIndex][2]) + "\n")
-			save.write(str(self.profileStates[profileIndex][3]) + "\n")
-			save.write(str(self.profileStates[profileIndex][4]) + "\n")
-			save.write(str(self.profileStates[profileIndex][5]) + "\n")
-			save.write(str(self.profileStates[profileIndex][6]) + "\n")
-			save.write(str(self.profileStates[profileIndex][7]) + "\n")
-
-
-
-	# Since the profiles might be loaded into <profileStates> in an arbitrary order,
-    # we need to identify which profileState index corresponds to which profile number.
-    # This function just takes a profile/mouse number and searches <profileStates> for the 
-    # profileState corresponding to that mouse number. It then returns the correct index. 
-    #
-    # E.G MOUSE1's profileState index might be 4
-	def find_profile_state_index(self, mouseNumber):
-
-		for x in range(0,len(self.profileStates)):
-
-			if mouseNumber == int(self.profileStates[x][2]):
-
-				return x
-
-		return -1
+		self.sharedState.update(mouseNumber, dominant_hand=armState)
+		return armState
 
 
 	def select_mouse1_button_onClick(self):
@@ -393,32 +246,28 @@ class GUI:
 
 	def update_button_onClick(self):
 
-		self.load_animal_profiles()
-
 		if self.currentMouse > 0 and self.currentMouse <= 5:
 
-			profileIndex = self.find_profile_state_index(self.currentMouse)
-
-			if profileIndex == -1:
+			if 'dominant_hand' not in self.sharedState.get(self.currentMouse):
 
 				print("Error: Could not find profile for Mouse " + str(self.currentMouse))
 				return -1
 
 			else:
 
-				self.profileStates[profileIndex][4] = self.scale.get()
-				self.save_animal_profile(profileIndex)
-				self.update_label.config(text="Pellet presentation distance \n for Mouse " + str(self.profileStates[profileIndex][2]) + " has been updated to " + str(self.profileStates[profileIndex][4]) + "mm!")
+				dist = self.scale.get()
+				self.sharedState.update(self.currentMouse, difficulty_dist_mm=dist)
+				self.update_label.config(text="Pellet presentation distance \n for Mouse " + str(self.currentMouse) + " has been updated to " + str(dist) + "mm!")
 				if self.currentMouse == 1:
-					self.mouse1_label.config(text="Dist= " + str(self.profileStates[profileIndex][4]))
+					self.mouse1_label.config(text="Dist= " + str(dist))
 				elif self.currentMouse == 2:
-					self.mouse2_label.config(text="Dist= " + str(self.profileStates[profileIndex][4]))
+					self.mouse2_label.config(text="Dist= " + str(dist))
 				elif self.currentMouse == 3:
-					self.mouse3_label.config(text="Dist= " + str(self.profileStates[profileIndex][4]))
+					self.mouse3_label.config(text="Dist= " + str(dist))
 				elif self.currentMouse == 4:
-					self.mouse4_label.config(text="Dist= " + str(self.profileStates[profileIndex][4]))
+					self.mouse4_label.config(text="Dist= " + str(dist))
 				elif self.currentMouse == 5:
-					self.mouse5_label.config(text="Dist= " + str(self.profileStates[profileIndex][4]))
+					self.mouse5_label.config(text="Dist= " + str(dist))
 
 	def shutdown_onClick(self):
 		self.master.destroy()
@@ -429,10 +278,9 @@ class GUI:
 # object in the parent process first. Constructing a GUI object is expensive and
 # we don't want it tying up the parent process. This is bad practice but it's easy
 # so I'm leaving it for now.
-def start_gui_loop(animalProfilePath):
+def start_gui_loop(animalProfilePath, sharedState):
 
 	root = Tk()
-	gui = GUI(root, animalProfilePath)
-	gui.load_animal_profiles()
+	GUI(root, animalProfilePath, sharedState)
 	root.mainloop()
 	root.destroy()
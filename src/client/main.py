@@ -7,14 +7,20 @@
 
 import gui
 import arduinoClient
+import eventLog
+import pelletScheduler
+import pelletService
+import recorder
+import rfidReader
+import persistence
+import sharedState
 import systemCheck
 import time
 import socket
 import sys
-from time import sleep
 import multiprocessing
+import threading
 import serial
-from subprocess import PIPE, Popen
 import os
 import cv2
 import random
@@ -36,8 +42,63 @@ with open("../../config/config.txt") as config:
     DISPLAY_PREVIEW = config.readline()[16:]
     PROFILE_SAVE_DIRECTORY = config.readline()[23:]
     PROFILE_SAVE_DIRECTORY = PROFILE_SAVE_DIRECTORY[:len(PROFILE_SAVE_DIRECTORY) - 1]
+    # Optional KEY=VALUE settings after the fixed ones above. Missing keys keep their defaults.
+    OPTIONAL_CONFIG = {}
+    for line in config:
+        key, sep, value = line.strip().partition("=")
+        if sep:
+            OPTIONAL_CONFIG[key] = value
 config.close()
 
+# Serial ports for the Arduino server and the RFID reader. Point ARDUINO_PORT at arduinoSimulator.py's pty to run
+# without the hardware.
+ARDUINO_PORT = OPTIONAL_CONFIG.get("ARDUINO_PORT", "/dev/ttyUSB0")
+RFID_PORT = OPTIONAL_CONFIG.get("RFID_PORT", "/dev/ttyUSB1")
+# Video recorder executable. Set it to mockSessionVideo.py to run without the camera. A relative path is relative to
+# this directory (Popen only searches PATH for a bare name, it wouldn't find mockSessionVideo.py here).
+RECORDER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             OPTIONAL_CONFIG.get("RECORDER_PATH", "../../bin/SessionVideo"))
+# Shared memory ring the recorder writes pellet ROI crops into, and the classifier run on them. Set PELLET_ROI_PATH
+# to nothing to turn pellet detection off. Without the model pellets are presented on the timer alone.
+PELLET_ROI_PATH = OPTIONAL_CONFIG.get("PELLET_ROI_PATH", "/dev/shm/homecage_pellet_roi")
+PELLET_MODEL_PATH = OPTIONAL_CONFIG.get("PELLET_MODEL_PATH", "../analysis/pelletModel/model.h5")
+
+
+TRIAL_LIMIT_CONFIG_PATH = "../../config/trialLimitConfig.txt"
+
+# When pellets are presented, retried and counted as trials. See pelletScheduler.py for the PELLET_* keys that can be
+# set in config.txt.
+PELLET_POLICY = pelletScheduler.load_policy(OPTIONAL_CONFIG)
+# How long to wait for the Arduino to finish positioning the stepper before giving up on it. Moving the stepper all
+# the way takes ~6 seconds.
+STEPPER_TIMEOUT = 15
+
+# Number of sessions each mouse has started today, keyed by mouse number.
+trialsToday = {}
+
+# Reads the daily trial limit for mice 1-5 from trialLimitConfig.txt. Returns a dict keyed by mouse number.
+# This is only read at start up, after that the limits live in SharedState.
+def loadAnimalProfileTrialLimits():
+
+    limits = {}
+    with open(TRIAL_LIMIT_CONFIG_PATH) as f:
+        for mouseNumber in range(1, 6):
+            limits[str(mouseNumber)] = int(f.readline().rstrip())
+    return limits
+
+def saveAnimalProfileTrialLimits(settings):
+
+    limits = [str(settings.get(str(mouseNumber), {}).get('trial_limit', 0)) for mouseNumber in range(1, 6)]
+    persistence.atomic_write(TRIAL_LIMIT_CONFIG_PATH, "".join(limit + "\n" for limit in limits))
+
+def resetAnimalProfileTrialsToday():
+
+    currentDT = datetime.datetime.now()
+
+    if(currentDT.hour == "07"):
+        print("Resetting animal trial limits for the day!")
+        trialsToday.clear()
+
 
 # This function generates a list of AnimalProfiles found inside <profile_save_directory>.
 # It then reads the save.txt file for each profile found, and uses the information
@@ -53,82 +114,48 @@ config.close()
 #       - Logs
 #       - Videos
 #       - save.txt
-mouse1TrialLimit = None
-mouse2TrialLimit = None
-mouse3TrialLimit = None
-mouse4TrialLimit = None
-mouse5TrialLimit = None
-
-mouse1TrialsToday = 0
-mouse2TrialsToday = 0
-mouse3TrialsToday = 0
-mouse4TrialsToday = 0
-mouse5TrialsToday = 0
-
-def loadAnimalProfileTrialLimits():
-
-    global mouse1TrialLimit, mouse2TrialLimit, mouse3TrialLimit, mouse4TrialLimit, mouse5TrialLimit
-
-    with open("../../config/trialLimitConfig.txt") as f:
-        mouse1TrialLimit = int(f.readline().rstrip())
-        mouse2TrialLimit = int(f.readline().rstrip())
-        mouse3TrialLimit = int(f.readline().rstrip())
-        mouse4TrialLimit = int(f.readline().rstrip())
-        mouse5TrialLimit = int(f.readline().rstrip())
-
-def resetAnimalProfileTrialsToday():
-
-    global mouse1TrialsToday, mouse2TrialsToday, mouse3TrialsToday, mouse4TrialsToday, mouse5TrialsToday
-    currentDT = datetime.datetime.now()
-
-    if(currentDT.hour == "07"):
-        print("Resetting animal trial limits for the day!")
-        mouse1TrialsToday = 0
-        mouse2TrialsToday = 0
-        mouse3TrialsToday = 0
-        mouse4TrialsToday = 0
-        mouse5TrialsToday = 0
-
-
-
 def loadAnimalProfiles(profile_save_directory):
     # Get list of profile folders
     profile_names = os.listdir(profile_save_directory)
     profiles = []
 
     for profile in profile_names:
-
-        # Build save file path
-        load_file = profile_save_directory + profile + "/" + profile + "_save.txt"
-        profile_state = []
-
-        # Open the save file
-        try:
-            load = open(load_file, 'r')
-        except IOError:
-            print("Could not open AnimalProfile save file!")
-
-        # Read all lines from save file and strip them
-        with load:
-            profile_state = load.readlines()
-        profile_state = [x.strip() for x in profile_state]
-
-        # Create AnimalProfile object using loaded data and put it in profile list
-        ID = profile_state[0]
-        name = profile_state[1]
-        mouseNumber = profile_state[2]
-        cageNumber = profile_state[3]
-        difficulty_dist_mm = profile_state[4]
-        dominant_hand = profile_state[5]
-        session_count = profile_state[6]
-        animal_profile_directory = profile_state[7]
-        temp = AnimalProfile(ID, name, mouseNumber, cageNumber, difficulty_dist_mm, dominant_hand, session_count,
-                             animal_profile_directory, False)
-        profiles.append(temp)
+        profiles.append(loadAnimalProfile(profile_save_directory, profile))
 
     return profiles
 
 
+# Reconstructs a single AnimalProfile from <profile_save_directory>/<profile>/<profile>_save.txt.
+def loadAnimalProfile(profile_save_directory, profile):
+
+    # Build save file path
+    load_file = profile_save_directory + profile + "/" + profile + "_save.txt"
+    profile_state = []
+
+    # Open the save file
+    try:
+        load = open(load_file, 'r')
+    except IOError:
+        print("Could not open AnimalProfile save file!")
+
+    # Read all lines from save file and strip them
+    with load:
+        profile_state = load.readlines()
+    profile_state = [x.strip() for x in profile_state]
+
+    # Create AnimalProfile object using loaded data
+    ID = profile_state[0]
+    name = profile_state[1]
+    mouseNumber = profile_state[2]
+    cageNumber = profile_state[3]
+    difficulty_dist_mm = profile_state[4]
+    dominant_hand = profile_state[5]
+    session_count = profile_state[6]
+    animal_profile_directory = profile_state[7]
+    return AnimalProfile(ID, name, mouseNumber, cageNumber, difficulty_dist_mm, dominant_hand, session_count,
+                         animal_profile_directory, False)
+
+
 class AnimalProfile(object):
 
     #    A profile containing all information related to a particular animal. When a new animal is added to the system,
@@ -182,19 +209,14 @@ class AnimalProfile(object):
 
     # This function writes the state of the AnimalProfile object to the
     # AnimalProfile's save file.
-    def saveProfile(self):
+    # Writes the save file atomically. Pass fsync=True at session boundaries so the session count survives a power cut.
+    def saveProfile(self, fsync=False):
 
         save_file_path = self.animal_profile_directory + str(self.name) + "_save.txt"
 
-        with open(save_file_path, 'w') as save:
-            save.write(str(self.ID) + "\n")
-            save.write(str(self.name) + "\n")
-            save.write(str(self.mouseNumber) + "\n")
-            save.write(str(self.cageNumber) + "\n")
-            save.write(str(self.difficulty_dist_mm) + "\n")
-            save.write(str(self.dominant_hand) + "\n")
-            save.write(str(self.session_count) + "\n")
-            save.write(str(self.animal_profile_directory) + "\n")
+        fields = [self.ID, self.name, self.mouseNumber, self.cageNumber, self.difficulty_dist_mm,
+                  self.dominant_hand, self.session_count, self.animal_profile_directory]
+        persistence.atomic_write(save_file_path, "".join(str(field) + "\n" for field in fields), fsync)
 
     # Generates the path where the video for the next session will be stored
     def genVideoPath(self, videoStartTimestamp):
@@ -205,7 +227,7 @@ class AnimalProfile(object):
 
     # This function takes all the information required for an animal's session log entry, and then formats it.
     # Once formatted, it appends the log entry to the animal's session_history.csv file.
-    def insertSessionEntry(self, start_timestamp, end_timestamp, trial_count):
+    def insertSessionEntry(self, start_timestamp, end_timestamp, trial_count, fsync=False):
 
         # TODO: Is there a better way to create + format strings?
         session_history = self.log_save_directory + str(self.name) + "_session_history.csv"
@@ -217,8 +239,115 @@ class AnimalProfile(object):
             trial_count) + "," + str(self.difficulty_dist_mm) + "," + str(
             self.dominant_hand) + "," + start_date + "," + start_time + "," + end_date + "," + end_time + "\n"
 
-        with open(session_history, "a") as log:
-            log.write(csv_entry)
+        persistence.append_line(session_history, csv_entry, fsync)
+
+
+class ProfileRegistry(object):
+    """
+        Holds every AnimalProfile in memory, keyed by RFID, so authorizing an RFID is a dict lookup instead of
+        re-reading every save file. Profiles are loaded from disk once at start up.
+
+        The configuration GUI runs in its own process and edits per-mouse settings (pellet distance, presentation arm)
+        through <shared_state>. Pending edits are applied before every lookup by comparing the shared version counter,
+        so picking them up costs one call when nothing changed and never touches the disk. Writing them to the save
+        files is left to persist(), which runs on a StatePersister thread.
+
+        The GUI only edits the pellet distance and the presentation arm, so those are the only fields taken from
+        <shared_state>. Everything else (session_count in particular) belongs to the SessionController.
+
+        Attributes:
+            profile_save_directory: The directory the AnimalProfiles live in.
+            shared_state: The SharedState the GUI writes its changes to.
+            profiles: Dict mapping RFID -> AnimalProfile.
+            lock: Held while profiles are modified or saved, since the persister thread saves them too.
+    """
+
+    def __init__(self, profile_save_directory, shared_state):
+
+        self.profile_save_directory = profile_save_directory
+        self.shared_state = shared_state
+        self.profiles = {}
+        self.lock = threading.RLock()
+        self.version = -1
+
+        for profile in loadAnimalProfiles(profile_save_directory):
+            self.profiles[profile.ID] = profile
+
+    # Publishes the loaded profiles and trial limits to <shared_state> so the GUI starts from the same values.
+    def seed_shared_state(self, trial_limits):
+
+        for mouseNumber, trial_limit in trial_limits.items():
+            self.shared_state.update(mouseNumber, trial_limit=trial_limit)
+        for profile in self.profiles.values():
+            self.shared_state.update(profile.mouseNumber, name=profile.name,
+                                     difficulty_dist_mm=profile.difficulty_dist_mm,
+                                     dominant_hand=profile.dominant_hand)
+        self.version = self.shared_state.get_version()
+
+    def profile_list(self):
+
+        return list(self.profiles.values())
+
+    def find_by_mouse_number(self, mouseNumber):
+
+        for profile in self.profiles.values():
+            if profile.mouseNumber == str(mouseNumber):
+                return profile
+
+        return None
+
+    # Returns the profile whose ID matches <RFID>, or -1 if there isn't one.
+    def lookup(self, RFID):
+
+        self.poll_changes()
+        return self.profiles.get(RFID, -1)
+
+    # Applies any settings the GUI has changed since the last call. Never blocks on disk.
+    def poll_changes(self):
+
+        if self.shared_state.get_version() == self.version:
+            return
+
+        version, settings = self.shared_state.snapshot()
+        with self.lock:
+            self.apply(settings)
+            self.version = version
+
+    def apply(self, settings):
+
+        for mouseNumber, entry in settings.items():
+            profile = self.find_by_mouse_number(mouseNumber)
+            if profile is None:
+                continue
+            if 'difficulty_dist_mm' in entry:
+                profile.difficulty_dist_mm = int(entry['difficulty_dist_mm'])
+            if 'dominant_hand' in entry:
+                profile.dominant_hand = str(entry['dominant_hand'])
+
+    def save_profile(self, profile, fsync=False):
+
+        with self.lock:
+            profile.saveProfile(fsync)
+
+    # StatePersister callback. Writes the trial limit file and the save file of every profile whose
+    # settings changed since the last persisted snapshot.
+    def persist(self, settings, previousSettings):
+
+        self.poll_changes()
+
+        limitsChanged = False
+        for mouseNumber, entry in settings.items():
+            previous = previousSettings.get(mouseNumber, {})
+            if entry.get('trial_limit') != previous.get('trial_limit'):
+                limitsChanged = True
+            if (entry.get('difficulty_dist_mm') != previous.get('difficulty_dist_mm') or
+                    entry.get('dominant_hand') != previous.get('dominant_hand')):
+                profile = self.find_by_mouse_number(mouseNumber)
+                if profile is not None:
+                    self.save_profile(profile)
+
+        if limitsChanged:
+            saveAnimalProfileTrialLimits(settings)
 
 
 class SessionController(object):
@@ -230,30 +359,29 @@ class SessionController(object):
                 A SessionController has the following properties:
 
 		Attributes:
-			profile_list: A list containing all animal profiles.
+			profile_registry: A ProfileRegistry containing all animal profiles.
 			arduino_client: An object that wraps a serial interface for talking to the Arduino server.
+			recorder: A RecorderProcess holding an initialized camera in standby, ready to record a session.
+			pellet_service: A PelletService reporting whether the pellet is still there, or None to present
+				pellets on the timer alone.
+			pellet_policy: The PelletPolicy each session's PelletScheduler follows.
 	"""
 
-    def __init__(self, profile_list, arduino_client):
+    def __init__(self, profile_registry, arduino_client, recorder, pellet_service=None,
+                 pellet_policy=pelletScheduler.DEFAULT_POLICY):
 
-        self.profile_list = profile_list
+        self.profile_registry = profile_registry
         self.arduino_client = arduino_client
+        self.recorder = recorder
+        self.pellet_service = pellet_service
+        self.pellet_policy = pellet_policy
 
-    def set_profile_list(self, profileList):
-
-        self.profile_list = profileList
-
-    # This function searches the SessionController's profile_list for a profile whose ID
+    # This function searches the SessionController's profile_registry for a profile whose ID
     # matches the supplied RFID. If a profile is found, it is returned. If no profile is found,
     # -1 is returned. (Not very pythonic but I have C-like habits.) 
     def searchForProfile(self, RFID):
 
-        for profile in self.profile_list:
-
-            if profile.ID == RFID:
-                return profile
-
-        return -1
+        return self.profile_registry.lookup(RFID)
 
     def print_session_start_information(self, profile, startTime):
 
@@ -273,11 +401,10 @@ class SessionController(object):
     # The session remains active until a signal is received from the Arduino server indicating that
     # the IR beam breaker has been reconnected.
     #
-    # Each session forks a process that records video for the duration of the session. 
-    # This function is also responsible for sending a terminate signal to that forked process.
-    # This signal is sent by creating a file called 'KILL' in the current working
-    # directory (Not good, but does the job. I was halfway through implementing IPC with sockets 
-    # but didn't have time to finish).
+    # Each session records video for the duration of the session. The recording process is spawned once
+    # at system start and keeps the camera initialized between sessions, so this function only has to tell it
+    # where to write the video and wait for it to confirm that it's recording. At the end of the session it
+    # tells the recorder to stop, which puts it back in standby for the next session.
     #
     # This function is also responsible for telling the Arduino server how to position the stepper motors and
     # for periodically sending get pellet requests.
@@ -296,194 +423,189 @@ class SessionController(object):
         self.print_session_start_information(profile, startTime)
 
         vidPath = profile.genVideoPath(startTime)
+        # Every event in the session gets logged with a timestamp and the video frame it happened on. See eventLog.py.
+        events = eventLog.SessionEventLog(profile.log_save_directory + os.path.basename(vidPath) + "_events.jsonl",
+                                          self.recorder)
+        events.log("SESSION_START", wall_time=startTime, mouse=profile.name, RFID=profile.ID, video=vidPath,
+                   difficulty_dist_mm=profile.difficulty_dist_mm, dominant_hand=profile.dominant_hand)
+
         if "TEST" in profile.name:
-            p = Popen(
-                ['../../bin/SessionVideo', vidPath, WIDTH, HEIGHT, OFFSET_X, OFFSET_Y, "50", EXPOSURE, BITRATE, "1"],
-                stdin=PIPE)
+            recording = self.recorder.start_recording(vidPath, "50", "1")
         else:
-            p = Popen(['../../bin/SessionVideo', vidPath, WIDTH, HEIGHT, OFFSET_X, OFFSET_Y, FPS, EXPOSURE, BITRATE,
-                       DISPLAY_PREVIEW], stdin=PIPE)
-
-        # Tell server to move stepper to appropriate position for current profile
-        self.arduino_client.serialInterface.write(b'3')
-        stepperMsg = str(profile.difficulty_dist_mm)
-        self.arduino_client.serialInterface.write(stepperMsg.encode())
-        sleep(1)
-
-        # Main session loop. Runs until it receives TERM sig from server. Polls
-        # the camera queue for GETPEL messages and forwards to server if it receives one.
-        if profile.dominant_hand == "LEFT":
-            self.arduino_client.serialInterface.write(b'1')
-        elif profile.dominant_hand == "RIGHT":
-            self.arduino_client.serialInterface.write(b'2')
-
-        trial_count = 1
-        sleep(6)
-        now = time.time()
-
-
-
-
-        while True:
-
-            if (time.time() - now > 7):
-                if profile.dominant_hand == "LEFT":
-                    self.arduino_client.serialInterface.write(b'1')
-                elif profile.dominant_hand == "RIGHT":
-                    self.arduino_client.serialInterface.write(b'2')
-                now = time.time()
-                trial_count += 1
-
-            # Check if message has arrived from server, if it has, check if it is a TERM message.
-            if self.arduino_client.serialInterface.in_waiting > 0:
-                serial_msg = self.arduino_client.serialInterface.readline().rstrip().decode()
-                if serial_msg == "TERM":
-                    break
-
-        open('KILL', 'a').close()
-        p.wait()
-        os.remove("KILL")
-
-        # Log session information.
+            recording = self.recorder.start_recording(vidPath, FPS, DISPLAY_PREVIEW)
+        if not recording:
+            print("Warning: Recorder did not confirm that it started recording " + vidPath)
+        events.log("RECORDING_STARTED", ok=recording, fps=self.recorder.recordingFps)
+
+        # Every message from the server goes into the event log. TERM is sent when the IR beam is broken, which is
+        # what ends a session.
+        def log_arduino_message(kind, seq, line):
+            if kind == "TERM":
+                events.log("TERM")
+            elif kind == "OTHER":
+                events.log("ARDUINO_MSG", msg=line)
+            else:
+                events.log("ARDUINO_" + kind, seq=seq)
+        self.arduino_client.messageListener = log_arduino_message
+
+        # Tell server to move stepper to appropriate position for current profile, and wait until it's there.
+        stepperSeq = self.arduino_client.move_stepper(profile.difficulty_dist_mm)
+        events.log("STEPPER_REQUEST", seq=stepperSeq, difficulty_dist_mm=profile.difficulty_dist_mm)
+        if self.arduino_client.wait_for(stepperSeq, STEPPER_TIMEOUT) is None:
+            print("Warning: Arduino did not report the stepper positioned, continuing anyway")
+
+        # Main session loop. Runs until it receives TERM sig from server. The PelletScheduler decides when the next
+        # pellet is requested and which presentations count as trials, from the server's replies and what the pellet
+        # classifier sees on the platform.
+        if self.pellet_service is not None:
+            self.pellet_service.reset()
+        scheduler = pelletScheduler.PelletScheduler(self.pellet_policy, self.pellet_service, time.monotonic())
+
+        while not self.arduino_client.termReceived:
+
+            if scheduler.due(time.monotonic()):
+                pelletSeq = self.arduino_client.present_pellet(profile.dominant_hand)
+                scheduler.armed(pelletSeq, time.monotonic())
+                events.log("PELLET_REQUEST", seq=pelletSeq, presentation=scheduler.presentations,
+                           hand=profile.dominant_hand)
+
+            self.arduino_client.poll(timeout=0.05)
+
+            status = None
+            if scheduler.seq is not None:
+                status = self.arduino_client.status(scheduler.seq)
+            seq = scheduler.seq
+            outcome = scheduler.update(time.monotonic(), status)
+            if outcome == pelletScheduler.FAILED and status is None:
+                print("Warning: Arduino did not report pellet presentation " + str(seq) + " done")
+            if outcome is not None:
+                probability = self.pellet_service.probability if self.pellet_service is not None else None
+                events.log("PELLET_OUTCOME", outcome=outcome, presentation=scheduler.presentations,
+                           trial=scheduler.trials, probability=probability)
+
+        self.arduino_client.messageListener = None
+        trial_count = scheduler.trials
+
+        framesRecorded = self.recorder.stop_recording()
+        if framesRecorded < 0:
+            print("Warning: Recorder did not confirm that it stopped recording " + vidPath)
+        events.log("RECORDING_STOPPED", frames=framesRecorded)
+
+        # Log session information. Pick up any GUI edits made during the session first so saving the
+        # profile doesn't overwrite them.
         endTime = time.time()
-        profile.insertSessionEntry(startTime, endTime, trial_count)
-        profile.saveProfile()
+        self.profile_registry.poll_changes()
+        profile.insertSessionEntry(startTime, endTime, trial_count, fsync=True)
+        self.profile_registry.save_profile(profile, fsync=True)
+        events.log("SESSION_END", wall_time=endTime, trials=trial_count, presentations=scheduler.presentations,
+                   outcomes=scheduler.outcomes)
+        events.close()
         self.print_session_end_information(profile, endTime)
 
 
 
-# Just a wrapper to launch the configuration GUI in its own process. 
-def launch_gui():
-    gui_process = multiprocessing.Process(target=gui.start_gui_loop, args=(PROFILE_SAVE_DIRECTORY,))
+# Just a wrapper to launch the configuration GUI in its own process. The GUI reads and writes
+# its settings through <shared_state>.
+def launch_gui(shared_state):
+    gui_process = multiprocessing.Process(target=gui.start_gui_loop, args=(PROFILE_SAVE_DIRECTORY, shared_state))
     gui_process.start()
     return gui_process
 
 
+# Spawns the video recording process in standby mode so the camera is already initialized
+# when the first animal shows up.
+def launch_recorder():
+    session_recorder = recorder.RecorderProcess(RECORDER_PATH, WIDTH, HEIGHT, OFFSET_X, OFFSET_Y, FPS,
+                                                EXPOSURE, BITRATE, DISPLAY_PREVIEW, PELLET_ROI_PATH)
+    if not session_recorder.spawn():
+        print("Warning: Recorder did not report ready. It will be respawned at the start of the next session.")
+    return session_recorder
+
+
 # This function initializes all the high level system components, returning a handle to each one. 
 def sys_init():
-    profile_list = loadAnimalProfiles(PROFILE_SAVE_DIRECTORY)
-    arduino_client = arduinoClient.client("/dev/ttyUSB0", 9600)
+    arduino_client = arduinoClient.client(ARDUINO_PORT, 9600)
     print("first step")
-    ser = serial.Serial('/dev/ttyUSB1', 9600)
+    # The reader thread does the RFID frame parsing, checksum validation and duplicate suppression, the main
+    # loop only ever sees one arrival per visit.
+    rfid_reader = rfidReader.RFIDReader(serial.Serial(RFID_PORT, 9600))
+    rfid_reader.start()
     
-    guiProcess = launch_gui()
-    session_controller = SessionController(profile_list, arduino_client)
-    return profile_list, arduino_client, session_controller, ser, guiProcess
-
+    # The manager process has to be running before the GUI process is forked.
+    shared_state = sharedState.SharedState(multiprocessing.Manager())
+    profile_registry = ProfileRegistry(PROFILE_SAVE_DIRECTORY, shared_state)
+    profile_registry.seed_shared_state(loadAnimalProfileTrialLimits())
+    sharedState.StatePersister(shared_state, profile_registry.persist).start()
 
-# This function listens to the open port of a serial object. It waits for <x02> 
-# to indicate the start of an RFID, if then appends to a string until it detects <x03>, indicating the end
-# of the RFID.
-def listen_for_rfid(ser):
-    rfid = ''
-
-    while (ser.is_open):
-
-        byte = ser.read(1)
-
-        if (byte == b'\x02'):
-            rfid = ''
-        elif (byte == b'\x03'):
-            return rfid
-        else:
-            rfid += byte.decode('utf-8')
+    guiProcess = launch_gui(shared_state)
+    session_recorder = launch_recorder()
+    # The classifier model is loaded once here and watches the recorder's ROI crops for the rest of the run.
+    pellet_service = pelletService.start_pellet_service(PELLET_ROI_PATH, PELLET_MODEL_PATH)
+    session_controller = SessionController(profile_registry, arduino_client, session_recorder, pellet_service,
+                                           PELLET_POLICY)
+    return profile_registry, shared_state, arduino_client, session_controller, rfid_reader, guiProcess
 
 
 
 def main():
 
-    global mouse1TrialLimit, mouse2TrialLimit, mouse3TrialLimit, mouse4TrialLimit, mouse5TrialLimit
-    global mouse1TrialsToday, mouse2TrialsToday, mouse3TrialsToday, mouse4TrialsToday, mouse5TrialsToday
-
-    loadAnimalProfileTrialLimits()
     # These are handles to all the main system components.
     
-    profile_list, arduino_client, session_controller, ser, guiProcess = sys_init()
+    profile_registry, shared_state, arduino_client, session_controller, rfid_reader, guiProcess = sys_init()
 
-    # Entry point of the system. This block waits for an RFID to enter the <SERIAL_INTERFACE_PATH> buffer.
-    # Once it receives an RFID, it parses it and searches for a profile with a matching RFID. If a profile
+    # Entry point of the system. This block waits for the RFID reader thread to report an animal arriving.
+    # Once it receives an RFID, it searches for a profile with a matching RFID. If a profile
     # is found, it starts a session for that profile. If no profile is found, it goes back to listening for
     # an RFID.
     while True:
 
         # Block until RFID is received
         print("Waiting for RFID...")
-        RFID_code = listen_for_rfid(ser)[:12]
+        RFID_code = rfid_reader.get().tag
         # Check RFID authorization
         profile = session_controller.searchForProfile(RFID_code)
 
         # RFID authorized
         if profile != -1:
 
-            # Before starting a session, reload the animal profiles. This is done incase a profile was
-            # changed by the GUI or some other process since the last load occured.
+            # Profile edits made by the GUI have already been applied by the lookup above.
             resetAnimalProfileTrialsToday()
-            session_controller.set_profile_list(loadAnimalProfiles(PROFILE_SAVE_DIRECTORY))
-            profile = session_controller.searchForProfile(RFID_code)
-
-            if(profile.mouseNumber == "1"):
-                if(mouse1TrialsToday >= mouse1TrialLimit):
-                    print("MOUSE1 has reached maximum trials for today...aborting!")
-                    continue
-                else:
-                    mouse1TrialsToday += 1
-
-            elif(profile.mouseNumber == "2"):
-                if(mouse2TrialsToday >= mouse2TrialLimit):
-                    print("MOUSE2 has reached maximum trials for today...aborting!")
-                    continue
-                else:
-                    mouse2TrialsToday += 1
-
-            elif(profile.mouseNumber == "3"):
-                if(mouse3TrialsToday >= mouse3TrialLimit):
-                    print("MOUSE3 has reached maximum trials for today...aborting!")
-                    continue
-                else:
-                    mouse3TrialsToday += 1
-
-            elif(profile.mouseNumber == "4"):
-                if(mouse4TrialsToday >= mouse4TrialLimit):
-                    print("MOUSE4 has reached maximum trials for today...aborting!")
-                    continue
-                else:
-                    mouse4TrialsToday += 1
-
-            elif(profile.mouseNumber == "5"):
-                if(mouse5TrialsToday >= mouse5TrialLimit):
-                    print("MOUSE5 has reached maximum trials for today...aborting!")
-                    continue
-                else:
-                    mouse5TrialsToday += 1
-
-
-            # Start a session on Arduino server side. <A> is the magic byte that tells the Arduino to start a session.
-            arduino_client.serialInterface.write(b'A')
+
+            # Trial limits are set in the GUI and read straight from the shared state.
+            trialLimit = shared_state.get(profile.mouseNumber).get('trial_limit')
+            if trialLimit is not None and trialsToday.get(profile.mouseNumber, 0) >= int(trialLimit):
+                print("MOUSE" + profile.mouseNumber + " has reached maximum trials for today...aborting!")
+                continue
+
+
+            # Start a session on Arduino server side.
+            if not arduino_client.start_session():
+                print("Arduino did not confirm the session start...aborting!")
+                # Forget this animal's read too, so it gets another try the next time it's read instead of waiting
+                # out the repeat-read window.
+                rfid_reader.clear_pending()
+                continue
+            # Only a session that actually starts counts against the trial limit.
+            if trialLimit is not None:
+                trialsToday[profile.mouseNumber] = trialsToday.get(profile.mouseNumber, 0) + 1
             # Start a session on Python client side.
             session_controller.startSession(profile)
             # After the session returns, flush the Arduino serial communication buffer.
             arduino_client.serialInterface.flush()
-
-            # Load profileList after each session as well. Can't remember why I decided to reload profiles before AND after session, 
-            # but I don't see any downside and removing this might break something. 
-            session_controller.set_profile_list(loadAnimalProfiles(PROFILE_SAVE_DIRECTORY))
-            loadAnimalProfileTrialLimits()
+            # Other animals may have been read at the tube entrance while the session was running. Those
+            # arrivals are stale now, same as before when the serial buffer was reset here, and their next read
+            # counts as a new arrival.
+            rfid_reader.clear_pending(RFID_code)
         # RFID NOT authorized
         else:
 
-            # <Y> is the magic byte that tells the Arduino server that the RFID was rejected. Sending this rejection notice
-            # is no longer necessary, it is a relic of when the RFID sensor was handled by the Arduino directly. However, removing it
+            # Tell the Arduino server that the RFID was rejected. Sending this rejection notice is no longer necessary,
+            # it is a relic of when the RFID sensor was handled by the Arduino directly. However, removing it
             # would require modifying the Arduino server code and there's no need for that at present. 
-            arduino_client.serialInterface.write(b'Y')
+            arduino_client.reject_rfid()
             unrecognized_id_msg = RFID_code + " not recognized. Aborting session.\n\n"
             print(unrecognized_id_msg)
 
-        # Reset RFID serial buffers. This is necessary because while an animal is in a session, it's RFID chip will often 
-        # get read many times as it wiggles around under the RFID sensor. This buffer reset prevents those additional reads
-        # from being processed after the session ends. 
-        ser.reset_input_buffer()
-        ser.reset_output_buffer()
-
 
 
 # Python convention for launching main() function.
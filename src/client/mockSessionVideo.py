@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import pelletRing
+
+
+"""
+    Stand-in for bin/SessionVideo that doesn't need a camera or the Spinnaker SDK. It takes the same arguments,
+
+        mockSessionVideo.py <VIDEO_PATH|--standby> WIDTH HEIGHT OFFSET_X OFFSET_Y FPS EXPOSURE BITRATE PREVIEW_WINDOW
+                            [PELLET_ROI_PATH]
+
+    speaks the same standby protocol on stdin/stdout (see SessionVideo.cpp) and stops on the same KILL file. Instead of
+    camera frames it generates synthetic mono frames (noise plus a moving blob) at the requested FPS and writes them
+    to a real AVI through OpenCV, so the rest of the session pipeline (and the disk) sees the same load it would with
+    the camera. Set RECORDER_PATH in config.txt to this file to use it. OFFSET_X, OFFSET_Y, EXPOSURE and BITRATE are
+    accepted and ignored.
+
+    Like SessionVideo, ".avi" is appended to the video path, and with PREVIEW_WINDOW=1 frames are shown instead of
+    recorded. If PELLET_ROI_PATH is given, the pellet crop of every PELLET_CLASSIFIER_FRAME_INTERVAL-th recorded frame
+    is written into the shared memory ring there (see pelletRing.py).
+"""
+
+
+# Same as pelletClassifierFrameInterval in SessionVideo.cpp.
+PELLET_CLASSIFIER_FRAME_INTERVAL = 100
+
+
+class SyntheticCamera(object):
+    """
+        Produces WIDTHxHEIGHT 8 bit frames cheaply: a fixed noise background with a bright blob that moves around,
+        so the video isn't trivially compressible.
+    """
+
+    def __init__(self, width, height):
+
+        self.width = width
+        self.height = height
+        rng = np.random.RandomState(0)
+        self.background = rng.randint(0, 64, (height, width)).astype(np.uint8)
+        self.frameIndex = 0
+
+    def next_frame(self):
+
+        frame = self.background.copy()
+        t = self.frameIndex / 30.0
+        centre = (int(self.width / 2 + self.width / 3 * np.sin(t)), int(self.height / 2 + self.height / 3 * np.cos(t)))
+        cv2.circle(frame, centre, max(4, self.height // 10), 255, -1)
+        self.frameIndex += 1
+        return frame
+
+
+# Reads stdin lines on a thread so the capture loop can check for commands without blocking.
+class StdinReader(threading.Thread):
+
+    def __init__(self):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lines = queue.Queue()
+        self.closed = False
+
+    def run(self):
+
+        for line in sys.stdin:
+            self.lines.put(line.strip())
+        self.closed = True
+        self.lines.put(None)
+
+    def read_line(self, timeout=None):
+
+        try:
+            return self.lines.get(timeout=timeout)
+        except queue.Empty:
+            return ""
+
+
+def recorder_output(line):
+
+    print(line)
+    sys.stdout.flush()
+
+
+# Records until the KILL file appears or (in standby mode) STOP is received. Returns the number of frames recorded.
+def acquire_images(camera, vidPath, fps, preview, stdinReader=None, roiRing=None):
+
+    if not vidPath.endswith(".avi"):
+        vidPath += ".avi"
+    writer = None
+    if not preview:
+        writer = cv2.VideoWriter(vidPath, cv2.VideoWriter_fourcc(*"MJPG"), fps, (camera.width, camera.height), False)
+        if not writer.isOpened():
+            print("Unable to open " + vidPath)
+            return -1
+
+    print("Acquiring images...")
+    if roiRing is not None:
+        roiRing.set_frame_count(0)
+    if stdinReader is not None:
+        recorder_output("RECORDER:RECORDING")
+
+    n_frames = 0
+    start = time.monotonic()
+    nextFrameTime = start
+    while True:
+        if os.path.isfile("KILL"):
+            break
+        if stdinReader is not None:
+            cmd = stdinReader.read_line(timeout=0) if not stdinReader.closed else None
+            if cmd == "STOP" or cmd is None:
+                break
+
+        # Pace frames like a camera running at <fps>. If writing can't keep up, frames just come out late.
+        delay = nextFrameTime - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        nextFrameTime += 1.0 / fps
+
+        frame = camera.next_frame()
+        if preview:
+            cv2.imshow("PtGrey Live Feed", frame)
+            cv2.waitKey(1)
+        else:
+            writer.write(frame)
+            if roiRing is not None and n_frames % PELLET_CLASSIFIER_FRAME_INTERVAL == 0:
+                roiRing.write(pelletRing.roi_crop(frame), n_frames)
+            n_frames += 1
+            if roiRing is not None:
+                roiRing.set_frame_count(n_frames)
+
+    duration = time.monotonic() - start
+    if writer is not None:
+        writer.release()
+
+    print("FRAMES RECORDED: " + str(n_frames))
+    print("TARGET ACQUISITION DURATION: {:.2f}".format(n_frames / float(fps)))
+    print("ACTUAL ACQUISITION DURATION: {:.2f}".format(duration))
+    if stdinReader is not None:
+        recorder_output("RECORDER:STOPPED " + str(n_frames))
+    return n_frames
+
+
+def main():
+
+    if len(sys.argv) < 10:
+        print("Usage: mockSessionVideo.py <VIDEO_PATH|--standby> WIDTH HEIGHT OFFSET_X OFFSET_Y FPS EXPOSURE BITRATE "
+              "PREVIEW_WINDOW [PELLET_ROI_PATH]")
+        return 1
+
+    width = int(sys.argv[2])
+    height = int(sys.argv[3])
+    fps = int(sys.argv[6])
+    preview = int(sys.argv[9])
+    camera = SyntheticCamera(width, height)
+    roiRing = pelletRing.ROIRingWriter(sys.argv[10]) if len(sys.argv) > 10 else None
+
+    if sys.argv[1] != "--standby":
+        acquire_images(camera, sys.argv[1], fps, preview, roiRing=roiRing)
+        return 0
+
+    stdinReader = StdinReader()
+    stdinReader.start()
+    recorder_output("RECORDER:READY")
+    while True:
+        cmd = stdinReader.read_line()
+        if cmd is None or cmd == "QUIT":
+            return 0
+
+        if cmd.startswith("START "):
+            # START <FPS> <PREVIEW_WINDOW> <VIDEO_PATH>. The path is last so it may contain spaces.
+            fields = cmd.split(" ", 3)
+            if len(fields) < 4:
+                recorder_output("RECORDER:FAILED")
+                continue
+            if acquire_images(camera, fields[3], int(fields[1]), int(fields[2]), stdinReader, roiRing) < 0:
+                recorder_output("RECORDER:FAILED")
+            if stdinReader.closed:
+                return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
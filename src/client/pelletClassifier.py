@@ -5,38 +5,118 @@ from keras.layers import Dense, Dropout, BatchNormalization, Convolution2D, MaxP
 from keras.losses import binary_crossentropy
 from keras import callbacks
 from keras.callbacks import ModelCheckpoint, TensorBoard
+from keras.utils import Sequence
 import numpy as np
 from tqdm import tqdm
 from sklearn.model_selection import train_test_split
 import time
+from pelletInference import CropClassifier, preprocess_frames, resize_frames, batches
 
+PREPROCESS_CHUNK = 1024
+
+
+# Loads the same number of negative and positive examples from the .npy files, resized to 80x80, in random order.
+# The files are memory mapped and resized PREPROCESS_CHUNK frames at a time straight into their shuffled place in the
+# output, so the only full size copy of the dataset is the float32 array that's returned. For datasets that don't fit
+# in memory at all, use PelletSequence instead.
 def preprocess(posTxt, negTxt):
-    negList = np.load(negTxt)
-    posList = np.load(posTxt)
+    negList = np.load(negTxt, mmap_mode='r')
+    posList = np.load(posTxt, mmap_mode='r')
     length = min([len(negList), len(posList)])
-    x = []
-    y = []
-    for i in tqdm(range(length)):
-        item = cv2.resize(negList[i], (80, 80))
-        item = np.array(item).reshape((80, 80, 1))
-        x.append(item)
-        y.append(0)
-    for i in tqdm(range(length)):
-        item = cv2.resize(posList[i], (80, 80))
-        item = np.array(item).reshape((80, 80, 1))
-        x.append(item)
-        y.append(1)
+    x = np.empty((length * 2, 80, 80, 1), dtype=np.float32)
+    y = np.empty(length * 2, dtype=np.int64)
 
     index = np.random.permutation(length*2)
-    x = np.asarray(x, dtype=np.float32)
-    y = np.asarray(y)
-    x = x[index]
-    y = y[index]
+    for label, source in ((0, negList), (1, posList)):
+        for start in tqdm(range(0, length, PREPROCESS_CHUNK)):
+            stop = min(start + PREPROCESS_CHUNK, length)
+            destination = index[label * length + start:label * length + stop]
+            x[destination] = resize_frames(source[start:stop], 80, 80)
+            y[destination] = label
     return x, y
 
 
+class PelletSequence(Sequence):
+    """
+        Streams balanced, shuffled training batches out of the negative and positive .npy files without loading
+        them: the files are memory mapped and only the frames of the current batch are read and resized.
+
+        Every batch is half negative and half positive examples. Each epoch uses as many examples of each class as
+        the smaller class has (like preprocess()), but the larger class is re-sampled every epoch instead of always
+        losing the same tail. Pass <negIndexes>/<posIndexes> to use a subset of each file, see split_sequences().
+
+        Attributes:
+            batchSize: Examples per batch (rounded down to an even number).
+            negIndexes, posIndexes: Which rows of each file this sequence draws from.
+    """
+
+    def __init__(self, posPath, negPath, batchSize=32, posIndexes=None, negIndexes=None, shuffle=True, seed=None):
+
+        self.pos = np.load(posPath, mmap_mode='r')
+        self.neg = np.load(negPath, mmap_mode='r')
+        self.batchSize = max(2, batchSize - batchSize % 2)
+        self.posIndexes = np.arange(len(self.pos)) if posIndexes is None else np.asarray(posIndexes)
+        self.negIndexes = np.arange(len(self.neg)) if negIndexes is None else np.asarray(negIndexes)
+        self.perClass = min(len(self.posIndexes), len(self.negIndexes))
+        self.shuffle = shuffle
+        self.random = np.random.RandomState(seed)
+        self.on_epoch_end()
+
+    def __len__(self):
+
+        return int(np.ceil(self.perClass * 2.0 / self.batchSize))
+
+    def __getitem__(self, i):
+
+        half = self.batchSize // 2
+        neg = self.read(self.neg, self.epochNeg[i * half:(i + 1) * half])
+        pos = self.read(self.pos, self.epochPos[i * half:(i + 1) * half])
+        x = np.concatenate((neg, pos))
+        y = np.concatenate((np.zeros(len(neg), dtype=np.int64), np.ones(len(pos), dtype=np.int64)))
+        if self.shuffle:
+            order = self.random.permutation(len(x))
+            x, y = x[order], y[order]
+        return x, y
+
+    def on_epoch_end(self):
+
+        if self.shuffle:
+            self.epochNeg = self.random.permutation(self.negIndexes)[:self.perClass]
+            self.epochPos = self.random.permutation(self.posIndexes)[:self.perClass]
+        else:
+            self.epochNeg = self.negIndexes[:self.perClass]
+            self.epochPos = self.posIndexes[:self.perClass]
+
+    # Reads rows <indexes> of a memory mapped file, in file order so the reads are as sequential as they can be.
+    def read(self, source, indexes):
+
+        order = np.argsort(indexes)
+        frames = np.empty((len(indexes), 80, 80, 1), dtype=np.float32)
+        frames[order] = resize_frames(source[indexes[order]], 80, 80)
+        return frames
+
+
+# Splits both .npy files into a training and a validation PelletSequence, holding out <validationFraction> of each
+# class.
+def split_sequences(posPath, negPath, batchSize=32, validationFraction=0.1, seed=None):
 
-class CNN():
+    random = np.random.RandomState(seed)
+    posCount = len(np.load(posPath, mmap_mode='r'))
+    negCount = len(np.load(negPath, mmap_mode='r'))
+    posIndexes = random.permutation(posCount)
+    negIndexes = random.permutation(negCount)
+    posSplit = int(posCount * validationFraction)
+    negSplit = int(negCount * validationFraction)
+
+    train = PelletSequence(posPath, negPath, batchSize, posIndexes[posSplit:], negIndexes[negSplit:], seed=seed)
+    validation = PelletSequence(posPath, negPath, batchSize, posIndexes[:posSplit], negIndexes[:negSplit],
+                                shuffle=False)
+    return train, validation
+
+
+# The Keras model, for training. For inference only, pelletInference.PelletPredictor runs an exported copy of the
+# weights without Keras; both share predict_batch()/predict_video() through CropClassifier.
+class CNN(CropClassifier):
 
     def __init__(self, model_weight_path, logsDir=''):
 
@@ -87,6 +167,20 @@ class CNN():
 
         print ("Finished!")
 
+    # Same as train(), from PelletSequences (see split_sequences()) instead of in-memory arrays.
+    def train_sequence(self, trainSequence, validationSequence, epoch=20, workers=1):
+        if os.path.exists(self.model_weight_path):
+            self.model.load_weights(self.model_weight_path)
+            print ("model already loaded")
+
+        log = callbacks.CSVLogger(self.logsDir)
+        saveBest = ModelCheckpoint(self.model_weight_path, save_best_only=True)
+        tb = TensorBoard('logs/')
+        self.model.fit_generator(trainSequence, validation_data=validationSequence, callbacks=[log, saveBest, tb],
+                                 epochs=epoch, workers=workers)
+
+        print ("Finished!")
+
 
     def predict(self, rawImage):
         tempImage = cv2.cvtColor(rawImage, cv2.COLOR_RGB2GRAY)
@@ -98,6 +192,13 @@ class CNN():
         predY = self.model.predict(predX)
         return predY[0]
 
+    # Returns the pellet probability of each crop in <crops>, which are already preprocessed: 80x80 gray, e.g from
+    # preprocess_frames() or the recorder's ROI ring.
+    def predict_crops(self, crops):
+
+        predX = np.asarray(crops, dtype=np.float32).reshape((-1,) + self.inputShape)
+        return np.asarray(self.model.predict_on_batch(predX)).reshape(-1)
+
     def takeALook(self, teX, teY):
         model = C.getModel()
         startTime = time.time()
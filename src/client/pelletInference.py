@@ -0,0 +1,371 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import abc
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+
+"""
+    Keras-free inference for the pellet classifier. Importing Keras/TensorFlow and rebuilding the graph in
+    pelletClassifier.CNN takes seconds and hundreds of MB for what is a ~9k parameter network, so the trained
+    weights can be exported once to a small .npz file:
+
+        python pelletInference.py export ../analysis/pelletModel/model.h5 ../analysis/pelletModel/model.npz
+
+    and run with PelletPredictor, which only needs NumPy (and h5py for the export itself). The export freezes the
+    network for inference: dropout is dropped and every BatchNormalization layer is folded from its four moving
+    statistics into one per channel scale and shift. The last one, which sits between the max pool and the dense
+    layer, is folded into the dense layer's weights. The others can't be folded into the convolutions next to them
+    exactly (zero padding, max pooling), so they stay as a multiply-add.
+
+    The frame preprocessing shared with pelletClassifier lives here too, so it can be used without Keras.
+"""
+
+
+# The classifier looks at an 80x80 crop of the frame after it's been resized to 224x224: rows 116-196, cols 56-136.
+RESIZED_SIZE = 224
+CROP_ROWS = (116, 196)
+CROP_COLS = (56, 136)
+INPUT_SHAPE = (80, 80, 1)
+# Weights cv2.COLOR_RGB2GRAY uses.
+GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+# Keras' BatchNormalization default, used if the .h5 doesn't record the model config.
+DEFAULT_BN_EPSILON = 1e-3
+# Strides of the three convolutions in pelletClassifier.CNN.getModel(), in order.
+CONV_STRIDES = (2, 2, 1)
+EXPORT_VERSION = 1
+
+
+# Source pixel indexes and weights for sampling output pixels <start>..<stop> of a <srcSize> -> <dstSize> bilinear
+# resize, the way cv2.resize(..., interpolation=INTER_LINEAR) does.
+def linear_sample_grid(srcSize, dstSize, start, stop):
+
+    src = (np.arange(start, stop, dtype=np.float32) + 0.5) * (float(srcSize) / dstSize) - 0.5
+    src = np.maximum(src, 0)
+    i0 = np.minimum(np.floor(src).astype(np.int64), srcSize - 1)
+    i1 = np.minimum(i0 + 1, srcSize - 1)
+    weight = (src - i0).astype(np.float32)
+    return i0, i1, weight
+
+
+# Bilinearly samples the rows and columns given by two linear_sample_grid()s out of a stack of frames
+# ((N, H, W) or (N, H, W, C)). Returns float32.
+def sample_frames(frames, rowGrid, colGrid):
+
+    r0, r1, rw = rowGrid
+    c0, c1, cw = colGrid
+    rw = rw.reshape(1, -1, 1)
+    cw = cw.reshape(1, 1, -1)
+    if frames.ndim == 4:
+        rw = rw[..., np.newaxis]
+        cw = cw[..., np.newaxis]
+
+    top = frames[:, r0].astype(np.float32)
+    bottom = frames[:, r1].astype(np.float32)
+    rows = top + (bottom - top) * rw
+    left = rows[:, :, c0]
+    right = rows[:, :, c1]
+    return left + (right - left) * cw
+
+
+# Preprocesses a stack of frames ((N, H, W, 3) RGB or (N, H, W) gray) into the classifier's (N, 80, 80, 1) input in one
+# vectorized operation. Equivalent to converting each frame to gray, resizing it to 224x224 and cropping it (up to
+# rounding), but only the pixels of the crop are ever computed.
+def preprocess_frames(frames):
+
+    frames = np.asarray(frames)
+    height, width = frames.shape[1], frames.shape[2]
+    crop = sample_frames(frames, linear_sample_grid(height, RESIZED_SIZE, *CROP_ROWS),
+                         linear_sample_grid(width, RESIZED_SIZE, *CROP_COLS))
+
+    if crop.ndim == 4:
+        crop = crop.dot(GRAY_WEIGHTS)
+    return np.round(crop).reshape((-1, CROP_ROWS[1] - CROP_ROWS[0], CROP_COLS[1] - CROP_COLS[0], 1))
+
+
+# Resizes a stack of gray frames ((N, H, W) or (N, H, W, 1)) to (N, height, width, 1) float32 in one vectorized
+# operation, the same as cv2.resize() on each frame (up to rounding). Frames already the right size are just copied.
+def resize_frames(frames, height, width):
+
+    frames = np.asarray(frames)
+    if frames.ndim == 4:
+        frames = frames[..., 0]
+    if frames.shape[1:] == (height, width):
+        return frames.astype(np.float32).reshape((-1, height, width, 1))
+
+    resized = sample_frames(frames, linear_sample_grid(frames.shape[1], height, 0, height),
+                            linear_sample_grid(frames.shape[2], width, 0, width))
+    return np.round(resized).reshape((-1, height, width, 1))
+
+
+# Yields lists of up to <batchSize> items from <iterable>.
+def batches(iterable, batchSize):
+
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batchSize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class CropClassifier(abc.ABC):
+    """
+        Everything a pellet classifier does on top of predict_crops(), which subclasses implement: single images,
+        batches of frames and whole videos.
+    """
+
+    # Returns the pellet probability of every crop in <crops>, an (N, 80, 80, 1) stack made by preprocess_frames().
+    @abc.abstractmethod
+    def predict_crops(self, crops):
+
+        pass
+
+    # Returns the pellet probability of one RGB frame, as a 1 element array.
+    def predict(self, rawImage):
+
+        return self.predict_crops(preprocess_frames(np.asarray(rawImage)[np.newaxis]))[:1]
+
+    # Returns the pellet probability of every frame in <frames>, which can be an (N, H, W, 3) stack or any iterable
+    # of frames (e.g a generator reading a video). Frames are preprocessed and run through the model <batchSize> at a
+    # time, so memory stays bounded for iterators.
+    def predict_batch(self, frames, batchSize=256):
+
+        if isinstance(frames, np.ndarray):
+            frames = (frames[i:i + batchSize] for i in range(0, len(frames), batchSize))
+        else:
+            frames = batches(frames, batchSize)
+
+        probabilities = []
+        for batch in frames:
+            probabilities.append(self.predict_crops(preprocess_frames(np.asarray(batch))))
+
+        if not probabilities:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(probabilities)
+
+    # Scans <videoPath> for pellet presence, every <frameInterval>th frame. Returns the frame indexes scanned and
+    # their pellet probabilities.
+    def predict_video(self, videoPath, batchSize=256, frameInterval=1):
+
+        import cv2
+        video = cv2.VideoCapture(videoPath)
+        frameIndexes = []
+
+        def frames():
+            index = 0
+            while True:
+                if index % frameInterval == 0:
+                    ret, frame = video.read()
+                    if not ret:
+                        return
+                    frameIndexes.append(index)
+                    yield frame
+                elif not video.grab():
+                    return
+                index += 1
+
+        try:
+            probabilities = self.predict_batch(frames(), batchSize)
+        finally:
+            video.release()
+        return np.asarray(frameIndexes), probabilities
+
+
+# Pads a (N, H, W, C) batch the way Keras/TensorFlow padding='same' does for a <kernel>x<kernel> window with
+# <stride>: the output is ceil(size / stride) and any odd padding goes on the bottom/right.
+def same_padding(x, kernel, stride):
+
+    padding = [(0, 0)]
+    for size in x.shape[1:3]:
+        out = -(-size // stride)
+        total = max((out - 1) * stride + kernel - size, 0)
+        padding.append((total // 2, total - total // 2))
+    padding.append((0, 0))
+    return np.pad(x, padding, mode="constant")
+
+
+# 2D convolution of a (N, H, W, C) batch with a Keras (kh, kw, C, F) kernel, padding='same'. The input windows are
+# a strided view of the padded batch (no im2col copy) contracted with the kernel in one tensordot.
+def conv2d_same(x, kernel, bias, stride):
+
+    kh, kw = kernel.shape[:2]
+    x = np.ascontiguousarray(same_padding(x, kh, stride))
+    n, h, w, c = x.shape
+    outH = (h - kh) // stride + 1
+    outW = (w - kw) // stride + 1
+    sn, sh, sw, sc = x.strides
+    windows = np.lib.stride_tricks.as_strided(x, (n, outH, outW, kh, kw, c),
+                                              (sn, sh * stride, sw * stride, sh, sw, sc))
+    return np.tensordot(windows, kernel, axes=([3, 4, 5], [0, 1, 2])) + bias
+
+
+def max_pool_2x2(x):
+
+    n, h, w, c = x.shape
+    x = x[:, :h - h % 2, :w - w % 2]
+    return x.reshape((n, h // 2, 2, w // 2, 2, c)).max(axis=(2, 4))
+
+
+def sigmoid(x):
+
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class PelletPredictor(CropClassifier):
+    """
+        Runs the pellet classifier from an .npz made by export_weights(), with NumPy only. Drop-in for
+        pelletClassifier.CNN wherever only inference is needed.
+
+        Attributes:
+            modelPath: The .npz the weights were loaded from.
+            inputShape: Shape of one preprocessed crop, (80, 80, 1).
+    """
+
+    def __init__(self, modelPath):
+
+        self.modelPath = modelPath
+        self.inputShape = INPUT_SHAPE
+        with np.load(modelPath) as weights:
+            if int(weights["version"]) != EXPORT_VERSION:
+                raise ValueError(modelPath + " was exported by a different version of pelletInference.py")
+            self.weights = dict((name, weights[name].astype(np.float32)) for name in weights.files
+                                if name != "version")
+
+    def predict_crops(self, crops):
+
+        w = self.weights
+        x = np.asarray(crops, dtype=np.float32).reshape((-1,) + self.inputShape)
+        for i, stride in enumerate(CONV_STRIDES):
+            x = np.maximum(conv2d_same(x, w["conv%d_kernel" % i], w["conv%d_bias" % i], stride), 0)
+            x = x * w["bn%d_scale" % i] + w["bn%d_shift" % i]
+        x = max_pool_2x2(x)
+        x = x.reshape((len(x), -1))
+        return sigmoid(x.dot(w["dense_kernel"]) + w["dense_bias"]).reshape(-1)
+
+
+# Returns the weights of each layer in a Keras .h5 (a full model save or save_weights()), in layer order, as a list
+# of (class name, [arrays]) plus the BatchNormalization epsilons if the model config is recorded.
+def read_keras_h5(h5Path):
+
+    import h5py
+
+    def text(value):
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    layers = []
+    epsilons = []
+    with h5py.File(h5Path, "r") as f:
+        if "model_config" in f.attrs:
+            config = json.loads(text(f.attrs["model_config"]))["config"]
+            if isinstance(config, dict):
+                config = config["layers"]
+            epsilons = [layer["config"].get("epsilon", DEFAULT_BN_EPSILON) for layer in config
+                        if layer["class_name"] == "BatchNormalization"]
+
+        group = f["model_weights"] if "model_weights" in f else f
+        for layerName in group.attrs["layer_names"]:
+            layerGroup = group[text(layerName)]
+            weightNames = [text(name) for name in layerGroup.attrs["weight_names"]]
+            if weightNames:
+                layers.append((text(layerName), [np.asarray(layerGroup[name]) for name in weightNames]))
+    return layers, epsilons
+
+
+# gamma, beta, moving mean and variance -> per channel scale and shift.
+def fold_batch_norm(gamma, beta, mean, variance, epsilon):
+
+    scale = gamma / np.sqrt(variance + epsilon)
+    return scale, beta - mean * scale
+
+
+# Converts the Keras weights at <h5Path> (the architecture in pelletClassifier.CNN.getModel()) to an .npz at
+# <npzPath> that PelletPredictor can load.
+def export_weights(h5Path, npzPath):
+
+    layers, epsilons = read_keras_h5(h5Path)
+    convs = [weights for name, weights in layers if len(weights) == 2 and weights[0].ndim == 4]
+    norms = [weights for name, weights in layers if len(weights) == 4]
+    dense = [weights for name, weights in layers if len(weights) == 2 and weights[0].ndim == 2]
+    if len(convs) != len(CONV_STRIDES) or len(norms) != len(CONV_STRIDES) + 1 or len(dense) != 1:
+        raise ValueError(h5Path + " doesn't have the layers of pelletClassifier.CNN: " +
+                         ", ".join(name for name, weights in layers))
+    if len(epsilons) != len(norms):
+        epsilons = [DEFAULT_BN_EPSILON] * len(norms)
+
+    exported = {"version": np.array(EXPORT_VERSION)}
+    for i, (kernel, bias) in enumerate(convs):
+        exported["conv%d_kernel" % i] = kernel.astype(np.float32)
+        exported["conv%d_bias" % i] = bias.astype(np.float32)
+        scale, shift = fold_batch_norm(*(list(norms[i]) + [epsilons[i]]))
+        exported["bn%d_scale" % i] = scale.astype(np.float32)
+        exported["bn%d_shift" % i] = shift.astype(np.float32)
+
+    # The last BatchNormalization is applied to the flattened (h, w, c) pooled output, so its per channel scale
+    # repeats every c inputs of the dense layer.
+    kernel, bias = dense[0]
+    scale, shift = fold_batch_norm(*(list(norms[-1]) + [epsilons[-1]]))
+    repeats = kernel.shape[0] // len(scale)
+    exported["dense_kernel"] = (kernel * np.tile(scale, repeats)[:, np.newaxis]).astype(np.float32)
+    exported["dense_bias"] = (bias + np.tile(shift, repeats).dot(kernel)).astype(np.float32)
+
+    np.savez(npzPath, **exported)
+    return npzPath
+
+
+# Returns the exported .npz next to <modelPath> if <modelPath> is a Keras .h5 and the .npz is at least as new,
+# otherwise <modelPath>.
+def fast_model_path(modelPath):
+
+    if modelPath.endswith(".npz"):
+        return modelPath
+    npzPath = os.path.splitext(modelPath)[0] + ".npz"
+    if os.path.isfile(npzPath) and (not os.path.isfile(modelPath) or
+                                    os.path.getmtime(npzPath) >= os.path.getmtime(modelPath)):
+        return npzPath
+    return modelPath
+
+
+# Loads the classifier at <modelPath>: a PelletPredictor for an exported .npz (see fast_model_path()), otherwise
+# the Keras CNN.
+def load_classifier(modelPath):
+
+    modelPath = fast_model_path(modelPath)
+    if modelPath.endswith(".npz"):
+        return PelletPredictor(modelPath)
+
+    import pelletClassifier
+    return pelletClassifier.CNN(modelPath)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Export the pellet classifier for Keras-free inference.")
+    subparsers = parser.add_subparsers(dest="command")
+    export = subparsers.add_parser("export", help="Convert a Keras .h5 to an .npz for PelletPredictor.")
+    export.add_argument("h5", help="Keras weights, e.g ../analysis/pelletModel/model.h5")
+    export.add_argument("npz", nargs="?", help="Output path. Defaults to the .h5 path with .npz instead.")
+    args = parser.parse_args()
+
+    if args.command != "export":
+        parser.print_help()
+        return 1
+
+    npzPath = export_weights(args.h5, args.npz or os.path.splitext(args.h5)[0] + ".npz")
+    print("Exported " + args.h5 + " to " + npzPath)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
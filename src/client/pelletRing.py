@@ -0,0 +1,189 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+
+
+"""
+    Shared memory ring buffer the recorder writes pellet ROI crops into (see SessionVideo.cpp, write_roi()). It's a
+    plain file, ideally on /dev/shm, laid out as:
+
+        header:     magic "PROI", version, slot count, crop width, crop height, reserved    (6 x uint32)
+                    number of crops written so far                                          (uint64)
+                    number of frames written to the current video                           (uint64)
+        slot i:     seq, frame index, CLOCK_MONOTONIC timestamp in ns                       (3 x uint64)
+                    width x height 8 bit gray pixels
+
+    Crop n goes in slot n % slot count. The writer sets the slot's seq to 2n + 1 before writing it and 2n + 2 after,
+    so a reader that sees the same even seq before and after copying a slot knows the copy is consistent (a seqlock).
+    The writer never waits on readers: if the classifier falls behind, old crops are simply overwritten.
+
+    The frame count is set to 0 before the recorder confirms a recording has started and updated after every frame
+    it writes, so at any moment it's the index of the frame being recorded. The session event log reads it from here
+    (RecorderProcess.frame_index()).
+
+    The crops are what the classifier expects: the frame resized to 224x224, then rows 116-196, cols 56-136.
+"""
+
+
+RING_MAGIC = 0x494f5250     # "PROI"
+RING_VERSION = 2
+HEADER = struct.Struct("<6IQQ")
+SLOT_HEADER = struct.Struct("<3Q")
+WRITE_COUNT_OFFSET = 24
+FRAME_COUNT_OFFSET = 32
+
+# One crop read from the ring. <count> is its position in the stream of crops (1 for the first).
+ROISample = namedtuple("ROISample", ["count", "frameIndex", "timestamp", "crop"])
+
+
+def slot_size(width, height):
+
+    return SLOT_HEADER.size + width * height
+
+
+def ring_size(slotCount, width, height):
+
+    return HEADER.size + slotCount * slot_size(width, height)
+
+
+# Crops a frame the same way the recorder does. Needs cv2, only used by the mock recorder.
+def roi_crop(frame):
+
+    import cv2
+    return cv2.resize(frame, (224, 224))[116:196, 56:136]
+
+
+class ROIRingWriter(object):
+    """
+        Python implementation of the recorder's side of the ring, used by mockSessionVideo.py.
+    """
+
+    def __init__(self, path, slotCount=8, width=80, height=80):
+
+        self.slotCount = slotCount
+        self.width = width
+        self.height = height
+        self.slotSize = slot_size(width, height)
+        size = ring_size(slotCount, width, height)
+
+        # Reuse the file if it exists so readers that already mapped it keep working.
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.buffer = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        self.buffer[:size] = b"\0" * size
+        HEADER.pack_into(self.buffer, 0, RING_MAGIC, RING_VERSION, slotCount, width, height, 0, 0, 0)
+        self.count = 0
+
+    def write(self, crop, frameIndex):
+
+        offset = HEADER.size + (self.count % self.slotCount) * self.slotSize
+        seq = 2 * self.count
+        SLOT_HEADER.pack_into(self.buffer, offset, seq + 1, frameIndex, int(time.monotonic() * 1e9))
+        self.buffer[offset + SLOT_HEADER.size:offset + self.slotSize] = crop.astype("uint8").tobytes()
+        struct.pack_into("<Q", self.buffer, offset, seq + 2)
+        self.count += 1
+        struct.pack_into("<Q", self.buffer, WRITE_COUNT_OFFSET, self.count)
+
+    def set_frame_count(self, frameCount):
+
+        struct.pack_into("<Q", self.buffer, FRAME_COUNT_OFFSET, frameCount)
+
+    def close(self):
+
+        self.buffer.close()
+
+
+class ROIRingReader(object):
+    """
+        Reads crops out of the ring. open() can be retried until the recorder has created the file.
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.buffer = None
+        self.lastCount = 0
+
+    def open(self):
+
+        if self.buffer is not None:
+            return True
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) < HEADER.size:
+            return False
+
+        with open(self.path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, slotCount, width, height, _, _, _ = HEADER.unpack_from(buffer, 0)
+        if magic != RING_MAGIC or version != RING_VERSION or len(buffer) < ring_size(slotCount, width, height):
+            buffer.close()
+            return False
+
+        self.buffer = buffer
+        self.slotCount = slotCount
+        self.width = width
+        self.height = height
+        self.slotSize = slot_size(width, height)
+        return True
+
+    def write_count(self):
+
+        return struct.unpack_from("<Q", self.buffer, WRITE_COUNT_OFFSET)[0]
+
+    def frame_count(self):
+
+        return struct.unpack_from("<Q", self.buffer, FRAME_COUNT_OFFSET)[0]
+
+    # Returns the crops written since the last call (at most one ring's worth, oldest first) as ROISamples with
+    # <crop> as a (height, width) uint8 numpy array.
+    def read_new(self):
+
+        if not self.open():
+            return []
+
+        count = self.write_count()
+        if count < self.lastCount:
+            # The recorder restarted and reset the ring.
+            self.lastCount = 0
+
+        samples = []
+        for n in range(max(self.lastCount, count - self.slotCount), count):
+            sample = self._read_slot(n)
+            if sample is not None:
+                samples.append(sample)
+        self.lastCount = count
+        return samples
+
+    def _read_slot(self, n):
+
+        offset = HEADER.size + (n % self.slotCount) * self.slotSize
+        for attempt in range(3):
+            seq, frameIndex, timestamp = SLOT_HEADER.unpack_from(self.buffer, offset)
+            pixels = self.buffer[offset + SLOT_HEADER.size:offset + self.slotSize]
+            if seq == 2 * n + 2 and struct.unpack_from("<Q", self.buffer, offset)[0] == seq:
+                crop = np.frombuffer(pixels, dtype=np.uint8).reshape((self.height, self.width))
+                return ROISample(n + 1, frameIndex, timestamp / 1e9, crop)
+            if seq > 2 * n + 2:
+                # Already overwritten by a newer crop.
+                return None
+        return None
+
+    def close(self):
+
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
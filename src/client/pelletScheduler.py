@@ -0,0 +1,179 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+from collections import namedtuple
+
+
+"""
+    Decides when the SessionController asks the Arduino for the next pellet. Each presentation goes through
+
+        WAITING     until the next presentation is due, then the controller requests one (armed())
+        PRESENTING  until the Arduino reports it DONE, NAK or it times out
+        PRESENTED   until the pellet classifier (PelletService) says what happened to the pellet
+
+    and ends with one of these outcomes:
+
+        TAKEN       The pellet was seen on the platform and then disappeared. Counts as a trial. The next pellet
+                    comes minInterval seconds after this one was presented (or straight away if that's passed).
+        UNTOUCHED   The pellet was seen but still hadn't been touched after untouchedTimeout seconds. Counts as a
+                    trial, and a fresh pellet is presented straight away.
+        EMPTY       The arm came up but the classifier never saw a pellet within confirmTimeout seconds. Not a trial.
+                    Retried after retryDelay seconds, or after minInterval once maxEmptyRetries retries in a row have
+                    come up empty (the dispenser is probably empty, no point cycling the arm).
+        FAILED      The Arduino NAKed the request or never reported it done. Not a trial, retried like EMPTY.
+        UNVERIFIED  The classifier can't tell (no model, recorder not writing crops). Counts as a trial and the
+                    next pellet comes after minInterval, which is how every pellet was handled before the classifier.
+
+    The scheduler doesn't talk to the Arduino or the clock itself, the controller passes in time.monotonic() and the
+    Arduino status, which keeps it easy to follow in the event log.
+"""
+
+
+WAITING = "WAITING"
+PRESENTING = "PRESENTING"
+PRESENTED = "PRESENTED"
+
+TAKEN = "TAKEN"
+UNTOUCHED = "UNTOUCHED"
+EMPTY = "EMPTY"
+FAILED = "FAILED"
+UNVERIFIED = "UNVERIFIED"
+
+# Seconds, apart from maxEmptyRetries. untouchedTimeout may be None to leave an untouched pellet up for good.
+PelletPolicy = namedtuple("PelletPolicy", ["minInterval", "retryDelay", "maxEmptyRetries", "confirmTimeout",
+                                           "untouchedTimeout", "presentationTimeout"])
+
+DEFAULT_POLICY = PelletPolicy(minInterval=7.0, retryDelay=2.0, maxEmptyRetries=3, confirmTimeout=4.0,
+                              untouchedTimeout=60.0, presentationTimeout=10.0)
+
+# config.txt key for each policy field.
+POLICY_CONFIG_KEYS = {
+    "minInterval": "PELLET_MIN_INTERVAL",
+    "retryDelay": "PELLET_RETRY_DELAY",
+    "maxEmptyRetries": "PELLET_MAX_EMPTY_RETRIES",
+    "confirmTimeout": "PELLET_CONFIRM_TIMEOUT",
+    "untouchedTimeout": "PELLET_UNTOUCHED_TIMEOUT",
+    "presentationTimeout": "PELLET_TIMEOUT",
+}
+
+
+# Builds a PelletPolicy from the optional KEY=VALUE settings in config.txt. Missing keys keep their defaults, an
+# empty PELLET_UNTOUCHED_TIMEOUT turns the untouched timeout off.
+def load_policy(optionalConfig, default=DEFAULT_POLICY):
+
+    values = default._asdict()
+    for field, key in POLICY_CONFIG_KEYS.items():
+        if key not in optionalConfig:
+            continue
+        value = optionalConfig[key].strip()
+        if field == "untouchedTimeout" and value == "":
+            values[field] = None
+        elif field == "maxEmptyRetries":
+            values[field] = int(value)
+        else:
+            values[field] = float(value)
+    return PelletPolicy(**values)
+
+
+class PelletScheduler(object):
+    """
+        The state of one session's pellet presentations. See the comment at the top of this file.
+
+        Attributes:
+            policy: The PelletPolicy in use.
+            pellet_service: A PelletService, or None to handle every presentation as UNVERIFIED.
+            state: WAITING, PRESENTING or PRESENTED.
+            seq: Sequence number of the presentation request in flight, if any.
+            presentations: Number of presentations requested this session.
+            trials: Number of presentations that counted as trials.
+            emptyStreak: Presentations in a row that came up EMPTY or FAILED.
+            outcomes: Dict counting each outcome.
+    """
+
+    def __init__(self, policy, pellet_service=None, now=0.0):
+
+        self.policy = policy
+        self.pellet_service = pellet_service
+        self.state = WAITING
+        self.nextPresentationTime = now
+        self.seq = None
+        self.requestTime = None
+        self.doneTime = None
+        self.seenPresent = False
+        self.presentations = 0
+        self.trials = 0
+        self.emptyStreak = 0
+        self.outcomes = dict((outcome, 0) for outcome in (TAKEN, UNTOUCHED, EMPTY, FAILED, UNVERIFIED))
+
+    # True when the controller should request a pellet.
+    def due(self, now):
+
+        return self.state == WAITING and now >= self.nextPresentationTime
+
+    # Tells the scheduler a pellet was requested with sequence number <seq>.
+    def armed(self, seq, now):
+
+        self.state = PRESENTING
+        self.seq = seq
+        self.requestTime = now
+        self.seenPresent = False
+        self.presentations += 1
+
+    # Advances the state machine. <arduinoStatus> is the Arduino's status for the request in flight (None while it's
+    # still pending). Returns the outcome if the current presentation just finished, otherwise None.
+    def update(self, now, arduinoStatus=None):
+
+        if self.state == PRESENTING:
+            if arduinoStatus == "DONE":
+                self.state = PRESENTED
+                self.doneTime = now
+                self.seq = None
+            elif arduinoStatus is not None or self.seq is None or \
+                    now - self.requestTime > self.policy.presentationTimeout:
+                return self._finish(FAILED, now)
+            return None
+
+        if self.state != PRESENTED:
+            return None
+
+        present = self.pellet_service.pellet_present() if self.pellet_service is not None else None
+        elapsed = now - self.doneTime
+
+        if present and not self.seenPresent:
+            self.seenPresent = True
+            self.trials += 1
+            self.emptyStreak = 0
+
+        if present is False and self.seenPresent:
+            return self._finish(TAKEN, now)
+        if present is False and elapsed >= self.policy.confirmTimeout:
+            return self._finish(EMPTY, now)
+        if present and self.policy.untouchedTimeout is not None and elapsed >= self.policy.untouchedTimeout:
+            return self._finish(UNTOUCHED, now)
+        if present is None and elapsed >= self.policy.minInterval:
+            if not self.seenPresent:
+                self.trials += 1
+            return self._finish(UNVERIFIED, now)
+        return None
+
+    def _finish(self, outcome, now):
+
+        self.outcomes[outcome] += 1
+        self.state = WAITING
+        self.seq = None
+
+        if outcome in (EMPTY, FAILED):
+            self.emptyStreak += 1
+            if self.emptyStreak > self.policy.maxEmptyRetries:
+                self.nextPresentationTime = now + self.policy.minInterval
+            else:
+                self.nextPresentationTime = now + self.policy.retryDelay
+        elif outcome == TAKEN:
+            self.nextPresentationTime = max(now, self.doneTime + self.policy.minInterval)
+        else:
+            self.nextPresentationTime = now
+        return outcome
@@ -0,0 +1,136 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import os
+import threading
+import time
+
+import pelletInference
+import pelletRing
+
+
+class PelletService(threading.Thread):
+    """
+        Watches the pellet for the SessionController. The recorder writes an ROI crop of every
+        pelletClassifierFrameInterval-th frame into a shared memory ring (see pelletRing.py); this thread loads the
+        pellet classifier once (the exported NumPy version if there is one, see pelletInference.py), runs it on every
+        new crop (in one batch if several arrived since the last look) and keeps the current pellet-present/absent
+        state.
+
+        The state only flips after <confirmations> crops in a row agree, so a paw passing over the pellet doesn't
+        make it "disappear". If no crop has arrived for <maxAge> seconds (recorder stopped, between sessions) the
+        state is unknown.
+
+        Attributes:
+            present: True/False once a state has been confirmed, None before that.
+            probability: Pellet probability of the latest crop.
+            frameIndex: Video frame the latest crop came from.
+            updated: time.monotonic() of the latest crop.
+            stats: Number of crops classified, inference batches and ring read errors.
+    """
+
+    def __init__(self, ringPath, modelPath, threshold=0.5, confirmations=2, maxAge=3.0, pollInterval=0.05):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.reader = pelletRing.ROIRingReader(ringPath)
+        self.modelPath = modelPath
+        self.threshold = threshold
+        self.confirmations = confirmations
+        self.maxAge = maxAge
+        self.pollInterval = pollInterval
+        self.stopEvent = threading.Event()
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+
+        self.classifier = None
+        self.present = None
+        self.probability = None
+        self.frameIndex = None
+        self.updated = None
+        self.pendingState = None
+        self.pendingCount = 0
+        self.stats = {"crops": 0, "batches": 0, "errors": 0}
+
+    def run(self):
+
+        # An exported .npz (see pelletInference.py) loads in milliseconds with NumPy alone. Otherwise Keras is imported
+        # here, so main.py starts (and works without the classifier) if it isn't installed.
+        try:
+            self.classifier = pelletInference.load_classifier(self.modelPath)
+        except Exception as e:
+            print("Pellet classifier unavailable, presenting pellets on the timer only: " + str(e))
+            return
+        self.ready.set()
+
+        while not self.stopEvent.is_set():
+            try:
+                samples = self.reader.read_new()
+            except (OSError, ValueError):
+                self.stats["errors"] += 1
+                self.reader.close()
+                samples = []
+
+            if samples:
+                probabilities = self.classifier.predict_crops([sample.crop for sample in samples])
+                self.stats["batches"] += 1
+                for sample, probability in zip(samples, probabilities):
+                    self.update(float(probability), sample.frameIndex)
+            else:
+                self.stopEvent.wait(self.pollInterval)
+
+        self.reader.close()
+
+    def update(self, probability, frameIndex):
+
+        with self.lock:
+            self.stats["crops"] += 1
+            self.probability = probability
+            self.frameIndex = frameIndex
+            self.updated = time.monotonic()
+
+            state = probability >= self.threshold
+            if state == self.pendingState:
+                self.pendingCount += 1
+            else:
+                self.pendingState = state
+                self.pendingCount = 1
+            if self.pendingCount >= self.confirmations:
+                self.present = state
+
+    # Returns True if the pellet is there, False if it isn't, or None if that isn't currently known.
+    def pellet_present(self):
+
+        with self.lock:
+            if self.updated is None or time.monotonic() - self.updated > self.maxAge:
+                return None
+            return self.present
+
+    # Forgets the current state, e.g at the start of a session so the last session's pellet doesn't count.
+    def reset(self):
+
+        with self.lock:
+            self.present = None
+            self.pendingState = None
+            self.pendingCount = 0
+            self.updated = None
+
+    def stop(self):
+
+        self.stopEvent.set()
+
+
+# Starts a PelletService if the classifier model exists, either as <modelPath> or as the exported .npz next to it.
+# Returns it, or None if there isn't one.
+def start_pellet_service(ringPath, modelPath):
+
+    if not ringPath or not os.path.isfile(pelletInference.fast_model_path(modelPath)):
+        return None
+
+    service = PelletService(ringPath, modelPath)
+    service.start()
+    return service
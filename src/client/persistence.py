@@ -0,0 +1,58 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import os
+import tempfile
+
+
+# Replaces the contents of <path> with <text> in one step. The text is written to a temp file in the same directory
+# and then renamed over <path>, so anyone reading <path> (or a crash part way through) sees either the old file
+# or the new one, never a half-written one. The fsync is only worth paying for when the write has to survive a
+# power cut, e.g at the end of a session.
+def atomic_write(path, text, fsync=False):
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tempPath = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        # Opened before anything else can fail, so the descriptor is always closed.
+        with os.fdopen(fd, 'w') as temp:
+            # mkstemp creates the file readable by the owner only, keep the permissions the file already had.
+            os.chmod(tempPath, os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644)
+            temp.write(text)
+            if fsync:
+                temp.flush()
+                os.fsync(temp.fileno())
+        os.replace(tempPath, path)
+    except BaseException:
+        os.remove(tempPath)
+        raise
+
+    if fsync:
+        fsync_directory(directory)
+
+
+# Appends <line> to <path> with a single write() on an O_APPEND descriptor, so concurrent readers never see
+# part of a line from this call.
+def append_line(path, line, fsync=False):
+
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode())
+        if fsync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Makes a rename inside <directory> durable.
+def fsync_directory(directory):
+
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,193 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import queue
+import sys
+import threading
+import time
+from subprocess import PIPE, Popen
+
+import pelletRing
+
+
+class RecorderProcess(object):
+    """
+        A handle to a SessionVideo process running in standby mode. The process is spawned once (ideally at system start),
+        initializes the camera and then sits idle until it is told to start recording. This moves the Spinnaker system
+        initialization, camera enumeration and configuration out of the time between an RFID read and the first recorded
+        frame. Each session just sends a START command with the video path and waits for the recorder to confirm that
+        acquisition has begun.
+
+        The process talks back over stdout. Lines prefixed with "RECORDER:" are protocol messages and are put on
+        <messages>, everything else is echoed to the terminal like it was before.
+
+        If <pelletRoiPath> is set the recorder also writes a crop of the pellet area of every
+        pelletClassifierFrameInterval-th frame into a shared memory ring at that path, for the PelletService, along
+        with the number of frames it has written to the current video (see frame_index()).
+
+        Attributes:
+            argv: The command used to spawn the recorder (camera settings come from config.txt).
+            process: The Popen handle for the recorder, or None if it hasn't been spawned.
+            messages: Queue of protocol messages received from the recorder.
+            recordingStartTime: time.time() at which the recorder confirmed the current recording started.
+            recordingStartMonotonic: Same moment as <recordingStartTime>, from time.monotonic().
+            recordingFps: FPS of the current recording.
+            frameCounter: ROIRingReader used to read the recorder's frame count, or None without a ring.
+    """
+
+    def __init__(self, recorderPath, width, height, offsetX, offsetY, fps, exposure, bitrate, displayPreview,
+                 pelletRoiPath=None):
+
+        self.argv = [recorderPath, "--standby"] + [str(arg).strip() for arg in
+                                                   (width, height, offsetX, offsetY, fps, exposure, bitrate,
+                                                    displayPreview)]
+        if pelletRoiPath:
+            self.argv.append(pelletRoiPath)
+        self.process = None
+        self.messages = queue.Queue()
+        self.recordingStartTime = None
+        self.recordingStartMonotonic = None
+        self.recordingFps = None
+        self.frameCounter = pelletRing.ROIRingReader(pelletRoiPath) if pelletRoiPath else None
+
+    # Starts the recorder process and the thread that reads its output. Returns True once the recorder
+    # reports that the camera is initialized, or False if it didn't within <timeout> seconds (or couldn't be started
+    # at all, e.g a wrong RECORDER_PATH).
+    def spawn(self, timeout=30):
+
+        # A fresh queue, so the EXITED (or FAILED) of a recorder that died isn't taken for this one's answer. The old
+        # reader thread keeps its own queue.
+        self.messages = queue.Queue()
+        try:
+            self.process = Popen(self.argv, stdin=PIPE, stdout=PIPE, universal_newlines=True, bufsize=1)
+        except OSError as e:
+            print("Unable to start the recorder " + self.argv[0] + ": " + str(e))
+            self.process = None
+            return False
+        reader = threading.Thread(target=self._read_output, args=(self.process, self.messages))
+        reader.daemon = True
+        reader.start()
+        return self._wait_for("READY", timeout) == "READY"
+
+    def is_alive(self):
+
+        return self.process is not None and self.process.poll() is None
+
+    # Makes sure there is a standby recorder to talk to. If the previous one died (e.g the camera was unplugged)
+    # a new one is spawned.
+    def ensure_ready(self, timeout=30):
+
+        if self.is_alive():
+            return True
+
+        print("Recorder is not running, spawning a new one...")
+        return self.spawn(timeout)
+
+    # Tells the recorder to start writing to <vidPath> and blocks until it confirms acquisition has started.
+    # Returns True if recording started.
+    def start_recording(self, vidPath, fps, displayPreview, timeout=10):
+
+        if not self.ensure_ready():
+            return False
+
+        # Drop anything left over from the last session (e.g a FAILED after a STOPPED).
+        self._clear_messages()
+        if not self._send("START " + str(fps).strip() + " " + str(displayPreview).strip() + " " + vidPath):
+            return False
+
+        if self._wait_for("RECORDING", timeout) != "RECORDING":
+            return False
+
+        self.recordingStartMonotonic = time.monotonic()
+        self.recordingStartTime = time.time()
+        self.recordingFps = float(str(fps).strip())
+        return True
+
+    # Tells the recorder to finish the current video and go back to standby. Returns the number of frames
+    # recorded, or -1 if the recorder never confirmed.
+    def stop_recording(self, timeout=30):
+
+        if not self.is_alive():
+            return -1
+
+        sent = self._send("STOP")
+        msg = self._wait_for("STOPPED", timeout) if sent else None
+        self.recordingStartTime = None
+        self.recordingStartMonotonic = None
+        if msg is None or not msg.startswith("STOPPED"):
+            return -1
+
+        return int(msg.split()[1])
+
+    # Index of the frame the recorder is writing to the current video right now, as counted by the recorder itself.
+    # None when not recording, or when there's no ring to read the count from (PELLET_ROI_PATH not set, or a
+    # recorder built before the ring had a frame count).
+    def frame_index(self):
+
+        if self.recordingStartMonotonic is None or self.frameCounter is None or not self.frameCounter.open():
+            return None
+        return self.frameCounter.frame_count()
+
+    def shutdown(self, timeout=10):
+
+        if not self.is_alive():
+            return
+
+        if not self._send("QUIT"):
+            self.process.kill()
+            return
+        try:
+            self.process.wait(timeout)
+        except Exception:
+            self.process.kill()
+
+    # Returns False if the recorder's stdin is closed (it died between is_alive() and now).
+    def _send(self, cmd):
+
+        try:
+            self.process.stdin.write(cmd + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            print("Recorder is not accepting commands (" + cmd + ")")
+            return False
+        return True
+
+    def _read_output(self, process, messages):
+
+        for line in process.stdout:
+            if line.startswith("RECORDER:"):
+                messages.put(line[len("RECORDER:"):].strip())
+            else:
+                sys.stdout.write(line)
+
+        # The recorder exited. Wake up anyone waiting on it.
+        messages.put("EXITED")
+
+    def _clear_messages(self):
+
+        while True:
+            try:
+                self.messages.get_nowait()
+            except queue.Empty:
+                return
+
+    # Blocks until a message starting with <token> arrives. FAILED and EXITED also end the wait
+    # since the expected message will never come after those. Returns the message, or None on timeout.
+    def _wait_for(self, token, timeout):
+
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            try:
+                msg = self.messages.get(timeout=remaining)
+            except queue.Empty:
+                return None
+
+            if msg.startswith(token) or msg in ("FAILED", "EXITED"):
+                return msg
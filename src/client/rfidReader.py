@@ -0,0 +1,144 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import queue
+import threading
+import time
+from collections import namedtuple
+
+
+STX = b"\x02"
+ETX = b"\x03"
+
+# One animal arriving at the reader. <tag> is the 10 data + 2 checksum characters (what profiles store as their ID),
+# <time> is time.monotonic() of the first read.
+RFIDArrival = namedtuple("RFIDArrival", ["tag", "time"])
+
+
+# Returns True if <tag> is 10 hex data characters followed by the 2 hex character XOR of the 5 data bytes.
+def valid_checksum(tag):
+
+    if len(tag) != 12:
+        return False
+    try:
+        values = [int(tag[i:i + 2], 16) for i in range(0, 12, 2)]
+    except ValueError:
+        return False
+
+    checksum = 0
+    for value in values[:5]:
+        checksum ^= value
+    return checksum == values[5]
+
+
+class RFIDReader(threading.Thread):
+    """
+        Reads the RFID reader's serial port on its own thread and turns the raw stream of tag frames into one
+        arrival per visit. The reader reports a tag over and over while it's in range (and in bursts while the
+        animal wiggles around), so:
+
+            1. Frames are parsed out of the byte stream (STX ... ETX) and anything with a bad checksum is dropped.
+            2. A tag only produces an arrival if it hasn't been read in the last <dedupWindow> seconds. Every read
+               restarts the window, so an animal sitting under the reader never produces a second arrival.
+            3. Arrivals go on a bounded queue. If the controller falls behind the oldest arrival is dropped.
+
+        Attributes:
+            serialInterface: The serial.Serial connection to the reader.
+            arrivals: Queue of RFIDArrivals for the controller.
+            lastSeen: Dict mapping tag -> time.monotonic() of its latest read.
+            stats: Counts of frames read, invalid frames, duplicates suppressed, arrivals and dropped arrivals.
+    """
+
+    def __init__(self, serialInterface, dedupWindow=10.0, maxQueued=8):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.serialInterface = serialInterface
+        self.dedupWindow = dedupWindow
+        self.arrivals = queue.Queue(maxQueued)
+        self.lastSeen = {}
+        self.lock = threading.Lock()
+        self.buffer = b""
+        self.stats = {"frames": 0, "invalid": 0, "duplicates": 0, "arrivals": 0, "dropped": 0}
+
+    def run(self):
+
+        while self.serialInterface.is_open:
+            data = self.serialInterface.read(max(1, self.serialInterface.in_waiting))
+            now = time.monotonic()
+            for tag in self.parse_frames(data):
+                self.handle_read(tag, now)
+
+    # Adds <data> to the frame buffer and returns the tags of any complete frames.
+    def parse_frames(self, data):
+
+        self.buffer += data
+        tags = []
+        while ETX in self.buffer:
+            frame, self.buffer = self.buffer.split(ETX, 1)
+            start = frame.rfind(STX)
+            if start < 0:
+                continue
+            tags.append(frame[start + 1:].strip().decode(errors="replace"))
+
+        # Don't let garbage without an ETX grow the buffer forever.
+        if len(self.buffer) > 64:
+            self.buffer = self.buffer[self.buffer.rfind(STX):] if STX in self.buffer else b""
+        return tags
+
+    def handle_read(self, tag, now):
+
+        self.stats["frames"] += 1
+        tag = tag[:12]
+        if not valid_checksum(tag):
+            self.stats["invalid"] += 1
+            return
+
+        with self.lock:
+            previous = self.lastSeen.get(tag)
+            self.lastSeen[tag] = now
+            if previous is not None and now - previous < self.dedupWindow:
+                self.stats["duplicates"] += 1
+                return
+            # Forget tags that are long gone so the cache stays small.
+            if len(self.lastSeen) > 64:
+                self.lastSeen = dict((t, seen) for t, seen in self.lastSeen.items() if now - seen < self.dedupWindow)
+
+        self.stats["arrivals"] += 1
+        arrival = RFIDArrival(tag, now)
+        while True:
+            try:
+                self.arrivals.put_nowait(arrival)
+                return
+            except queue.Full:
+                try:
+                    self.arrivals.get_nowait()
+                    self.stats["dropped"] += 1
+                except queue.Empty:
+                    pass
+
+    # Blocks until the next arrival.
+    def get(self, timeout=None):
+
+        return self.arrivals.get(timeout=timeout)
+
+    # Drops every queued arrival. Called after a session, since anything that arrived while it was running is stale.
+    # Every tag apart from <keepTag> (the animal that just had the session) is forgotten too: another animal waiting
+    # at the entrance kept refreshing its window while the session ran, and would otherwise get no arrival until it
+    # had been out of range for <dedupWindow> seconds. Its next read is a new arrival, like it was when the serial
+    # buffer was reset here.
+    def clear_pending(self, keepTag=None):
+
+        while True:
+            try:
+                self.arrivals.get_nowait()
+                self.stats["dropped"] += 1
+            except queue.Empty:
+                break
+
+        with self.lock:
+            self.lastSeen = dict((tag, seen) for tag, seen in self.lastSeen.items() if tag == keepTag)
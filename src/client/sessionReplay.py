@@ -0,0 +1,341 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import argparse
+import bisect
+import json
+import os
+import random
+import select
+import sys
+import time
+import tty
+from collections import namedtuple
+
+import arduinoSimulator
+
+
+"""
+    Replay harness for the whole client. It plays the part of the world around main.py: the RFID reader (on a pty),
+    the Arduino (arduinoSimulator.py, on another pty) and the animals. Each simulated visit breaks the IR beam, sends
+    a stream of tag reads with the duplicate bursts a real reader produces while the animal wiggles around, and then
+    leaves. The harness measures how long it takes main.py to start a session after the first read of each visit,
+    and how many sessions (ideally exactly one) each visit produced.
+
+    Usage:
+        1. Set ARDUINO_PORT and RFID_PORT in config.txt to the --arduino-link / --rfid-link paths (defaults below).
+        2. python sessionReplay.py --profiles ../../AnimalProfiles/ --visits 1000 ...
+        3. Start main.py (with RECORDER_PATH=mockSessionVideo.py in config.txt) in another terminal. The replay starts once both
+           ports have been opened and the controller has had --settle seconds to start up.
+"""
+
+
+# One tag read. <t> is seconds from the start of the visit.
+Read = namedtuple("Read", ["t", "tag"])
+# One animal visit: breaks the beam at <start> (seconds from the start of the replay), stays <dwell> seconds.
+Visit = namedtuple("Visit", ["start", "dwell", "tag", "reads", "known"])
+
+
+# Builds the frame a reader sends for <tag>: STX, 10 hex data characters, 2 hex checksum characters (XOR of the
+# 5 data bytes), CR LF, ETX. If <tag> already has 12 characters its checksum is kept as is.
+def rfid_frame(tag):
+
+    tag = tag.upper()
+    if len(tag) == 10:
+        tag += rfid_checksum(tag)
+    return b"\x02" + tag.encode() + b"\r\n\x03"
+
+
+def rfid_checksum(data):
+
+    checksum = 0
+    for i in range(0, len(data), 2):
+        checksum ^= int(data[i:i + 2], 16)
+    return "{:02X}".format(checksum)
+
+
+def random_tag(rng):
+
+    return "".join(rng.choice("0123456789ABCDEF") for _ in range(10))
+
+
+# Reads from a recorded stream file, one read per line: "<seconds> <tag>", with seconds from the start of the
+# recording. Reads closer than <visitGap> seconds to the previous read belong to the same visit.
+def load_recorded_visits(path, knownTags, visitGap):
+
+    reads = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 2:
+                reads.append((float(fields[0]), fields[1]))
+    reads.sort()
+
+    visits = []
+    current = []
+    for t, tag in reads:
+        if current and (t - current[-1][0] > visitGap or tag != current[0][1]):
+            visits.append(current)
+            current = []
+        current.append((t, tag))
+    if current:
+        visits.append(current)
+
+    return [Visit(v[0][0], v[-1][0] - v[0][0] + visitGap / 2, v[0][1], [Read(t - v[0][0], tag) for t, tag in v],
+                  v[0][1] in knownTags) for v in visits]
+
+
+# Generates <n> visits. Each visit lasts <dwell> seconds (+-50%), the reader reports the tag every <readInterval>
+# seconds while it's in range and every so often sends a burst of <burst> back to back reads. <unknownRate> is the
+# fraction of visits made by tags that have no profile.
+def synthetic_visits(knownTags, n, dwell, gap, readInterval, burst, unknownRate, seed=0):
+
+    rng = random.Random(seed)
+    visits = []
+    start = 0.0
+    for _ in range(n):
+        known = rng.random() >= unknownRate or not knownTags
+        tag = rng.choice(knownTags) if known and knownTags else random_tag(rng)
+        visitDwell = dwell * rng.uniform(0.5, 1.5)
+
+        reads = []
+        t = 0.0
+        while t < visitDwell:
+            reads.append(Read(t, tag))
+            if rng.random() < 0.2:
+                reads.extend(Read(t + 0.002 * (i + 1), tag) for i in range(burst))
+            t += readInterval * rng.uniform(0.5, 1.5)
+
+        visits.append(Visit(start, visitDwell, tag, reads, known))
+        start += visitDwell + gap * rng.uniform(0.5, 1.5)
+
+    return visits
+
+
+class RFIDReaderPty(object):
+    """
+        Fake RFID reader on a pseudo-terminal. write() sends bytes to whoever opened <port>.
+    """
+
+    def __init__(self):
+
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        tty.setraw(slave)
+        os.close(slave)
+
+    def is_open(self):
+
+        poller = select.poll()
+        poller.register(self.master, select.POLLHUP)
+        return not any(event & select.POLLHUP for _, event in poller.poll(0))
+
+    def write(self, data):
+
+        try:
+            os.write(self.master, data)
+        except OSError:
+            pass
+
+    def close(self):
+
+        os.close(self.master)
+
+
+class SessionReplay(object):
+    """
+        Plays <visits> against a running main.py and collects the results. See the comment at the top of this file.
+    """
+
+    def __init__(self, visits, simulator, reader, timeScale=1.0):
+
+        self.visits = visits
+        self.simulator = simulator
+        self.reader = reader
+        self.timeScale = timeScale
+        self.visitTimes = []
+
+    def wait_for_client(self, settle, timeout=None):
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not (self.reader.is_open() and self.simulator.stats["opens"] > 0):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        time.sleep(settle)
+        return True
+
+    def run(self):
+
+        # Every read and beam change on one timeline, played in order.
+        timeline = []
+        for i, visit in enumerate(self.visits):
+            timeline.append((visit.start, 0, i, "enter"))
+            timeline.extend((visit.start + read.t, 1, i, read.tag) for read in visit.reads)
+            timeline.append((visit.start + visit.dwell, 2, i, "leave"))
+        timeline.sort()
+
+        origin = time.monotonic()
+        self.visitTimes = [None] * len(self.visits)
+        for t, kind, i, what in timeline:
+            delay = origin + t * self.timeScale - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            if kind == 0:
+                self.simulator.animal_enters()
+            elif kind == 1:
+                if self.visitTimes[i] is None:
+                    self.visitTimes[i] = time.monotonic()
+                self.reader.write(rfid_frame(what))
+            else:
+                self.simulator.animal_leaves()
+
+        # Give the controller time to finish the last session.
+        time.sleep(1)
+
+    # Matches the session starts / rejections the simulator saw against the visits.
+    def results(self):
+
+        starts = sorted(self.simulator.startTimes)
+        rejects = sorted(self.simulator.rejectTimes)
+        # A visit owns everything between its first read and the first read of the next visit.
+        firstReads = sorted(t for t in self.visitTimes if t is not None) + [float("inf")]
+
+        latencies = []
+        sessionsPerVisit = []
+        rejectsPerVisit = []
+        missed = 0
+        duplicates = 0
+        falseStarts = 0
+        for i, visit in enumerate(self.visits):
+            first = self.visitTimes[i]
+            if first is None:
+                continue
+            end = firstReads[bisect.bisect_right(firstReads, first)]
+            visitStarts = starts[bisect.bisect_left(starts, first):bisect.bisect_left(starts, end)]
+            visitRejects = rejects[bisect.bisect_left(rejects, first):bisect.bisect_left(rejects, end)]
+            sessionsPerVisit.append(len(visitStarts))
+            rejectsPerVisit.append(len(visitRejects))
+
+            if visit.known:
+                if not visitStarts:
+                    missed += 1
+                else:
+                    latencies.append(visitStarts[0] - first)
+                    duplicates += len(visitStarts) - 1
+            else:
+                falseStarts += len(visitStarts)
+
+        latencies.sort()
+        duration = firstReads[-2] - firstReads[0] if len(firstReads) > 2 else 0.0
+
+        return {
+            "visits": len(self.visits),
+            "known_visits": sum(1 for v in self.visits if v.known),
+            "reads": sum(len(v.reads) for v in self.visits),
+            "visits_per_minute": 60.0 * len(self.visits) / duration if duration > 0 else None,
+            "sessions_started": len(starts),
+            "missed_visits": missed,
+            "duplicate_sessions": duplicates,
+            "sessions_for_unknown_tags": falseStarts,
+            "rejections": len(rejects),
+            "max_sessions_per_visit": max(sessionsPerVisit) if sessionsPerVisit else 0,
+            "max_rejections_per_visit": max(rejectsPerVisit) if rejectsPerVisit else 0,
+            "latency_s": {
+                "mean": sum(latencies) / len(latencies) if latencies else None,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1] if latencies else None,
+            },
+        }
+
+
+def percentile(sortedValues, p):
+
+    if not sortedValues:
+        return None
+    return sortedValues[min(len(sortedValues) - 1, int(round(p / 100.0 * (len(sortedValues) - 1))))]
+
+
+def load_profile_tags(profileDirectory):
+
+    tags = []
+    for name in sorted(os.listdir(profileDirectory)):
+        saveFile = os.path.join(profileDirectory, name, name + "_save.txt")
+        if os.path.isfile(saveFile):
+            with open(saveFile) as f:
+                tags.append(f.readline().strip())
+    return tags
+
+
+def link(path, target):
+
+    if os.path.islink(path):
+        os.remove(path)
+    os.symlink(target, path)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Replay RFID visits against main.py and measure session start latency.")
+    parser.add_argument("--profiles", default="../../AnimalProfiles/", help="Profiles whose tags count as known.")
+    parser.add_argument("--tags", nargs="*", help="Known tags to use instead of the ones in --profiles.")
+    parser.add_argument("--recorded", help="Replay a recorded stream (lines of '<seconds> <tag>') instead.")
+    parser.add_argument("--visits", type=int, default=100)
+    parser.add_argument("--dwell", type=float, default=20.0, help="Mean seconds an animal stays per visit.")
+    parser.add_argument("--gap", type=float, default=10.0, help="Mean seconds between visits.")
+    parser.add_argument("--read-interval", type=float, default=0.1, help="Mean seconds between reads while in range.")
+    parser.add_argument("--burst", type=int, default=5, help="Number of reads in a duplicate burst.")
+    parser.add_argument("--unknown-rate", type=float, default=0.05, help="Fraction of visits by unknown tags.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="Multiplier applied to visit timing and Arduino latencies (0.01 = 100x faster).")
+    parser.add_argument("--arduino-link", default="/tmp/homecage_arduino")
+    parser.add_argument("--rfid-link", default="/tmp/homecage_rfid")
+    parser.add_argument("--settle", type=float, default=5.0, help="Seconds to let main.py start up before replaying.")
+    parser.add_argument("--output", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    knownTags = args.tags if args.tags else load_profile_tags(args.profiles)
+    if args.recorded:
+        visits = load_recorded_visits(args.recorded, set(knownTags), visitGap=1.0)
+    else:
+        visits = synthetic_visits(knownTags, args.visits, args.dwell, args.gap, args.read_interval, args.burst,
+                                  args.unknown_rate, args.seed)
+
+    simulator = arduinoSimulator.ArduinoSimulator(timeScale=args.time_scale)
+    reader = RFIDReaderPty()
+    link(args.arduino_link, simulator.port)
+    link(args.rfid_link, reader.port)
+    simulator.start()
+
+    replay = SessionReplay(visits, simulator, reader, args.time_scale)
+    try:
+        print("Arduino on " + args.arduino_link + ", RFID reader on " + args.rfid_link + ". Waiting for main.py...")
+        replay.wait_for_client(args.settle)
+        print("Replaying " + str(len(visits)) + " visits...")
+        replay.run()
+    except KeyboardInterrupt:
+        print("Interrupted, reporting partial results")
+    finally:
+        simulator.stop()
+        os.remove(args.arduino_link)
+        os.remove(args.rfid_link)
+
+    results = replay.results()
+    json.dump(results, sys.stdout, indent=4)
+    print()
+    print(simulator.report())
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
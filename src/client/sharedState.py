@@ -0,0 +1,122 @@
+"""
+    Author: Julian Pitney
+    Email: JulianPitney@gmail.com
+    Organization: University of Ottawa (Silasi Lab)
+"""
+
+
+import threading
+import time
+
+
+class SharedState(object):
+    """
+        Per-mouse settings shared between the SessionController process and the configuration GUI process.
+        Both processes read and write this object directly instead of passing changes through the config and save
+        files, so a change made in the GUI is visible to the controller as soon as it's made (even mid-session)
+        and neither side ever parses a half-written file.
+
+        The state lives in a multiprocessing.Manager, so this object can be handed to the GUI process as an argument.
+        Every write bumps <version>, which lets readers check whether anything changed with one cheap call.
+
+        Attributes:
+            settings: Manager dict mapping mouse number (str) -> dict with any of the keys name, trial_limit,
+                      difficulty_dist_mm and dominant_hand.
+            version: Manager Value incremented on every write.
+            lock: Manager Lock held for every write and for consistent snapshots.
+    """
+
+    def __init__(self, manager):
+
+        self.settings = manager.dict()
+        self.version = manager.Value('i', 0)
+        self.lock = manager.Lock()
+
+    # Updates the given fields for <mouseNumber>, e.g update("1", dominant_hand="LEFT").
+    def update(self, mouseNumber, **fields):
+
+        with self.lock:
+            entry = dict(self.settings.get(str(mouseNumber), {}))
+            entry.update(fields)
+            self.settings[str(mouseNumber)] = entry
+            self.version.value += 1
+
+    # Returns a copy of the settings for <mouseNumber> (empty if the mouse is unknown).
+    def get(self, mouseNumber):
+
+        return dict(self.settings.get(str(mouseNumber), {}))
+
+    def get_version(self):
+
+        return self.version.value
+
+    # Returns (version, settings) read atomically with respect to writers.
+    def snapshot(self):
+
+        with self.lock:
+            return self.version.value, dict((k, dict(v)) for k, v in self.settings.items())
+
+
+class StatePersister(threading.Thread):
+    """
+        Background thread that writes SharedState to disk, so neither the GUI nor a running session ever waits
+        on file I/O for a settings change. Writes are debounced: once the version counter changes, the thread waits
+        until it has stayed the same for <interval> seconds (or <maxDelay> seconds have passed since the first unsaved
+        change) and then calls persist(snapshot, previousSnapshot) once. Clicking through a spinbox therefore costs a
+        single write of the final value.
+    """
+
+    def __init__(self, sharedState, persist, interval=0.5, maxDelay=5.0):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sharedState = sharedState
+        self.persist = persist
+        self.interval = interval
+        self.maxDelay = maxDelay
+        self.stopEvent = threading.Event()
+        self.persistedVersion, self.persistedSettings = sharedState.snapshot()
+        self.lastSeenVersion = self.persistedVersion
+        self.firstUnsavedTime = None
+
+    def run(self):
+
+        while not self.stopEvent.wait(self.interval):
+            version = self.sharedState.get_version()
+            if version == self.persistedVersion:
+                continue
+
+            now = time.time()
+            if self.firstUnsavedTime is None:
+                self.firstUnsavedTime = now
+
+            # Still changing, wait for it to settle unless it's been unsaved for too long.
+            if version != self.lastSeenVersion and now - self.firstUnsavedTime < self.maxDelay:
+                self.lastSeenVersion = version
+                continue
+
+            self.flush()
+
+    # Persists any unsaved changes right now.
+    def flush(self):
+
+        if self.sharedState.get_version() == self.persistedVersion:
+            return
+
+        version, settings = self.sharedState.snapshot()
+        self.lastSeenVersion = version
+        try:
+            self.persist(settings, self.persistedSettings)
+        except (IOError, OSError) as e:
+            # Keep the old snapshot so the write is retried on the next tick.
+            print("Could not persist settings: " + str(e))
+            return
+
+        self.persistedVersion, self.persistedSettings = version, settings
+        self.firstUnsavedTime = None
+
+    def stop(self):
+
+        self.stopEvent.set()
+        self.join()
+        self.flush()
@@ -20,8 +20,14 @@
 #include <opencv2/highgui.hpp>
 #include <opencv2/core.hpp>
 #include <opencv2/imgcodecs.hpp>
+#include <opencv2/imgproc.hpp>
 #include <stdlib.h>
 #include <chrono>
+#include <poll.h>
+#include <sys/mman.h>
+#include <fcntl.h>
+#include <cstring>
+#include <ctime>
 
 using namespace Spinnaker;
 using namespace Spinnaker::GenApi;
@@ -49,6 +55,7 @@ Input Args:
 	EXPOSURE = integer representing exposure time in microseconds
 	BITRATE = integer representing bitrate
 	PREVIEW_WINDOW = integer flag for turning preview window on or off (Note the preview window will significantly lower your max fps)
+	PELLET_ROI_PATH = (optional) path of the shared memory ring pellet ROI crops are written into, see Pellet ROI Ring below
 
 Note: In the HomeCage system, these args are supplied by the python client when it spawns this process for recording.
 
@@ -74,6 +81,30 @@ Note: The AcquireImages() function captures until it detects the existence of a
 	directory that this program is running from. In the HomeCage system this file is created and deleted by the python client.
 	Obviously, this is terrible way to handle IPC. Socket communication was in the works but never got finished.
 
+Standby Mode:
+
+	If the first argument is --standby instead of a video path, the program initializes the camera once and then
+	waits for commands on stdin instead of recording straight away. This keeps the (slow) Spinnaker system/camera
+	initialization out of the time between an RFID read and the start of recording. Commands are single lines:
+
+		START <FPS> <PREVIEW_WINDOW> <VIDEO_PATH>	Start recording a new video. Replies "RECORDER:RECORDING" once acquisition has begun.
+		STOP						Stop the current recording. Replies "RECORDER:STOPPED <frames recorded>".
+		QUIT						Deinitialize the camera and exit.
+
+	"RECORDER:READY" is printed once the camera is initialized and the program is waiting for its first command.
+	The KILL file still stops a recording in standby mode, the program just returns to waiting for the next START.
+
+Pellet ROI Ring:
+
+	If PELLET_ROI_PATH is given, every pelletClassifierFrameInterval-th recorded frame is resized to 224x224 and the
+	80x80 pellet area (rows 116-196, cols 56-136) is copied into a ring of ROI_RING_SLOTS slots in a file mapped
+	at that path (normally on /dev/shm). The python client's PelletService reads the crops from there and runs the
+	pellet classifier on them. The layout and the seqlock protocol are described in src/client/pelletRing.py.
+	Writing a crop is a memcpy, the recorder never waits on the reader.
+
+	The ring's header also holds the number of frames written to the current video, updated after every frame
+	(set_frames_recorded()). The client logs it as the frame each session event happened on.
+
 Note: The block in AcquireImages that displays spinnaker frames to an OpenCV window is explained in detail
 	on github under SilasiLab/Spinnaker-Utilities/ in the file displaySpinnakerFramesOpenCV.cpp
 
@@ -99,6 +130,34 @@ int ACTUAL_ACQUISITION_DURATION = 0;
 
 int pelletClassifierFrameInterval = 100;
 
+string PELLET_ROI_PATH = "";
+const uint32_t ROI_RING_MAGIC = 0x494f5250;
+const uint32_t ROI_RING_VERSION = 2;
+const uint32_t ROI_RING_SLOTS = 8;
+const int ROI_SIZE = 80;
+
+struct ROIRingHeader
+{
+	uint32_t magic;
+	uint32_t version;
+	uint32_t slotCount;
+	uint32_t width;
+	uint32_t height;
+	uint32_t reserved;
+	uint64_t writeCount;
+	uint64_t framesRecorded;
+};
+
+struct ROISlotHeader
+{
+	uint64_t seq;
+	uint64_t frameIndex;
+	uint64_t timestamp;
+};
+
+const size_t ROI_SLOT_SIZE = sizeof(ROISlotHeader) + ROI_SIZE * ROI_SIZE;
+unsigned char* roiRing = NULL;
+
 
 
 enum aviType
@@ -157,6 +216,49 @@ inline bool file_exists (const std::string& name) {
 }
 
 
+// Reads one line from stdin into <line> without blocking for longer than <timeoutMs> (-1 blocks until a line arrives).
+// Partial lines are buffered between calls. Returns false if no complete line is available yet, or if stdin was closed
+// (in which case <stdinClosed> is set so the caller can shut down).
+string stdinBuffer = "";
+bool stdinClosed = false;
+
+bool read_stdin_line(string &line, int timeoutMs) {
+
+	while(true)
+	{
+		size_t newline = stdinBuffer.find('\n');
+		if(newline != string::npos)
+		{
+			line = stdinBuffer.substr(0, newline);
+			stdinBuffer.erase(0, newline + 1);
+			return true;
+		}
+
+		if(stdinClosed)
+		{
+			return false;
+		}
+
+		struct pollfd stdinPoll;
+		stdinPoll.fd = STDIN_FILENO;
+		stdinPoll.events = POLLIN;
+		if(poll(&stdinPoll, 1, timeoutMs) <= 0)
+		{
+			return false;
+		}
+
+		char buf[256];
+		ssize_t n = read(STDIN_FILENO, buf, sizeof(buf));
+		if(n <= 0)
+		{
+			stdinClosed = true;
+			return false;
+		}
+		stdinBuffer.append(buf, n);
+	}
+}
+
+
 // This function configures the camera to use a trigger. First, trigger mode is
 // set to off in order to select the trigger source. Once the trigger source
 // has been selected, trigger mode is then enabled, which has the camera
@@ -331,7 +433,80 @@ int ResetTrigger(INodeMap & nodeMap)
 }
 
 
-int AcquireImages(CameraPtr pCam, INodeMap &nodeMap, INodeMap &nodeMapTLDevice, char *vidPath) {
+// Maps the pellet ROI ring at PELLET_ROI_PATH. The file is reused, not unlinked, so a reader that already has it
+// mapped keeps working across recorder restarts.
+bool open_roi_ring()
+{
+	size_t size = sizeof(ROIRingHeader) + ROI_RING_SLOTS * ROI_SLOT_SIZE;
+	int fd = open(PELLET_ROI_PATH.c_str(), O_RDWR | O_CREAT, 0644);
+	if(fd < 0 || ftruncate(fd, size) != 0)
+	{
+		cout << "Unable to open pellet ROI ring " << PELLET_ROI_PATH << endl;
+		if(fd >= 0)
+		{
+			close(fd);
+		}
+		return false;
+	}
+	void* buffer = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+	close(fd);
+	if(buffer == MAP_FAILED)
+	{
+		cout << "Unable to map pellet ROI ring " << PELLET_ROI_PATH << endl;
+		return false;
+	}
+
+	memset(buffer, 0, size);
+	ROIRingHeader* header = (ROIRingHeader*)buffer;
+	header->magic = ROI_RING_MAGIC;
+	header->version = ROI_RING_VERSION;
+	header->slotCount = ROI_RING_SLOTS;
+	header->width = ROI_SIZE;
+	header->height = ROI_SIZE;
+	roiRing = (unsigned char*)buffer;
+	return true;
+}
+
+
+// Publishes the number of frames written to the current video in the ROI ring's header.
+void set_frames_recorded(uint64_t frames)
+{
+	if(roiRing == NULL)
+	{
+		return;
+	}
+	__atomic_store_n(&((ROIRingHeader*)roiRing)->framesRecorded, frames, __ATOMIC_RELEASE);
+}
+
+// Copies the pellet area of <img> into the next slot of the ROI ring.
+void write_roi(Mat &img, int frameIndex)
+{
+	if(roiRing == NULL)
+	{
+		return;
+	}
+
+	Mat resized;
+	resize(img, resized, Size(224, 224));
+	Mat crop = resized(Rect(56, 116, ROI_SIZE, ROI_SIZE)).clone();
+
+	ROIRingHeader* header = (ROIRingHeader*)roiRing;
+	uint64_t count = header->writeCount;
+	ROISlotHeader* slot = (ROISlotHeader*)(roiRing + sizeof(ROIRingHeader) + (count % ROI_RING_SLOTS) * ROI_SLOT_SIZE);
+
+	struct timespec now;
+	clock_gettime(CLOCK_MONOTONIC, &now);
+	__atomic_store_n(&slot->seq, 2 * count + 1, __ATOMIC_RELEASE);
+	slot->frameIndex = frameIndex;
+	slot->timestamp = (uint64_t)now.tv_sec * ns_per_second + now.tv_nsec;
+	memcpy((unsigned char*)slot + sizeof(ROISlotHeader), crop.data, ROI_SIZE * ROI_SIZE);
+	__atomic_store_n(&slot->seq, 2 * count + 2, __ATOMIC_RELEASE);
+	__atomic_store_n(&header->writeCount, count + 1, __ATOMIC_RELEASE);
+}
+
+
+
+int AcquireImages(CameraPtr pCam, INodeMap &nodeMap, INodeMap &nodeMapTLDevice, const char *vidPath, bool standby) {
 
 int result = 0;
 
@@ -458,6 +633,11 @@ try
 	pCam->BeginAcquisition();
 
 	cout << "Acquiring images..." << endl;
+	set_frames_recorded(0);
+	if(standby)
+	{
+		cout << "RECORDER:RECORDING" << endl;
+	}
 
 	// Retrieve device serial number for filename
 	gcstring deviceSerialNumber("");
@@ -486,6 +666,15 @@ try
 			break;
         }
 
+		if(standby)
+		{
+			string cmd;
+			if((read_stdin_line(cmd, 0) && cmd == "STOP") || stdinClosed)
+			{
+				break;
+			}
+		}
+
 		try
 		{
 			ImagePtr pResultImage = pCam->GetNextImage();
@@ -497,7 +686,6 @@ try
 			}
 			else
 			{
-                pelletClassifierFrameCount++;
 				void* img_ptr = pResultImage->GetData();
 				Mat img(HEIGHT, WIDTH, CV_8UC1, img_ptr);
 
@@ -509,9 +697,9 @@ try
 		        else
 		        {
 
-		            if(pelletClassifierFrameCount > pelletClassifierFrameInterval)
+		            if(pelletClassifierFrameCount >= pelletClassifierFrameInterval || n_frames == 0)
 		            {
-		                imwrite("/home/sliasi/HomeCageSinglePellet/temp/pelletClassifierFatMouse.jpg", img);
+		                write_roi(img, n_frames);
 		                pelletClassifierFrameCount = 0;
 		            }
 
@@ -519,6 +707,7 @@ try
 				    aviRecorder.AVIAppend(pResultImage);
 				    pResultImage->Release();
 				    n_frames++;
+				    set_frames_recorded(n_frames);
 				    pelletClassifierFrameCount++;
 				}
 			}
@@ -541,6 +730,11 @@ try
 	// End acquisition
 	pCam->EndAcquisition();
 	aviRecorder.AVIClose();
+
+	if(standby)
+	{
+		cout << "RECORDER:STOPPED " << n_frames << endl;
+	}
 }
 catch (Spinnaker::Exception &e)
 {
@@ -564,6 +758,12 @@ int main(int argc, char** argv) {
     EXPOSURE = atoi(argv[7]);
     BITRATE = atoi(argv[8]);
     PREVIEW_WINDOW = atoi(argv[9]);
+    if(argc > 10)
+    {
+        PELLET_ROI_PATH = argv[10];
+    }
+
+	bool standby = (string(argv[1]) == "--standby");
 
 	cout << "PTGREY BOOTING...\n";
 
@@ -584,6 +784,12 @@ int main(int argc, char** argv) {
 		system->ReleaseInstance();
 
 		cout << "Not enough cameras!" << endl;
+		if(standby)
+		{
+			// Nobody is watching the terminal in standby mode, so don't wait for Enter.
+			cout << "RECORDER:FAILED" << endl;
+			return -1;
+		}
 		cout << "Done! Press Enter to exit..." << endl;
 		getchar();
 
@@ -592,6 +798,11 @@ int main(int argc, char** argv) {
 
 
 	initCameras(camList);
+	if(PELLET_ROI_PATH != "")
+	{
+		// Without the ring recording still works, the client just presents pellets on the timer alone.
+		open_roi_ring();
+	}
 	// Retrieve GenICam nodemap for each camera
 	INodeMap & nodeMap = camList.GetByIndex(0)->GetNodeMap();
 	// Retrieve TL device nodemap for each camera
@@ -599,7 +810,41 @@ int main(int argc, char** argv) {
 	// Configure Trigger for each camera
 	//ConfigureTrigger(nodeMap);
 	// Acquire
-	AcquireImages(camList.GetByIndex(0), nodeMap, nodeMapTLDevice, argv[1]);
+	if(!standby)
+	{
+		AcquireImages(camList.GetByIndex(0), nodeMap, nodeMapTLDevice, argv[1], false);
+	}
+	else
+	{
+		cout << "RECORDER:READY" << endl;
+
+		string cmd;
+		while(!stdinClosed)
+		{
+			if(!read_stdin_line(cmd, -1))
+			{
+				continue;
+			}
+
+			if(cmd.compare(0, 6, "START ") == 0)
+			{
+				// START <FPS> <PREVIEW_WINDOW> <VIDEO_PATH>. The path is last so it may contain spaces.
+				istringstream startArgs(cmd.substr(6));
+				string vidPath;
+				startArgs >> FPS >> PREVIEW_WINDOW;
+				getline(startArgs >> ws, vidPath);
+
+				if(AcquireImages(camList.GetByIndex(0), nodeMap, nodeMapTLDevice, vidPath.c_str(), true) != 0)
+				{
+					cout << "RECORDER:FAILED" << endl;
+				}
+			}
+			else if(cmd == "QUIT")
+			{
+				break;
+			}
+		}
+	}
 
 
 